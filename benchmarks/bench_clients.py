@@ -0,0 +1,140 @@
+"""
+Compare the wall time of multi-call commands when every call builds its own
+boto3 client against the shared client registry. Calls go to a local stub
+of the Batch and CloudWatch Logs APIs that answers after a fixed latency,
+so no AWS account is needed.
+
+    python benchmarks/bench_clients.py [jobs] [streams]
+"""
+
+import io
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+
+from red import batch, clients, logs
+
+# Round trip of the stubbed endpoint, roughly a same-region AWS call
+LATENCY = 0.005
+EVENTS_PER_STREAM = 300
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, don't let Nagle hold the body
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(LATENCY)
+        target = self.headers.get("X-Amz-Target", "")
+        if self.path == "/v1/submitjob":
+            job_id = str(uuid.uuid4())
+            response = {"jobId": job_id, "jobName": body["jobName"], "jobArn": job_id}
+        elif target.endswith("GetLogEvents"):
+            start = int(body.get("nextToken") or 0)
+            end = min(start + body.get("limit", 10000), EVENTS_PER_STREAM)
+            offset = int(body["logStreamName"].rsplit("/", 1)[-1])
+            response = {
+                "events": [
+                    {"timestamp": i * 1000 + offset, "message": f"event {i}"}
+                    for i in range(start, end)
+                ],
+                "nextForwardToken": str(end),
+            }
+        else:
+            self.send_error(400)
+            return
+        data = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.1")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class PerCallClient:
+    """
+    Builds a new boto3 client for every call, as each call did before the
+    shared registry.
+    """
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+        self.exceptions = boto3.client(service_name).exceptions
+
+    def __getattr__(self, operation):
+        def call(**params):
+            return getattr(boto3.client(self.service_name), operation)(**params)
+
+        return call
+
+
+def submit(jobs):
+    payloads = ({"ITEM": str(i)} for i in range(jobs))
+    for result in batch.submit_batch_jobs("bench", "q", "d", payloads, []):
+        assert result["jobId"], result
+
+
+def merge(streams):
+    labels = [(str(i), f"bench/default/{i}") for i in range(streams)]
+    with redirect_stdout(io.StringIO()):
+        logs.merge_logs("bench", labels, output_format="text")
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    streams = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+    os.environ.update(
+        AWS_ACCESS_KEY_ID="bench",
+        AWS_SECRET_ACCESS_KEY="bench",
+        AWS_DEFAULT_REGION="us-east-1",
+        AWS_ENDPOINT_URL_BATCH=endpoint,
+        AWS_ENDPOINT_URL_CLOUDWATCH_LOGS=endpoint,
+    )
+    # Load the service models once so neither side pays for it
+    for fn, size in ((submit, 1), (merge, 1)):
+        fn(size)
+    commands = [
+        (f"submit {jobs} jobs", submit, jobs, batch, "pooled_client"),
+        (f"merge {streams} streams", merge, streams, logs, "client"),
+    ]
+    for label, fn, size, module, name in commands:
+        shared_client = getattr(module, name)
+        clients.reset()
+        created = clients.clients_created()
+        shared = timed(fn, size)
+        created = clients.clients_created() - created
+        setattr(module, name, lambda service, *args: PerCallClient(service))
+        try:
+            per_call = timed(fn, size)
+        finally:
+            setattr(module, name, shared_client)
+        print(
+            f"{label:<18} per-call clients {per_call:>6.2f} s  "
+            f"shared {shared:>6.2f} s  ({created} clients created)"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
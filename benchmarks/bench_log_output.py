@@ -0,0 +1,48 @@
+"""
+Compare log output throughput of the Rich console path and the raw paths.
+
+    python benchmarks/bench_log_output.py [events]
+"""
+
+import io
+import os
+import sys
+import time
+
+from rich.console import Console
+
+from red import logs
+
+
+def make_events(count):
+    start = 1_700_000_000_000
+    return [
+        {
+            "timestamp": start + i * 7,
+            "message": f"[worker-{i % 8}] processed item {i} status=[ok] elapsed=0.{i % 1000:03d}s",
+        }
+        for i in range(count)
+    ]
+
+
+def bench(label, fn, count):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<6} {count / elapsed:>12,.0f} lines/s  ({elapsed:.3f}s)")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    events = make_events(count)
+    devnull = open(os.devnull, "w")
+
+    # Render through a Rich console the same way the default output does
+    logs.print = Console(file=io.StringIO(), width=120).print
+    bench("rich", lambda: logs.write_events(events, "rich"), count)
+    bench("text", lambda: logs.write_events(events, "text", out=devnull), count)
+    bench("jsonl", lambda: logs.write_events(events, "jsonl", out=devnull), count)
+
+
+if __name__ == "__main__":
+    main()
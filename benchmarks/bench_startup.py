@@ -0,0 +1,71 @@
+"""
+Measure CLI startup with python -X importtime and fail when it regresses.
+
+    python benchmarks/bench_startup.py [--budget-ms 200] [--runs 5]
+
+Exits non-zero if importing red.main exceeds the budget or pulls in one of
+the modules that must only load when a command needs it.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Modules that must not be imported just to build the CLI
+LAZY_MODULES = ["boto3", "botocore", "questionary", "sh", "rich.progress"]
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def run(args):
+    env = {**os.environ, "PYTHONPATH": SRC}
+    return subprocess.run(
+        [sys.executable, *args], env=env, capture_output=True, text=True
+    )
+
+
+def import_time_ms():
+    result = run(["-X", "importtime", "-c", "import red.main"])
+    for line in result.stderr.splitlines():
+        if line.rstrip().endswith("| red.main"):
+            return int(line.split("|")[1]) / 1000
+    raise RuntimeError(result.stderr)
+
+
+def help_wall_ms():
+    start = time.perf_counter()
+    run(["-m", "red.main", "--help"])
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=200)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    imports = statistics.median(import_time_ms() for _ in range(args.runs))
+    wall = statistics.median(help_wall_ms() for _ in range(args.runs))
+    loaded = run(
+        [
+            "-c",
+            "import sys, red.main; "
+            "loaded = lambda m: type(sys.modules.get(m)).__name__ "
+            "not in ('NoneType', '_LazyModule'); "
+            f"print(' '.join(m for m in {LAZY_MODULES!r} if loaded(m)))",
+        ]
+    ).stdout.split()
+
+    print(f"import red.main  {imports:>7.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"red --help       {wall:>7.1f} ms")
+    if loaded:
+        print(f"eagerly imported: {', '.join(loaded)}")
+    if imports > args.budget_ms or loaded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
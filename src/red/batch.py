@@ -1,18 +1,61 @@
+import base64
+import functools
+import hashlib
 import json
 import time
 import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
-import boto3
 from botocore.exceptions import ClientError
 
-from red.iam import create_batch_role
+from red import constants, staging, waiter
+from red.clients import client, pooled_client
+from red.iam import (
+    create_batch_role,
+    create_instance_profile,
+    delete_role,
+    put_inline_policy,
+)
 from red.utility import print
 
+MAX_ARRAY_SIZE = constants.MAX_ARRAY_SIZE
+# ECS rejects container overrides larger than 8 KiB
+MAX_OVERRIDES_BYTES = 8192
 
-def submit_batch_job(job_name, job_queue, job_definition, environment=None):
+
+def build_environment(job_environment, payload):
+    """
+    Combine job definition environment variables with payload overrides.
+    Payload values are converted to strings as required by Batch.
+    """
+    envs = [{"name": x.get("Name"), "value": x.get("Value")} for x in job_environment]
+    for k, v in payload.items():
+        if not isinstance(v, str):
+            v = json.dumps(v) if isinstance(v, (dict, list)) else str(v)
+        envs.append({"name": k, "value": v})
+    return envs
+
+
+def check_overrides_size(environment):
+    """
+    Raise ValueError when the environment overrides of a job are over the
+    ECS limit.
+    """
+    overrides = json.dumps({"environment": environment}, separators=(",", ":"))
+    size = len(overrides.encode())
+    if size > MAX_OVERRIDES_BYTES:
+        raise ValueError(
+            f"Job overrides are {size} bytes, over the {MAX_OVERRIDES_BYTES} byte "
+            "limit. Pass references (e.g. S3 keys) to large payload values instead"
+        )
+
+
+def submit_batch_job(
+    job_name, job_queue, job_definition, environment=None, array_size=None
+):
     try:
         # Create batch client
-        batch_client = boto3.client("batch")
+        batch_client = client("batch")
 
         # Prepare submission parameters
         submit_job_params = {
@@ -30,7 +73,12 @@ def submit_batch_job(job_name, job_queue, job_definition, environment=None):
         if container_overrides:
             submit_job_params["containerOverrides"] = container_overrides
 
+        # Submit as an array job, children get AWS_BATCH_JOB_ARRAY_INDEX
+        if array_size and array_size > 1:
+            submit_job_params["arrayProperties"] = {"size": array_size}
+
         # Submit the job
+        # Throttled submits are retried by the client's adaptive retry mode
         response = batch_client.submit_job(**submit_job_params)
 
         return {"jobId": response["jobId"], "jobName": response["jobName"]}
@@ -40,8 +88,153 @@ def submit_batch_job(job_name, job_queue, job_definition, environment=None):
         raise
 
 
+def submit_batch_jobs(
+    job_name, job_queue, job_definition, payloads, job_environment, concurrency=16
+):
+    """
+    Submit one job per payload from a bounded worker pool.
+    Payloads are consumed lazily so arbitrarily large inputs stream through.
+    Yields a result dict per payload in completion order.
+    """
+    batch_client = pooled_client("batch", concurrency)
+
+    def submit(payload):
+        submit_job_params = {
+            "jobName": job_name,
+            "jobQueue": job_queue,
+            "jobDefinition": job_definition,
+            "containerOverrides": {
+                "environment": build_environment(job_environment, payload)
+            },
+        }
+        try:
+            response = batch_client.submit_job(**submit_job_params)
+            return {"jobId": response["jobId"], "payload": payload}
+        except Exception as e:
+            return {"jobId": None, "payload": payload, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        try:
+            for payload in payloads:
+                # Keep a bounded number of submits in flight
+                if len(pending) >= concurrency * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(executor.submit(submit, payload))
+        except Exception:
+            # Report the jobs already in flight before a bad payload surfaces
+            for future in as_completed(pending):
+                yield future.result()
+            raise
+        for future in as_completed(pending):
+            yield future.result()
+
+
+TERMINAL_JOB_STATUSES = ("SUCCEEDED", "FAILED")
+DESCRIBE_JOBS_LIMIT = 100
+
+
+def _job_poll_interval(job, now):
+    # Poll fast around state changes, slow down for long running jobs
+    status = job.get("status")
+    if status == "STARTING":
+        return 1
+    if status in ("SUBMITTED", "PENDING"):
+        return 2
+    if status == "RUNNABLE":
+        return 3
+    if status == "RUNNING":
+        running_for = now - job.get("startedAt", now * 1000) / 1000
+        return min(30, max(2, running_for / 10))
+    return 5
+
+
+def wait_for_jobs(job_ids, every_poll=False, max_interval=None):
+    """
+    Track any number of jobs until they reach a terminal state.
+    Jobs that are due are described together, 100 per DescribeJobs call,
+    and each job is re-polled on an interval adapted to its state.
+    Yields (job, previous_status) every time a job changes status, or on
+    every poll with every_poll. max_interval caps the time between polls.
+    """
+    batch_client = client("batch")
+    statuses = {}
+    next_poll = {job_id: 0 for job_id in dict.fromkeys(job_ids)}
+    while next_poll:
+        now = time.time()
+        due = [job_id for job_id, at in next_poll.items() if at <= now]
+        for i in range(0, len(due), DESCRIBE_JOBS_LIMIT):
+            chunk = due[i : i + DESCRIBE_JOBS_LIMIT]
+            response = batch_client.describe_jobs(jobs=chunk)
+            found = {job["jobId"]: job for job in response["jobs"]}
+            for job_id in chunk:
+                job = found.get(job_id)
+                if not job:
+                    # Unknown or expired job ids are reported once and dropped
+                    del next_poll[job_id]
+                    yield {"jobId": job_id, "status": "NOT_FOUND"}, None
+                    continue
+                previous = statuses.get(job_id)
+                statuses[job_id] = job["status"]
+                if every_poll or job["status"] != previous:
+                    yield job, previous
+                if job["status"] in TERMINAL_JOB_STATUSES:
+                    del next_poll[job_id]
+                else:
+                    interval = _job_poll_interval(job, time.time())
+                    if max_interval:
+                        interval = min(interval, max_interval)
+                    next_poll[job_id] = time.time() + interval
+        if next_poll:
+            time.sleep(max(0, min(next_poll.values()) - time.time()))
+
+
+def describe_jobs(job_ids):
+    batch_client = client("batch")
+    jobs = []
+    for i in range(0, len(job_ids), DESCRIBE_JOBS_LIMIT):
+        response = batch_client.describe_jobs(jobs=job_ids[i : i + DESCRIBE_JOBS_LIMIT])
+        jobs.extend(response["jobs"])
+    return jobs
+
+
+def resolve_log_streams(job_ids):
+    """
+    Resolve jobs to (label, logStreamName) pairs. Array parents are expanded
+    into their children, labelled by array index, other jobs by their
+    position in job_ids.
+    """
+    jobs = {job["jobId"]: job for job in describe_jobs(job_ids)}
+    streams = []
+    for position, job_id in enumerate(job_ids):
+        job = jobs.get(job_id)
+        if not job:
+            continue
+        if "arrayProperties" not in job or "index" in job["arrayProperties"]:
+            log_stream_name = job.get("container", {}).get("logStreamName")
+            if log_stream_name:
+                streams.append((str(position), log_stream_name))
+            continue
+        # Children ids are <parent>:<index>, ListJobs without a status only
+        # returns the running ones
+        size = job["arrayProperties"]["size"]
+        child_ids = [f"{job_id}:{i}" for i in range(size)]
+        children = sorted(
+            describe_jobs(child_ids), key=lambda x: x["arrayProperties"]["index"]
+        )
+        for child in children:
+            log_stream_name = child.get("container", {}).get("logStreamName")
+            if log_stream_name:
+                streams.append(
+                    (str(child["arrayProperties"]["index"]), log_stream_name)
+                )
+    return streams
+
+
 def get_job_definition_environment_variables(job_definition_name=None):
-    batch_client = boto3.client("batch")
+    batch_client = client("batch")
 
     # Parameters for the API call
     params = {"status": "ACTIVE"}  # Only get active job definitions
@@ -87,18 +280,59 @@ def _deep_merge(base, override):
     return result
 
 
-def create_batch_environment(
-    function_name,
-    repo_uri,
-    config,
-    # role_arn, subnet_a, subnet_b, security_group_id, ecr_image, data_bucket
-):
-    batch_client = boto3.client("batch")
-    logs_client = boto3.client("logs")
+def _batch_resource_state(resource, state, deleted):
+    # Missing resources only count as done when waiting for removal
+    if resource is None:
+        return deleted or state == "DISABLED", "DELETED"
+    status = resource["status"]
+    if deleted:
+        return False, status
+    if status == "INVALID":
+        raise RuntimeError(f"{status}: {resource.get('statusReason')}")
+    return (
+        status == "VALID" and (state is None or resource["state"] == state),
+        f"{status} {resource['state']}",
+    )
+
+
+def wait_for_compute_environment(name, state=None, deleted=False):
+    batch_client = client("batch")
+
+    def check():
+        response = batch_client.describe_compute_environments(
+            computeEnvironments=[name]
+        )
+        envs = response["computeEnvironments"]
+        return _batch_resource_state(envs[0] if envs else None, state, deleted)
+
+    return waiter.wait_for(check, f"compute environment {name}")
+
+
+def wait_for_job_queue(name, state=None, deleted=False):
+    batch_client = client("batch")
+
+    def check():
+        queues = batch_client.describe_job_queues(jobQueues=[name])["jobQueues"]
+        return _batch_resource_state(queues[0] if queues else None, state, deleted)
+
+    return waiter.wait_for(check, f"job queue {name}")
+
+
+def ensure_batch_role(function_name, config):
     # Create MVP role if not one provided
     role = config.get("Role")
     if not role:
         role = create_batch_role(function_name, function_name, config.get("IamPolicy"))
+        if role:
+            # Lets get_shard read the input red map staged for the job
+            put_inline_policy(
+                function_name, "red-staging", staging.read_policy(function_name)
+            )
+    return role
+
+
+def ensure_log_group(function_name):
+    logs_client = client("logs")
     # Create Log Group if it doesn't exist
     log_group_name = function_name
 
@@ -115,302 +349,642 @@ def create_batch_environment(
         logs_client.create_log_group(
             logGroupName=log_group_name, tags={"Name": log_group_name}
         )
+    return log_group_name
+
+
+FARGATE_TYPES = ("FARGATE", "FARGATE_SPOT")
+EC2_TYPES = ("EC2", "SPOT")
+DEFAULT_ALLOCATION_STRATEGIES = {
+    "EC2": "BEST_FIT_PROGRESSIVE",
+    "SPOT": "SPOT_PRICE_CAPACITY_OPTIMIZED",
+}
+# Finds every compute environment of a project, whatever its name
+PROJECT_TAG = "red:project"
+# Set by red warm, deploys leave minvCpus alone while it is in the future
+WARM_TAG = "red:warm-until"
 
-    # Create Compute Environment if it doesn't exist
-    compute_env_name = function_name
 
-    # Check if Compute Environment exists
+def compute_environment_specs(function_name, config):
+    """
+    (name, spec) for each ComputeEnvironments entry of .red in queue order,
+    by default the single FARGATE environment named after the project.
+    """
+    specs = config.get("ComputeEnvironments") or [{"Type": "FARGATE", "MaxvCpus": 100}]
+    result = []
+    for spec in specs:
+        ce_type = spec.get("Type", "FARGATE").upper()
+        if ce_type not in FARGATE_TYPES + EC2_TYPES:
+            raise ValueError(f"Unknown compute environment type {ce_type}")
+        if spec.get("Name"):
+            ce_name = f"{function_name}-{spec['Name']}"
+        elif ce_type == "FARGATE":
+            # The name RED has always used for its single environment
+            ce_name = function_name
+        else:
+            ce_name = f"{function_name}-{ce_type.lower().replace('_', '-')}"
+        result.append((ce_name, {**spec, "Type": ce_type}))
+    names = [ce_name for ce_name, _ in result]
+    if len(set(names)) != len(names):
+        raise ValueError(
+            "Compute environment names must be unique, set Name on environments "
+            "of the same Type"
+        )
+    if len({spec["Type"] in FARGATE_TYPES for _, spec in result}) > 1:
+        raise ValueError(
+            "A job queue can't mix Fargate and EC2 compute environments, "
+            "use FARGATE/FARGATE_SPOT or EC2/SPOT"
+        )
+    return result
+
+
+def uses_ec2(function_name, config):
+    return compute_environment_specs(function_name, config)[0][1]["Type"] in EC2_TYPES
+
+
+def compute_resources(spec, config, instance_profile=None, launch_template=None):
+    vpc = config.get("VPC", {})
+    resources = {
+        "type": spec["Type"],
+        "maxvCpus": int(spec.get("MaxvCpus", 100)),
+        "subnets": spec.get("SubnetIds") or vpc.get("SubnetIds", []),
+        "securityGroupIds": spec.get("SecurityGroupIds")
+        or vpc.get("SecurityGroupIds", []),
+    }
+    if spec["Type"] in EC2_TYPES:
+        resources.update(
+            minvCpus=int(spec.get("MinvCpus", 0)),
+            instanceTypes=spec.get("InstanceTypes", ["optimal"]),
+            allocationStrategy=spec.get(
+                "AllocationStrategy", DEFAULT_ALLOCATION_STRATEGIES[spec["Type"]]
+            ),
+            instanceRole=instance_profile,
+        )
+        if "BidPercentage" in spec:
+            resources["bidPercentage"] = int(spec["BidPercentage"])
+        if "SpotIamFleetRole" in spec:
+            resources["spotIamFleetRole"] = spec["SpotIamFleetRole"]
+        if "DesiredvCpus" in spec:
+            resources["desiredvCpus"] = int(spec["DesiredvCpus"])
+        if launch_template and spec.get("PrePullImage", True):
+            resources["launchTemplate"] = {
+                "launchTemplateName": launch_template,
+                "version": "$Default",
+            }
+    return resources
+
+
+def warm_until(tags):
+    """
+    Epoch seconds a red warm lasts until from the compute environment's
+    tags, float("inf") for a warm without --for, None when not warm.
+    """
+    value = tags.get(WARM_TAG)
+    if value is None:
+        return None
+    until = float("inf") if value == "none" else float(value)
+    return until if until > time.time() else None
+
+
+def _resource_changes(current, resources):
+    changes = {}
+    for key, value in resources.items():
+        # Batch scales desiredvCpus itself and never lowers it on request
+        if key in ("type", "spotIamFleetRole", "desiredvCpus"):
+            continue
+        existing = current.get(key)
+        if isinstance(value, list):
+            existing, value = sorted(existing or []), sorted(value)
+        elif isinstance(value, dict):
+            existing = {k: (existing or {}).get(k) for k in value}
+        if existing != value:
+            changes[key] = resources[key]
+    return changes
+
+
+def _wait_for_new_compute_environment(
+    batch_client, compute_env_name, instance_profile, attempts=3
+):
+    """
+    Wait for a just created compute environment. EC2 can still miss a new
+    instance profile when Batch validates it, the environment then goes
+    INVALID until it's updated with the profile again.
+    """
+    for attempt in range(attempts):
+        try:
+            return wait_for_compute_environment(compute_env_name)
+        except RuntimeError as e:
+            if (
+                not instance_profile
+                or "profile" not in str(e).lower()
+                or attempt == attempts - 1
+            ):
+                raise
+            print(f"Retrying {compute_env_name} while its instance profile propagates")
+            time.sleep(10)
+            batch_client.update_compute_environment(
+                computeEnvironment=compute_env_name,
+                computeResources={"instanceRole": instance_profile},
+            )
+
+
+def ensure_compute_environment(
+    function_name,
+    compute_env_name,
+    spec,
+    role,
+    config,
+    instance_profile=None,
+    launch_template=None,
+):
+    """
+    Create the compute environment, or update an existing one in place when
+    its capacity, networking or instances differ from .red. minvCpus is left
+    alone while the environment is warmed by red warm.
+    """
+    batch_client = client("batch")
+    resources = compute_resources(spec, config, instance_profile, launch_template)
     describe_response = batch_client.describe_compute_environments(
         computeEnvironments=[compute_env_name]
     )
-    existing_compute_envs = [
-        env["computeEnvironmentName"]
-        for env in describe_response.get("computeEnvironments", [])
-    ]
+    existing = describe_response.get("computeEnvironments", [])
 
-    if compute_env_name not in existing_compute_envs:
+    if not existing:
         print(f"Creating Compute Environment: {compute_env_name}")
-        batch_client.create_compute_environment(
+        params = dict(
             computeEnvironmentName=compute_env_name,
             type="MANAGED",
             state="ENABLED",
-            serviceRole=role,
-            computeResources={
-                "type": "FARGATE",
-                "maxvCpus": 100,
-                "subnets": config.get("VPC", {}).get("SubnetIds", []),
-                "securityGroupIds": config.get("VPC", {}).get("SecurityGroupIds", []),
-            },
+            computeResources=resources,
+            tags={PROJECT_TAG: function_name},
         )
-
-        # Wait for compute environment to be ready
-        while True:
-            response = batch_client.describe_compute_environments(
-                computeEnvironments=[compute_env_name]
+        # EC2 environments use the Batch service-linked role, which allows
+        # changing their instances in place
+        if spec["Type"] in FARGATE_TYPES:
+            params["serviceRole"] = role
+
+        # An instance profile created in the same deploy takes a few seconds
+        # before Batch accepts it
+        def create():
+            try:
+                batch_client.create_compute_environment(**params)
+                return True, "CREATED"
+            except batch_client.exceptions.ClientException as e:
+                message = str(e).lower()
+                if "role" not in message and "profile" not in message:
+                    raise
+                return False, "INSTANCE PROFILE PROPAGATING"
+
+        waiter.wait_for(create, f"compute environment {compute_env_name}", timeout=120)
+        _wait_for_new_compute_environment(
+            batch_client, compute_env_name, instance_profile
+        )
+        return compute_env_name
+
+    current = existing[0]
+    current_type = current.get("computeResources", {}).get("type")
+    if current_type and current_type != resources["type"]:
+        if current_type not in EC2_TYPES or resources["type"] not in EC2_TYPES:
+            raise ValueError(
+                f"{compute_env_name} is {current_type}, can't change it to "
+                f"{resources['type']}. Rename the entry or run red kill first"
             )
-            status = response["computeEnvironments"][0]["status"]
-            if status == "VALID":
-                break
-            time.sleep(10)
+    if PROJECT_TAG not in current.get("tags", {}):
+        batch_client.tag_resource(
+            resourceArn=current["computeEnvironmentArn"],
+            tags={PROJECT_TAG: function_name},
+        )
+    changes = _resource_changes(current.get("computeResources", {}), resources)
+    if current_type and current_type != resources["type"]:
+        # EC2 and SPOT switch in place with an infrastructure update
+        changes["type"] = resources["type"]
+    if "minvCpus" in changes and warm_until(current.get("tags", {})):
+        del changes["minvCpus"]
+    if changes or current["state"] != "ENABLED":
+        print(
+            f"Updating Compute Environment: {compute_env_name} ({', '.join(changes)})"
+        )
+        params = dict(computeEnvironment=compute_env_name, state="ENABLED")
+        if changes:
+            params["computeResources"] = changes
+        batch_client.update_compute_environment(**params)
+        wait_for_compute_environment(compute_env_name, state="ENABLED")
     else:
-        print(f"Compute Environment already exists: {compute_env_name}")
+        print(f"Compute Environment up to date: {compute_env_name}")
+    return compute_env_name
+
+
+def ensure_compute_environments(
+    function_name, role, config, instance_profile=None, launch_template=None
+):
+    """
+    Ensure every compute environment of .red concurrently, returns their
+    names in queue order.
+    """
+    return waiter.wait_all(
+        *[
+            functools.partial(
+                ensure_compute_environment,
+                function_name,
+                compute_env_name,
+                spec,
+                role,
+                config,
+                instance_profile,
+                launch_template,
+            )
+            for compute_env_name, spec in compute_environment_specs(
+                function_name, config
+            )
+        ]
+    )
+
+
+def launch_template_name(function_name):
+    return f"{function_name}-red"
+
+
+def ensure_launch_template(function_name, repo_uri):
+    """
+    Create the EC2 launch template that pre-pulls the job image on new
+    instances, or point its default version at changed user data. Returns
+    the template name.
+    """
+    ec2_client = client("ec2")
+    name = launch_template_name(function_name)
+    registry = repo_uri.split("/")[0]
+    user_data = constants.PREPULL_USER_DATA.format(
+        # <account>.dkr.ecr.<region>.amazonaws.com
+        region=registry.split(".")[3],
+        registry=registry,
+        image=f"{repo_uri}:latest",
+    )
+    data = {"UserData": base64.b64encode(user_data.encode()).decode()}
+    try:
+        current = ec2_client.describe_launch_template_versions(
+            LaunchTemplateName=name, Versions=["$Default"]
+        )["LaunchTemplateVersions"][0]
+    except ClientError as e:
+        if "NotFound" not in e.response["Error"]["Code"]:
+            raise
+        print(f"Creating Launch Template: {name}")
+        ec2_client.create_launch_template(
+            LaunchTemplateName=name, LaunchTemplateData=data
+        )
+        return name
+    if current["LaunchTemplateData"].get("UserData") != data["UserData"]:
+        print(f"Updating Launch Template: {name}")
+        version = ec2_client.create_launch_template_version(
+            LaunchTemplateName=name, LaunchTemplateData=data
+        )["LaunchTemplateVersion"]["VersionNumber"]
+        ec2_client.modify_launch_template(
+            LaunchTemplateName=name, DefaultVersion=str(version)
+        )
+    return name
 
+
+def delete_launch_template(function_name):
+    ec2_client = client("ec2")
+    name = launch_template_name(function_name)
+    try:
+        print(f"Deleting Launch Template: {name}")
+        ec2_client.delete_launch_template(LaunchTemplateName=name)
+    except TEARDOWN_ERRORS:
+        print("Skipping Launch Template")
+
+
+def project_compute_environments(function_name):
+    """
+    Names of the project's compute environments, found by tag, including the
+    untagged one environments created before tagging used.
+    """
+    batch_client = client("batch")
+    names = []
+    paginator = batch_client.get_paginator("describe_compute_environments")
+    for page in paginator.paginate():
+        for env in page["computeEnvironments"]:
+            name = env["computeEnvironmentName"]
+            if name == function_name or env.get("tags", {}).get(PROJECT_TAG) == (
+                function_name
+            ):
+                names.append(name)
+    return names
+
+
+def ensure_job_queue(function_name, compute_env_names):
+    batch_client = client("batch")
     # Create Job Queue if it doesn't exist
     job_queue_name = function_name
+    compute_environment_order = [
+        {"order": index + 1, "computeEnvironment": compute_env_name}
+        for index, compute_env_name in enumerate(compute_env_names)
+    ]
 
     # Check if Job Queue exists
     describe_response = batch_client.describe_job_queues(jobQueues=[job_queue_name])
-    existing_job_queues = [
-        queue["jobQueueName"] for queue in describe_response.get("jobQueues", [])
-    ]
+    existing_job_queues = describe_response.get("jobQueues", [])
 
-    if job_queue_name not in existing_job_queues:
+    if not existing_job_queues:
         print(f"Creating Job Queue: {job_queue_name}")
         batch_client.create_job_queue(
             jobQueueName=job_queue_name,
             state="ENABLED",
             priority=1,
-            computeEnvironmentOrder=[
-                {"order": 1, "computeEnvironment": compute_env_name}
-            ],
+            computeEnvironmentOrder=compute_environment_order,
         )
 
         # Wait for job queue to be ready
-        while True:
-            response = batch_client.describe_job_queues(jobQueues=[job_queue_name])
-            status = response["jobQueues"][0]["status"]
-            if status == "VALID":
-                break
-            time.sleep(10)
-
+        wait_for_job_queue(job_queue_name)
+        return job_queue_name
+
+    # The queue reports environment ARNs, compare by name
+    current_order = [
+        {
+            "order": x["order"],
+            "computeEnvironment": x["computeEnvironment"].split("/")[-1],
+        }
+        for x in sorted(
+            existing_job_queues[0]["computeEnvironmentOrder"],
+            key=lambda x: x["order"],
+        )
+    ]
+    if current_order != compute_environment_order:
+        print(f"Updating Job Queue: {job_queue_name}")
+        batch_client.update_job_queue(
+            jobQueue=job_queue_name,
+            state="ENABLED",
+            computeEnvironmentOrder=compute_environment_order,
+        )
+        wait_for_job_queue(job_queue_name, state="ENABLED")
+        unused = set(project_compute_environments(function_name)) - set(
+            compute_env_names
+        )
+        for compute_env_name in sorted(unused):
+            print(
+                f"Compute Environment {compute_env_name} is no longer in .red, "
+                "red kill deletes it"
+            )
     else:
         print(f"Job Queue already exists: {job_queue_name}")
+    return job_queue_name
 
-    # Create Job Definition if it doesn't exist
-    job_def_name = function_name
 
-    # Check if Job Definition exists
-    describe_response = batch_client.describe_job_definitions(
-        jobDefinitionName=job_def_name
-    )
-    # deregister old job def
-    for job in describe_response.get("jobDefinitions", []):
-        if job.get("status") != "INACTIVE":
-            response = batch_client.deregister_job_definition(
-                jobDefinition=job.get("jobDefinitionArn")
-            )
-    existing_job_defs = [
-        def_.get("jobDefinitionArn")
-        for def_ in describe_response.get("jobDefinitions", [])
-    ]
+JOB_DEFINITION_HASH_TAG = "red:config-hash"
 
-    if job_def_name not in existing_job_defs:
-        print(f"Creating Job Definition: {job_def_name}")
-        runtime = {}
-        if config.get("Arch") == "arm64":
-            runtime = {
-                "runtimePlatform": {
-                    "cpuArchitecture": "ARM64",
-                    "operatingSystemFamily": "LINUX",
-                },
-            }
-        sts_client = boto3.client("sts")
-        account_id = sts_client.get_caller_identity()["Account"]
-        # Build default container properties
-        default_container_properties = {
-            "ephemeralStorage": {"sizeInGiB": config.get("StorageSize")},
-            "enableExecuteCommand": True,
-            "image": repo_uri,
-            "jobRoleArn": role,
-            "executionRoleArn": role,
-            "fargatePlatformConfiguration": {"platformVersion": "LATEST"},
-            "networkConfiguration": {
-                "assignPublicIp": config.get("assignPublicIp", "DISABLED")
-            },
-            "resourceRequirements": [
-                {"type": "VCPU", "value": str(config.get("Cpu"))},
-                {"type": "MEMORY", "value": str(config.get("MemorySize"))},
-            ],
-            "logConfiguration": {
-                "logDriver": "awslogs",
-                "options": {
-                    "awslogs-group": log_group_name,
-                    "awslogs-region": batch_client.meta.region_name,
-                    "awslogs-stream-prefix": job_def_name,
-                },
+
+def _account_id(repo_uri):
+    # ECR repo uris start with the account id, avoiding an STS call
+    account_id = repo_uri.split(".")[0]
+    if account_id.isdigit():
+        return account_id
+    return client("sts").get_caller_identity()["Account"]
+
+
+def job_definition_params(function_name, repo_uri, role, log_group_name, config):
+    """
+    Final register_job_definition parameters, after merging ContainerProperties.
+    """
+    batch_client = client("batch")
+    job_def_name = function_name
+    runtime = {}
+    if config.get("Arch") == "arm64":
+        runtime = {
+            "runtimePlatform": {
+                "cpuArchitecture": "ARM64",
+                "operatingSystemFamily": "LINUX",
             },
-            "environment": [
-                {"name": k, "value": str(v)}
-                for k, v in config.get("Env", {}).items()
-                if not (isinstance(v, str) and v.startswith("ssmParam::"))
-            ],
-            "secrets": [
-                {
-                    "name": k,
-                    "valueFrom": f"arn:aws:ssm:{batch_client.meta.region_name}:{account_id}:parameter/{v[10:].lstrip('/')}",
-                }
-                for k, v in config.get("Env", {}).items()
-                if isinstance(v, str) and v.startswith("ssmParam::")
-            ],
-            **runtime,
         }
+    account_id = _account_id(repo_uri)
+    ec2 = uses_ec2(function_name, config)
+    cpu = config.get("Cpu")
+    if ec2:
+        # EC2 jobs take whole vCPUs and have no Fargate platform settings
+        runtime = {}
+        cpu = max(1, round(float(cpu)))
+    # Build default container properties
+    default_container_properties = {
+        "ephemeralStorage": {"sizeInGiB": config.get("StorageSize")},
+        "enableExecuteCommand": True,
+        "image": repo_uri,
+        "jobRoleArn": role,
+        "executionRoleArn": role,
+        "fargatePlatformConfiguration": {"platformVersion": "LATEST"},
+        "networkConfiguration": {
+            "assignPublicIp": config.get("assignPublicIp", "DISABLED")
+        },
+        "resourceRequirements": [
+            {"type": "VCPU", "value": str(cpu)},
+            {"type": "MEMORY", "value": str(config.get("MemorySize"))},
+        ],
+        "logConfiguration": {
+            "logDriver": "awslogs",
+            "options": {
+                "awslogs-group": log_group_name,
+                "awslogs-region": batch_client.meta.region_name,
+                "awslogs-stream-prefix": job_def_name,
+            },
+        },
+        "environment": [
+            {"name": k, "value": str(v)}
+            for k, v in config.get("Env", {}).items()
+            if not (isinstance(v, str) and v.startswith("ssmParam::"))
+        ],
+        "secrets": [
+            {
+                "name": k,
+                "valueFrom": f"arn:aws:ssm:{batch_client.meta.region_name}:{account_id}:parameter/{v[10:].lstrip('/')}",
+            }
+            for k, v in config.get("Env", {}).items()
+            if isinstance(v, str) and v.startswith("ssmParam::")
+        ],
+        **runtime,
+    }
 
-        # Merge with any containerProperties from config
-        config_container_props = config.get("ContainerProperties", {})
-        final_container_properties = _deep_merge(
-            default_container_properties, config_container_props
-        )
+    if ec2:
+        for key in (
+            "ephemeralStorage",
+            "fargatePlatformConfiguration",
+            "networkConfiguration",
+        ):
+            default_container_properties.pop(key)
 
-        job_arn = batch_client.register_job_definition(
-            jobDefinitionName=job_def_name,
-            type="container",
-            platformCapabilities=["FARGATE"],
-            timeout={"attemptDurationSeconds": config.get("Timeout", 10000)},
-            retryStrategy={"attempts": 1},
-            propagateTags=True,
-            containerProperties=final_container_properties,
-        )["jobDefinitionArn"]
-
-        # Wait for job definition to be registered
-        while True:
-            response = batch_client.describe_job_definitions(jobDefinitions=[job_arn])
-            status = response["jobDefinitions"][0].get("status", "")
-            if status == "ACTIVE":
-                break
-            time.sleep(10)
+    # Merge with any containerProperties from config
+    config_container_props = config.get("ContainerProperties", {})
+    final_container_properties = _deep_merge(
+        default_container_properties, config_container_props
+    )
+    return {
+        "jobDefinitionName": job_def_name,
+        "type": "container",
+        "platformCapabilities": ["EC2" if ec2 else "FARGATE"],
+        "timeout": {"attemptDurationSeconds": config.get("Timeout", 10000)},
+        "retryStrategy": {"attempts": 1},
+        "propagateTags": True,
+        "containerProperties": final_container_properties,
+    }
 
-    else:
-        print(f"Job Definition already exists: {job_def_name}")
 
+def job_definition_hash(params):
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def register_job_definition(function_name, repo_uri, role, log_group_name, config):
+    batch_client = client("batch")
+    job_def_name = function_name
+    params = job_definition_params(
+        function_name, repo_uri, role, log_group_name, config
+    )
+    config_hash = job_definition_hash(params)
+
+    # Skip registration when the active revision already matches
+    describe_response = batch_client.describe_job_definitions(
+        jobDefinitionName=job_def_name, status="ACTIVE"
+    )
+    active_job_defs = describe_response.get("jobDefinitions", [])
+    if any(
+        job.get("tags", {}).get(JOB_DEFINITION_HASH_TAG) == config_hash
+        for job in active_job_defs
+    ):
+        print(f"Job Definition up to date: {job_def_name}")
+        return job_def_name
+
+    print(f"Creating Job Definition: {job_def_name}")
+    job_arn = batch_client.register_job_definition(
+        **params, tags={JOB_DEFINITION_HASH_TAG: config_hash}
+    )["jobDefinitionArn"]
+
+    # Wait for job definition to be registered
+    def job_definition_active():
+        response = batch_client.describe_job_definitions(jobDefinitions=[job_arn])
+        definitions = response["jobDefinitions"]
+        status = definitions[0].get("status", "") if definitions else "PENDING"
+        return status == "ACTIVE", status
+
+    waiter.wait_for(job_definition_active, f"job definition {job_def_name}")
+
+    # deregister old job defs once the new revision is active
+    for job in active_job_defs:
+        batch_client.deregister_job_definition(
+            jobDefinition=job.get("jobDefinitionArn")
+        )
+    return job_def_name
+
+
+def create_batch_environment(
+    function_name,
+    repo_uri,
+    config,
+    # role_arn, subnet_a, subnet_b, security_group_id, ecr_image, data_bucket
+):
+    role = ensure_batch_role(function_name, config)
+    log_group_name = ensure_log_group(function_name)
+    instance_profile = config.get("InstanceRole")
+    launch_template = None
+    if uses_ec2(function_name, config):
+        if not instance_profile:
+            instance_profile = create_instance_profile(f"{function_name}_instance")
+        launch_template = ensure_launch_template(function_name, repo_uri)
+    compute_env_names = ensure_compute_environments(
+        function_name, role, config, instance_profile, launch_template
+    )
+    job_queue_name = ensure_job_queue(function_name, compute_env_names)
+    job_def_name = register_job_definition(
+        function_name, repo_uri, role, log_group_name, config
+    )
     return {
-        "compute_environment": compute_env_name,
+        "compute_environment": compute_env_names[0],
         "job_queue": job_queue_name,
         "job_definition": job_def_name,
     }
 
 
-def delete_batch_environment(name):
-    batch_client = boto3.client("batch")
-    logs_client = boto3.client("logs")
+# Errors a teardown step reports and carries on after, so one leftover
+# resource doesn't stop the rest from being deleted
+TEARDOWN_ERRORS = (ClientError, RuntimeError, TimeoutError)
 
-    # 1. Disable Job Queue
+
+def disable_job_queue(name):
     try:
         print(f"Disabling job queue: {name}")
-        batch_client.update_job_queue(jobQueue=name, state="DISABLED")
-
-        # Wait for job queue to be disabled
-        while True:
-            response = batch_client.describe_job_queues(jobQueues=[name])
-            if not response["jobQueues"]:
-                break
-            status = response["jobQueues"][0]["status"]
-            state = response["jobQueues"][0]["state"]
-            if status == "VALID" and state == "DISABLED":
-                break
-            time.sleep(10)
+        client("batch").update_job_queue(jobQueue=name, state="DISABLED")
+        wait_for_job_queue(name, state="DISABLED")
+    except TEARDOWN_ERRORS:
+        print("Skipping job queue")
 
-    except:
-        ...
 
-    # 2. Delete Job Queue
+def delete_job_queue(name, wait=True):
     try:
         print(f"Deleting job queue: {name}")
-        batch_client.delete_job_queue(jobQueue=name)
-
-        # Wait for job queue to be deleted
-        while True:
-            response = batch_client.describe_job_queues(jobQueues=[name])
-            if not response["jobQueues"]:
-                break
-            time.sleep(10)
+        client("batch").delete_job_queue(jobQueue=name)
+        if wait:
+            wait_for_job_queue(name, deleted=True)
+    except TEARDOWN_ERRORS:
+        print("Skipping job queue")
 
-    except:
-        print(f"Skipping Job Queue")
 
-    # 3. Disable Compute Environment
+def disable_compute_environment(name):
     try:
         print(f"Disabling compute environment: {name}")
-        batch_client.update_compute_environment(
+        client("batch").update_compute_environment(
             computeEnvironment=name, state="DISABLED"
         )
+        wait_for_compute_environment(name, state="DISABLED")
+    except TEARDOWN_ERRORS:
+        print("Skipping compute environment")
 
-        # Wait for compute environment to be disabled
-        while True:
-            response = batch_client.describe_compute_environments(
-                computeEnvironments=[name]
-            )
-            if not response["computeEnvironments"]:
-                break
-            status = response["computeEnvironments"][0]["status"]
-            state = response["computeEnvironments"][0]["state"]
-            if status == "VALID" and state == "DISABLED":
-                break
-            time.sleep(10)
-
-    except:
-        ...
 
-    # 4. Delete Compute Environment
+def delete_compute_environment(name, wait=True):
     try:
         print(f"Deleting compute environment: {name}")
-        batch_client.delete_compute_environment(computeEnvironment=name)
-
-        # Wait for compute environment to be deleted
-        while True:
-            response = batch_client.describe_compute_environments(
-                computeEnvironments=[name]
-            )
-            if not response["computeEnvironments"]:
-                break
-            time.sleep(10)
+        client("batch").delete_compute_environment(computeEnvironment=name)
+        if wait:
+            wait_for_compute_environment(name, deleted=True)
+    except TEARDOWN_ERRORS:
+        print("Skipping compute environment")
 
-    except:
-        print(f"Skipping Compute Environment")
 
-    # 5. Deregister Job Definition
+def deregister_job_definitions(name):
+    batch_client = client("batch")
     try:
         print(f"Deregistering job definition: {name}")
-        response = batch_client.describe_job_definitions(
-            jobDefinitionName=name, status="ACTIVE"
-        )
-
-        for job_def in response["jobDefinitions"]:
-            batch_client.deregister_job_definition(
-                jobDefinition=job_def["jobDefinitionArn"]
-            )
+        paginator = batch_client.get_paginator("describe_job_definitions")
+        for page in paginator.paginate(jobDefinitionName=name, status="ACTIVE"):
+            for job_def in page["jobDefinitions"]:
+                batch_client.deregister_job_definition(
+                    jobDefinition=job_def["jobDefinitionArn"]
+                )
+    except TEARDOWN_ERRORS:
+        print("Skipping job definition")
 
-    except:
-        print(f"Skipping Job Definition")
 
-    # 6. Delete Log Group
+def delete_log_group(name):
+    logs_client = client("logs")
     try:
         print(f"Deleting log group: {name}")
         logs_client.delete_log_group(logGroupName=name)
-    except Exception as e:
-        print(f"Skipping Log Group")
-    # Delete IAM role
-    iam_client = boto3.client("iam")
+    except TEARDOWN_ERRORS:
+        print("Skipping log group")
+
+
+def delete_batch_role(name):
     try:
-        try:
-            # Detach all policies from the role
-            attached_policies = iam_client.list_attached_role_policies(RoleName=name)[
-                "AttachedPolicies"
-            ]
-            for policy in attached_policies:
-                iam_client.detach_role_policy(
-                    RoleName=name, PolicyArn=policy["PolicyArn"]
-                )
-                time.sleep(5)
-                try:
-                    iam_client.delete_policy(PolicyArn=policy["PolicyArn"])
-                except:
-                    ...
-            iam_client.delete_role(RoleName=name)
-        except:
-            ...
         print(f"Deleting IAM role: {name}")
-        time.sleep(5)
-    except:
+        delete_role(name)
+    except TEARDOWN_ERRORS:
         traceback.print_exc()
-        print(f"Couldn't delete IAM role")
+        print("Couldn't delete IAM role")
+
+
+def delete_batch_environment(name):
+    """
+    Delete every Batch resource one after another. red kill runs the same
+    steps concurrently as a graph.
+    """
+    disable_job_queue(name)
+    delete_job_queue(name)
+    disable_compute_environment(name)
+    delete_compute_environment(name)
+    deregister_job_definitions(name)
+    delete_log_group(name)
+    delete_batch_role(name)
     print("All batch environment resources have been deleted successfully")
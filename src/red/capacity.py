@@ -0,0 +1,212 @@
+import json
+import math
+import statistics
+import time
+from datetime import datetime, timezone
+
+from red import batch, schedule
+from red.clients import client
+from red.utility import print
+
+
+def warm_compute_environment(function_name, config):
+    """
+    The (name, spec) of the first EC2 or SPOT compute environment in queue
+    order, the one jobs are placed on first.
+    """
+    for compute_env_name, spec in batch.compute_environment_specs(
+        function_name, config
+    ):
+        if spec["Type"] in batch.EC2_TYPES:
+            return compute_env_name, spec
+    raise ValueError(
+        "red warm needs an EC2 or SPOT entry in ComputeEnvironments, Fargate "
+        "has no capacity to keep running"
+    )
+
+
+def _warm_until(value):
+    return math.inf if value == "none" else int(value)
+
+
+def _tag_changes(compute_env_arn, since):
+    """
+    (epoch seconds, warm until) of every change CloudTrail recorded to the
+    warm tag of a compute environment since since, warm until None for a
+    cool and inf for a warm without an end.
+    """
+    paginator = client("cloudtrail").get_paginator("lookup_events")
+    changes = []
+    for event_name in ("TagResource", "UntagResource"):
+        pages = paginator.paginate(
+            LookupAttributes=[
+                {"AttributeKey": "EventName", "AttributeValue": event_name}
+            ],
+            StartTime=datetime.fromtimestamp(since, timezone.utc),
+        )
+        for page in pages:
+            for event in page["Events"]:
+                detail = json.loads(event["CloudTrailEvent"])
+                params = detail.get("requestParameters") or {}
+                if (
+                    detail.get("eventSource") != "batch.amazonaws.com"
+                    or params.get("resourceArn") != compute_env_arn
+                ):
+                    continue
+                at = event["EventTime"].timestamp()
+                if event_name == "UntagResource":
+                    if batch.WARM_TAG in (params.get("tagKeys") or []):
+                        changes.append((at, None))
+                    continue
+                until = (params.get("tags") or {}).get(batch.WARM_TAG)
+                if until is not None:
+                    changes.append((at, _warm_until(until)))
+    return sorted(changes, key=lambda x: x[0])
+
+
+def warm_windows(changes, since, tagged_until=None):
+    """
+    [start, end] epoch seconds of the warms a list of tag changes describes,
+    end inf for a warm that hasn't ended. A warm started before since counts
+    from since when the first change is a cool, or without any change when
+    the compute environment is still tagged warm until tagged_until.
+    """
+    windows = []
+    if changes and changes[0][1] is None:
+        windows.append([since, math.inf])
+    elif not changes and tagged_until is not None:
+        windows.append([since, tagged_until])
+    for at, until in changes:
+        if windows and windows[-1][1] > at:
+            windows[-1][1] = at
+        if until is not None:
+            windows.append([at, until])
+    return windows
+
+
+def warm(function_name, config, vcpus, duration=None):
+    """
+    Keep vcpus running in the project's EC2 compute environment, for duration
+    seconds when given. Returns the compute environment name.
+    """
+    batch_client = client("batch")
+    compute_env_name, spec = warm_compute_environment(function_name, config)
+    max_vcpus = int(spec.get("MaxvCpus", 100))
+    if vcpus > max_vcpus:
+        raise ValueError(f"{compute_env_name} is limited to {max_vcpus} vCPUs")
+    envs = batch_client.describe_compute_environments(
+        computeEnvironments=[compute_env_name]
+    )["computeEnvironments"]
+    if not envs:
+        raise LookupError(f"{compute_env_name} not found, run red deploy first")
+    current = envs[0]
+
+    now = time.time()
+    until = now + duration if duration else None
+    # Tag first so a deploy running meanwhile doesn't reset minvCpus
+    batch_client.tag_resource(
+        resourceArn=current["computeEnvironmentArn"],
+        tags={batch.WARM_TAG: str(int(until)) if until else "none"},
+    )
+    resources = {"minvCpus": vcpus}
+    # desiredvCpus can only be raised, Batch scales it down by itself
+    if vcpus >= current["computeResources"].get("desiredvCpus", 0):
+        resources["desiredvCpus"] = vcpus
+    print(f"Warming {compute_env_name} to {vcpus} vCPUs")
+    batch_client.update_compute_environment(
+        computeEnvironment=compute_env_name, computeResources=resources
+    )
+    batch.wait_for_compute_environment(compute_env_name)
+
+    min_vcpus = int(spec.get("MinvCpus", 0))
+    if until:
+        schedule.schedule_cool_down(
+            function_name,
+            compute_env_name,
+            min_vcpus,
+            datetime.fromtimestamp(until, timezone.utc),
+        )
+    else:
+        schedule.delete_cool_down(function_name, compute_env_name)
+    return compute_env_name
+
+
+def cool(function_name, config):
+    """
+    Scale the warmed compute environment back to the MinvCpus of .red and
+    cancel its scheduled cool down. Returns the compute environment name.
+    """
+    batch_client = client("batch")
+    compute_env_name, spec = warm_compute_environment(function_name, config)
+    envs = batch_client.describe_compute_environments(
+        computeEnvironments=[compute_env_name]
+    )["computeEnvironments"]
+    if not envs:
+        raise LookupError(f"{compute_env_name} not found, run red deploy first")
+    min_vcpus = int(spec.get("MinvCpus", 0))
+    print(f"Cooling {compute_env_name} to {min_vcpus} vCPUs")
+    batch_client.update_compute_environment(
+        computeEnvironment=compute_env_name,
+        computeResources={"minvCpus": min_vcpus},
+    )
+    batch_client.untag_resource(
+        resourceArn=envs[0]["computeEnvironmentArn"], tagKeys=[batch.WARM_TAG]
+    )
+    schedule.delete_cool_down(function_name, compute_env_name)
+    batch.wait_for_compute_environment(compute_env_name)
+    return compute_env_name
+
+
+def queue_latencies(function_name, config, since):
+    """
+    Seconds from submission to start of the queue's jobs created after since
+    (epoch milliseconds), split by whether they were submitted while warmed
+    by red warm, as CloudTrail recorded it. Array jobs count once, by their
+    first child to start.
+    """
+    batch_client = client("batch")
+    windows = []
+    try:
+        compute_env_name, _ = warm_compute_environment(function_name, config)
+    except ValueError:
+        # Without an EC2 compute environment nothing was ever warmed
+        compute_env_name = None
+    if compute_env_name:
+        envs = batch_client.describe_compute_environments(
+            computeEnvironments=[compute_env_name]
+        )["computeEnvironments"]
+        if envs:
+            changes = _tag_changes(envs[0]["computeEnvironmentArn"], since / 1000)
+            tagged = (envs[0].get("tags") or {}).get(batch.WARM_TAG)
+            tagged_until = _warm_until(tagged) if tagged else None
+            windows = warm_windows(changes, since / 1000, tagged_until)
+    latencies = {"warm": [], "cold": []}
+    paginator = batch_client.get_paginator("list_jobs")
+    pages = paginator.paginate(
+        jobQueue=function_name,
+        filters=[{"name": "AFTER_CREATED_AT", "values": [str(since)]}],
+    )
+    for page in pages:
+        for job in page["jobSummaryList"]:
+            if not job.get("startedAt"):
+                continue
+            created = job["createdAt"] / 1000
+            latency = (job["startedAt"] - job["createdAt"]) / 1000
+            warm = any(start <= created < end for start, end in windows)
+            latencies["warm" if warm else "cold"].append(latency)
+    return latencies
+
+
+def latency_summary(latencies):
+    """
+    Count, p50, p90 and max of a list of latencies, None without any.
+    """
+    if not latencies:
+        return None
+    latencies = sorted(latencies)
+    if len(latencies) > 1:
+        deciles = statistics.quantiles(latencies, n=10, method="inclusive")
+        p50, p90 = deciles[4], deciles[8]
+    else:
+        p50 = p90 = latencies[0]
+    return {"count": len(latencies), "p50": p50, "p90": p90, "max": latencies[-1]}
@@ -0,0 +1,73 @@
+import json
+import threading
+
+# Sized for the concurrent submit, log and deploy workers sharing a client
+MAX_POOL_CONNECTIONS = 64
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+_created = 0
+
+
+def _client_config(**overrides):
+    from botocore.config import Config
+
+    settings = dict(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        retries={"max_attempts": 10, "mode": "adaptive"},
+        tcp_keepalive=True,
+    )
+    settings.update(overrides)
+    return Config(**settings)
+
+
+def client(service_name, region_name=None, **config):
+    """
+    Return the shared client for a service, creating it on first use.
+    Clients are thread safe once created, creation is guarded by a lock
+    because boto3 sessions are not. Extra keyword arguments override the
+    botocore Config and get a client of their own.
+    """
+    global _session, _created
+    key = (service_name, region_name, json.dumps(config, sort_keys=True))
+    service_client = _clients.get(key)
+    if service_client is not None:
+        return service_client
+    with _lock:
+        service_client = _clients.get(key)
+        if service_client is None:
+            if _session is None:
+                # boto3 is imported on first use to keep CLI startup fast
+                import boto3.session
+
+                _session = boto3.session.Session()
+            service_client = _session.client(
+                service_name, region_name=region_name, config=_client_config(**config)
+            )
+            _clients[key] = service_client
+            _created += 1
+    return service_client
+
+
+def pooled_client(service_name, concurrency, region_name=None):
+    """
+    The shared client when its connection pool covers concurrency, else a
+    client with a pool sized for it.
+    """
+    if concurrency <= MAX_POOL_CONNECTIONS:
+        return client(service_name, region_name)
+    return client(service_name, region_name, max_pool_connections=concurrency)
+
+
+def clients_created():
+    """Number of clients created in this process."""
+    return _created
+
+
+def reset():
+    """Drop every cached client and the session, e.g. after changing profile."""
+    global _session
+    with _lock:
+        _clients.clear()
+        _session = None
@@ -1,15 +1,104 @@
 BATCH_DOCKERFILE = """FROM python:3.13
+RUN pip install --no-cache-dir boto3
 COPY . .
 ENTRYPOINT [ "python", "main.py" ]
 """
 
-BATCH_PYTHON = """def handler():
+BATCH_PYTHON = """import json
+import os
+
+
+def get_shard():
+    \"\"\"Return the items of the input list assigned to this array child.\"\"\"
+    if "RED_MAP_KEY" not in os.environ:
+        return []
+    import boto3
+
+    s3 = boto3.client("s3", region_name=os.environ["RED_MAP_REGION"])
+    index = int(os.environ.get("AWS_BATCH_JOB_ARRAY_INDEX", 0))
+
+    def read(start, end):
+        return s3.get_object(
+            Bucket=os.environ["RED_MAP_BUCKET"],
+            Key=os.environ["RED_MAP_KEY"],
+            Range=f"bytes={start}-{end - 1}",
+        )["Body"].read()
+
+    # The staged input starts with the offset of every shard, 16 digits each
+    offsets = read(16 * index, 16 * (index + 2))
+    return json.loads(read(int(offsets[:16]), int(offsets[16:])))
+
+
+def handler():
     print("hello world")
 
 if __name__ == "__main__":
     handler()
 """
 
+MAX_ARRAY_SIZE = 10000
+
+# Reused across Lambda packaging runs, pip downloads wheels for the target
+# platform so one builder image serves every architecture
+LAMBDA_BUILDER_IMAGE = "red-lambda-builder:1"
+LAMBDA_BUILDER_DOCKERFILE = """FROM amazonlinux:2023
+RUN yum install -y python3-pip && yum clean all
+"""
+
+# Lambda entry point packaged next to main.py, runs the same handler as Batch
+LAMBDA_HANDLER = """import json
+import os
+import runpy
+
+_secrets = json.loads(os.environ.pop("RED_SSM_PARAMS", "{}"))
+if _secrets:
+    import boto3
+
+    _ssm = boto3.client("ssm")
+    for _name, _arn in _secrets.items():
+        _parameter = _ssm.get_parameter(Name=_arn, WithDecryption=True)
+        os.environ[_name] = _parameter["Parameter"]["Value"]
+
+
+def lambda_handler(event, context):
+    # Payload keys become environment variables, as they do for Batch jobs
+    environ = dict(os.environ)
+    try:
+        for key, value in (event or {}).items():
+            if not isinstance(value, str):
+                value = json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+            os.environ[key] = value
+        module = runpy.run_path("main.py", run_name="red_main")
+        if callable(module.get("handler")):
+            return module["handler"]()
+        runpy.run_path("main.py", run_name="__main__")
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+"""
+LAMBDA_HANDLER_FILE = "red_lambda.py"
+
+# EC2 launch template user data: keep pulled images on the instance and pull
+# the job image at boot, so the first job on a fresh instance doesn't wait
+# for it. Batch merges this MIME part with its own user data.
+PREPULL_USER_DATA = """MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="==RED=="
+
+--==RED==
+Content-Type: text/x-shellscript; charset="us-ascii"
+
+#!/bin/bash
+echo ECS_IMAGE_PULL_BEHAVIOR=prefer-cached >> /etc/ecs/ecs.config
+(
+  until docker info >/dev/null 2>&1; do sleep 1; done
+  command -v aws >/dev/null || yum install -y awscli
+  aws ecr get-login-password --region {region} | docker login --username AWS --password-stdin {registry}
+  docker pull {image}
+) >/var/log/red-prepull.log 2>&1 &
+
+--==RED==--
+"""
+
 SPECS = {
     "0.25": [512, 1024, 2048],
     "0.5": [1024, 2048, 3072, 4096],
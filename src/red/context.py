@@ -0,0 +1,307 @@
+import hashlib
+import heapq
+import json
+import os
+import re
+import stat
+import threading
+
+from red.utility import cache_dir, write_json
+
+FINGERPRINT_VERSION = "1"
+_stat_cache_lock = threading.Lock()
+
+
+def load_dockerignore(context):
+    """
+    Read .dockerignore patterns as (regex, negated) pairs in file order.
+    """
+    path = os.path.join(context, ".dockerignore")
+    if not os.path.exists(path):
+        return []
+    patterns = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:].strip()
+            line = os.path.normpath(line.strip("/")).replace(os.sep, "/")
+            if line in ("", "."):
+                continue
+            patterns.append((_pattern_to_regex(line), negated))
+    return patterns
+
+
+def _pattern_to_regex(pattern):
+    # Go filepath.Match syntax plus "**" for any number of directories
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**", i):
+            i += 2
+            if pattern.startswith("/", i):
+                i += 1
+                regex += "(?:.*/)?"
+            else:
+                regex += ".*"
+            continue
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                regex += "[" + pattern[i + 1 : end] + "]"
+                i = end
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    return re.compile(regex + "$")
+
+
+def is_excluded(rel_path, patterns):
+    """
+    Docker semantics: the last matching pattern wins, and a pattern matching
+    a parent directory matches everything below it.
+    """
+    parts = rel_path.split("/")
+    candidates = ["/".join(parts[: i + 1]) for i in range(len(parts))]
+    excluded = False
+    for regex, negated in patterns:
+        if any(regex.match(x) for x in candidates):
+            excluded = not negated
+    return excluded
+
+
+def walk_context(context, patterns=None):
+    """
+    Yield (relative path, absolute path, stat) for every file sent to the
+    docker daemon, in a stable order.
+    """
+    if patterns is None:
+        patterns = load_dockerignore(context)
+    has_negations = any(negated for _, negated in patterns)
+    for root, dirs, files in os.walk(context):
+        dirs.sort()
+        rel_root = os.path.relpath(root, context).replace(os.sep, "/")
+        rel_root = "" if rel_root == "." else rel_root + "/"
+        # Excluded directories can be skipped unless a "!" pattern re-includes
+        if not has_negations:
+            dirs[:] = [d for d in dirs if not is_excluded(rel_root + d, patterns)]
+        # Symlinked directories are sent as links, os.walk doesn't list them
+        links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+        for name in sorted(files + links):
+            rel_path = rel_root + name
+            if is_excluded(rel_path, patterns):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            yield rel_path, path, st
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_stat_cache(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def fingerprint(context, dockerfile, extra=None):
+    """
+    Fingerprint a build from the Dockerfile, every file in the build context
+    (honoring .dockerignore) and any extra build settings. File contents are
+    only hashed when their size, mtime or inode changed since the last run.
+    """
+    cache_path = os.path.join(cache_dir(), "stat-cache.json")
+    cache = _load_stat_cache(cache_path)
+    changed = False
+    digest = hashlib.sha256()
+    digest.update(f"v{FINGERPRINT_VERSION}\0".encode())
+    digest.update(json.dumps(extra or {}, sort_keys=True).encode() + b"\0")
+
+    def file_hash(path, st):
+        nonlocal changed
+        key = os.path.abspath(path)
+        signature = [st.st_size, st.st_mtime_ns, st.st_ino]
+        cached = cache.get(key)
+        if cached and cached[:3] == signature:
+            return cached[3]
+        file_digest = _hash_file(path)
+        cache[key] = [*signature, file_digest]
+        changed = True
+        return file_digest
+
+    digest.update(b"Dockerfile\0" + file_hash(dockerfile, os.stat(dockerfile)).encode())
+    for rel_path, path, st in walk_context(context):
+        if stat.S_ISLNK(st.st_mode):
+            content = "link:" + os.readlink(path)
+        elif stat.S_ISREG(st.st_mode):
+            content = file_hash(path, st)
+        else:
+            continue
+        executable = "x" if st.st_mode & stat.S_IXUSR else "-"
+        digest.update(f"{rel_path}\0{executable}\0{content}\0".encode())
+
+    if changed:
+        # Merge with entries written by concurrent fingerprints meanwhile
+        with _stat_cache_lock:
+            write_json(cache_path, {**_load_stat_cache(cache_path), **cache})
+    return digest.hexdigest()
+
+
+# Paths that rarely belong in an image, suggested for .dockerignore
+IGNORE_SUGGESTIONS = [
+    ".git",
+    ".venv",
+    "venv",
+    "env",
+    "node_modules",
+    "**/__pycache__",
+    "**/*.pyc",
+    ".mypy_cache",
+    ".pytest_cache",
+    ".ruff_cache",
+    ".tox",
+    ".DS_Store",
+    "*.egg-info",
+    "dist",
+    "build",
+]
+INSTALL_COMMANDS = ("pip install", "poetry install", "uv sync", "npm install", "npm ci")
+
+
+def dockerfile_instructions(dockerfile):
+    """
+    (instruction, arguments) pairs of a Dockerfile, continuation lines joined.
+    """
+    instructions = []
+    current = ""
+    with open(dockerfile, "r") as f:
+        for line in f:
+            stripped = line.strip()
+            if not current and (not stripped or stripped.startswith("#")):
+                continue
+            if stripped.endswith("\\"):
+                current += stripped[:-1] + " "
+                continue
+            current += stripped
+            parts = current.split()
+            instructions.append((parts[0].upper(), " ".join(parts[1:])))
+            current = ""
+    return instructions
+
+
+def cache_busting_layers(dockerfile, included):
+    """
+    Flag Dockerfile layers that are rebuilt more often than they need to be.
+    """
+    warnings = []
+    instructions = dockerfile_instructions(dockerfile)
+    for index, (instruction, args) in enumerate(instructions):
+        if instruction not in ("COPY", "ADD"):
+            continue
+        sources = [x for x in args.split() if not x.startswith("--")][:-1]
+        if not any(x in (".", "./", "*") for x in sources):
+            continue
+        later_installs = [
+            x
+            for x in instructions[index + 1 :]
+            if x[0] == "RUN" and any(cmd in x[1] for cmd in INSTALL_COMMANDS)
+        ]
+        if later_installs:
+            warnings.append(
+                f"Line '{instruction} {args}' copies the whole context before "
+                f"'RUN {later_installs[0][1]}', any source change reinstalls "
+                "dependencies. Copy the dependency files and install first."
+            )
+        if ".git" in included:
+            warnings.append(
+                f"Line '{instruction} {args}' copies .git, every commit busts "
+                "this layer and all layers after it."
+            )
+    return warnings
+
+
+def analyze_context(context, dockerfile, top=15):
+    """
+    Summarize what a build sends to the docker daemon.
+    """
+    patterns = load_dockerignore(context)
+    total_bytes = 0
+    file_count = 0
+    largest_files = []
+    directories = {}
+    for rel_path, path, st in walk_context(context, patterns):
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        total_bytes += st.st_size
+        file_count += 1
+        if len(largest_files) < top:
+            heapq.heappush(largest_files, (st.st_size, rel_path))
+        else:
+            heapq.heappushpop(largest_files, (st.st_size, rel_path))
+        parts = rel_path.split("/")[:-1]
+        for depth in range(1, min(len(parts), 2) + 1):
+            directory = "/".join(parts[:depth])
+            directories[directory] = directories.get(directory, 0) + st.st_size
+
+    included = set()
+    suggestions = []
+    for suggestion in IGNORE_SUGGESTIONS:
+        regex = _pattern_to_regex(suggestion)
+        present = [d for d in directories if regex.match(d)]
+        if present or os.path.exists(os.path.join(context, suggestion)):
+            if not is_excluded(suggestion.replace("**/", ""), patterns):
+                included.add(suggestion)
+                suggestions.append(suggestion)
+    # Large files that look like data rather than code
+    for size, rel_path in largest_files:
+        if size > 50 * 1024 * 1024:
+            suggestions.append(rel_path)
+
+    return {
+        "total_bytes": total_bytes,
+        "file_count": file_count,
+        "largest_files": sorted(largest_files, reverse=True),
+        "largest_directories": heapq.nlargest(
+            top, directories.items(), key=lambda x: x[1]
+        ),
+        "cache_warnings": cache_busting_layers(dockerfile, included),
+        "ignore_suggestions": suggestions,
+    }
+
+
+def suggested_dockerignore(context, suggestions):
+    existing = ""
+    path = os.path.join(context, ".dockerignore")
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            existing = f.read()
+    lines = [x for x in suggestions if x not in existing.splitlines()]
+    if not lines:
+        return existing
+    if existing and not existing.endswith("\n"):
+        existing += "\n"
+    return existing + "\n".join(lines) + "\n"
@@ -1,32 +1,89 @@
+import hashlib
+import json
 import os
+import shutil
+import stat
 import sys
+import threading
+import time
 import traceback
+import zipfile
 
 import sh
 
-from red.utility import catch_error, print
+from red import constants, ecr
+from red.context import fingerprint, walk_context
+from red.utility import cache_dir, catch_error, print, write_json
+
+# Log in again when the cached login has less than this many seconds left
+LOGIN_EXPIRY_MARGIN = 300
+
+
+def _login_cache_path():
+    return os.path.join(cache_dir(), "ecr-logins.json")
+
+
+def _docker_knows_registry(registry):
+    # docker login records the registry in auths even with a credential store
+    config_dir = os.environ.get("DOCKER_CONFIG") or os.path.join(
+        os.path.expanduser("~"), ".docker"
+    )
+    try:
+        with open(os.path.join(config_dir, "config.json"), "r") as f:
+            docker_config = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return registry in docker_config.get("auths", {}) or registry in docker_config.get(
+        "credHelpers", {}
+    )
+
+
+def _load_logins():
+    try:
+        with open(_login_cache_path(), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+_login_lock = threading.Lock()
 
 
 def login_to_ecr(account_ecr):
+    """
+    Log docker in to the ECR registry unless an earlier login is still valid.
+    Only the login expiry is cached, the password stays with docker.
+    """
+    # Concurrent deploys share one login
+    with _login_lock:
+        _login_to_ecr(account_ecr)
+
+
+def _login_to_ecr(account_ecr):
+    logins = _load_logins()
+    expires_at = logins.get(account_ecr, 0)
+    if expires_at - LOGIN_EXPIRY_MARGIN > time.time() and _docker_knows_registry(
+        account_ecr
+    ):
+        return
     try:
-        # Get ECR login password
-        ecr_password = sh.aws("ecr", "get-login-password").strip()
-        # Perform Docker login
-        docker_login = sh.docker.login(
-            "--username", "AWS", "--password-stdin", account_ecr, _in=ecr_password
+        password, expires_at = ecr.get_login_password()
+        sh.docker.login(
+            "--username", "AWS", "--password-stdin", account_ecr, _in=password
         )
         print("Docker login successful")
-
     except:
         catch_error("An error ocurred during Docker login")
+    logins[account_ecr] = expires_at
+    write_json(_login_cache_path(), logins)
 
 
-def build_image(uri, config, quiet=False):
+def build_image(uri, config, quiet=False, tags=("latest",)):
+    tag_args = [x for tag in tags for x in ("-t", f"{uri}:{tag}")]
     try:
         if quiet:
             sh.docker.build(
-                "-t",
-                f"{uri}:latest",
+                *tag_args,
                 "-f",
                 config.get("DockerfilePath", "Dockerfile"),
                 config.get("BuildContext", "."),
@@ -35,11 +92,10 @@ def build_image(uri, config, quiet=False):
             )
         else:
             sh.docker.build(
-                "-t",
-                f"{uri}:latest",
+                *tag_args,
                 "-f",
                 config.get("DockerfilePath", "Dockerfile"),
-                ".",
+                config.get("BuildContext", "."),
                 _out=sys.stdout,
                 _err=sys.stderr,
             )
@@ -48,12 +104,70 @@ def build_image(uri, config, quiet=False):
         catch_error("An error ocurred while building image")
 
 
-def push_image(uri, quiet=False):
+BUILDX_BUILDER = "red"
+PLATFORMS = {
+    "x86_64": "linux/amd64",
+    "amd64": "linux/amd64",
+    "arm64": "linux/arm64",
+    "aarch64": "linux/arm64",
+}
+
+
+_builder_lock = threading.Lock()
+
+
+def ensure_buildx_builder():
+    # The default docker driver can't export cache to a registry. Concurrent
+    # deploys would otherwise all see it missing and create it together
+    with _builder_lock:
+        try:
+            sh.docker.buildx.inspect(BUILDX_BUILDER, _out=None, _err=None)
+        except sh.ErrorReturnCode:
+            sh.docker.buildx.create(
+                "--name", BUILDX_BUILDER, "--driver", "docker-container", _out=None
+            )
+
+
+def buildx_build_and_push(uri, config, quiet=False, tags=("latest",)):
+    """
+    Build with buildx, importing and exporting the layer cache from a
+    registry tag, and push straight from the builder.
+    """
+    cache_ref = config.get("BuildCache") or f"{uri}:{ecr.BUILD_CACHE_TAG}"
+    platform = PLATFORMS.get(config.get("Arch", "x86_64"), "linux/amd64")
+    tag_args = [x for tag in tags for x in ("-t", f"{uri}:{tag}")]
     try:
-        if quiet:
-            sh.docker.push(f"{uri}:latest", _out=None, _err=None)
-        else:
-            sh.docker.push(f"{uri}:latest", _out=sys.stdout, _err=sys.stderr)
+        ensure_buildx_builder()
+        sh.docker.buildx.build(
+            "--builder",
+            BUILDX_BUILDER,
+            "--platform",
+            platform,
+            *tag_args,
+            "-f",
+            config.get("DockerfilePath", "Dockerfile"),
+            "--cache-from",
+            f"type=registry,ref={cache_ref}",
+            "--cache-to",
+            f"type=registry,ref={cache_ref},mode=max,image-manifest=true,oci-mediatypes=true",
+            "--provenance=false",
+            "--push",
+            config.get("BuildContext", "."),
+            _out=None if quiet else sys.stdout,
+            _err=None if quiet else sys.stderr,
+        )
+        print(f"Built and pushed docker image to ECR ({uri})")
+    except:
+        catch_error("An error ocurred while building image with buildx")
+
+
+def push_image(uri, quiet=False, tags=("latest",)):
+    try:
+        for tag in tags:
+            if quiet:
+                sh.docker.push(f"{uri}:{tag}", _out=None, _err=None)
+            else:
+                sh.docker.push(f"{uri}:{tag}", _out=sys.stdout, _err=sys.stderr)
         print(f"Pushed docker image to ECR ({uri})!\\n")
     except:
         catch_error("An error ocurred pushing image to ECR")
@@ -68,10 +182,36 @@ def pull_image(uri):
         sys.exit()
 
 
+def image_fingerprint(config):
+    dockerfile = config.get("DockerfilePath", "Dockerfile")
+    context = config.get("BuildContext", ".")
+    return (
+        ecr.IMAGE_TAG_PREFIX
+        + fingerprint(context, dockerfile, {"Arch": config.get("Arch", "x86_64")})[:32]
+    )
+
+
 def push_to_ecr(uri, account_ecr, config, quiet=False):
+    """
+    Build and push the image unless an image with the same build context
+    fingerprint is already in ECR. Returns the image reference by digest.
+    """
+    repository_name = uri.split("/", 1)[1]
+    tag = image_fingerprint(config)
+    digest = ecr.get_image_digest(repository_name, tag)
+    if digest:
+        print(f"Image unchanged, reusing {tag}")
+        return f"{uri}@{digest}"
     login_to_ecr(account_ecr)
-    build_image(uri, config, quiet=quiet)
-    push_image(uri, quiet=quiet)
+    tags = ("latest", tag)
+    if config.get("Builder", "docker") == "buildx":
+        # Keep the layer cache tag out of reach of the expiry rule
+        ecr.put_lifecycle_policy(repository_name)
+        buildx_build_and_push(uri, config, quiet=quiet, tags=tags)
+    else:
+        build_image(uri, config, quiet=quiet, tags=tags)
+        push_image(uri, quiet=quiet, tags=tags)
+    return f"{uri}@{ecr.get_image_digest(repository_name, tag)}"
 
 
 def pull_from_ecr(uri, account_ecr):
@@ -79,28 +219,168 @@ def pull_from_ecr(uri, account_ecr):
     pull_image(uri)
 
 
-def build_serverless_package(config):
+LAMBDA_PACKAGE = "lambda_package.zip"
+_dependency_locks = {}
+_dependency_locks_lock = threading.Lock()
+
+
+def ensure_lambda_builder():
+    try:
+        sh.docker.image.inspect(constants.LAMBDA_BUILDER_IMAGE, _out=None, _err=None)
+    except sh.ErrorReturnCode:
+        print("Building Lambda builder image")
+        sh.docker.build(
+            "-t",
+            constants.LAMBDA_BUILDER_IMAGE,
+            "-",
+            _in=constants.LAMBDA_BUILDER_DOCKERFILE,
+            _out=sys.stdout,
+            _err=sys.stderr,
+        )
+
+
+def lambda_dependencies(requirements, runtime, platform):
+    """
+    Install requirements for the Lambda platform into a cache directory keyed
+    on the requirements, runtime and platform, and zip them once. Returns the
+    path of the dependencies zip.
+    """
+    with open(requirements, "rb") as f:
+        key = hashlib.sha256(
+            f.read() + f"\0{runtime}\0{platform}".encode()
+        ).hexdigest()[:32]
+    # Projects with the same requirements install them once
+    with _dependency_locks_lock:
+        lock = _dependency_locks.setdefault(key, threading.Lock())
+    with lock:
+        return _install_dependencies(requirements, runtime, platform, key)
+
+
+def _install_dependencies(requirements, runtime, platform, key):
+    lambda_cache = os.path.join(cache_dir(), "lambda")
+    target = os.path.join(lambda_cache, "deps", key)
+    deps_zip = target + ".zip"
+    if os.path.exists(deps_zip):
+        return deps_zip
+    pip_cache = os.path.join(lambda_cache, "pip-cache")
+    os.makedirs(pip_cache, exist_ok=True)
+    shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(target)
+    ensure_lambda_builder()
+    print("Installing Lambda dependencies")
+    sh.docker.run(
+        "--rm",
+        "--user",
+        f"{os.getuid()}:{os.getgid()}",
+        "-e",
+        "PIP_CACHE_DIR=/pip-cache",
+        "-v",
+        f"{pip_cache}:/pip-cache",
+        "-v",
+        f"{target}:/deps",
+        "-v",
+        f"{os.path.abspath(requirements)}:/requirements.txt:ro",
+        constants.LAMBDA_BUILDER_IMAGE,
+        "pip",
+        "install",
+        "--platform",
+        platform,
+        "--target=/deps",
+        "--implementation",
+        "cp",
+        "--python-version",
+        runtime,
+        "--only-binary=:all:",
+        "--upgrade",
+        "-r",
+        "/requirements.txt",
+        _out=sys.stdout,
+        _err=sys.stderr,
+    )
+    tmp_zip = f"{deps_zip}.{os.getpid()}"
+    with zipfile.ZipFile(tmp_zip, "w", zipfile.ZIP_DEFLATED) as package:
+        for root, dirs, files in os.walk(target):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                package.write(path, os.path.relpath(path, target))
+    os.replace(tmp_zip, deps_zip)
+    shutil.rmtree(target, ignore_errors=True)
+    return deps_zip
+
+
+def build_serverless_package(config, extra_files=None):
+    """
+    Build lambda_package.zip from the cached dependencies zip plus the
+    project's source files. Nothing is rebuilt when neither changed since the
+    last package, and the dependencies are only zipped once per requirements.
+
+    :param extra_files: optional dict of archive name to file content
+    """
+    extra_files = extra_files or {}
     runtime = config.get("Runtime")
     platform = (
         "manylinux2014_x86_64"
-        if config.get("Arch") == "x86_64"
+        if config.get("Arch", "x86_64") == "x86_64"
         else "manylinux2014_aarch64"
     )
-    cwd = os.getcwd()
-    # Create docker command with proper argument handling
-    docker = sh.docker.bake(
-        "run", "-v", f"{cwd}:/working", "--rm", "amazonlinux:latest"
-    )
-    # Chain commands inside container
-    commands = f"""
-    cd /working
-    ls -lat
-    yum install pip zip -y &&
-    pip install --platform {platform} --target=. --implementation cp --python-version {runtime} --only-binary=:all: --upgrade -r ./requirements.txt &&
-    rm -f ../lambda_package.zip
-    rm -f ./lambda_package.zip
-    zip ../lambda_package.zip -r . &&
-    mv ../lambda_package.zip ./lambda_package.zip
-    """
-    # Execute the command
-    docker("/bin/bash", "-c", commands, _out=sys.stdout, _err=sys.stderr)
+    # The package holds the build context, the project directory by default
+    root = os.path.abspath(config.get("BuildContext", "."))
+    package_path = os.path.join(root, LAMBDA_PACKAGE)
+    requirements = os.path.join(root, "requirements.txt")
+    deps_zip = None
+    if os.path.exists(requirements):
+        try:
+            deps_zip = lambda_dependencies(requirements, runtime, platform)
+        except:
+            catch_error("An error ocurred while installing Lambda dependencies")
+
+    # The package and the project files that only configure the build stay
+    # out, .red can hold settings that aren't meant for the function
+    excluded = {LAMBDA_PACKAGE} | {
+        os.path.relpath(os.path.abspath(x), root).replace(os.sep, "/")
+        for x in (".red", config.get("DockerfilePath", "Dockerfile"))
+    }
+    sources = {
+        rel_path: (path, [st.st_size, st.st_mtime_ns, st.st_mode])
+        for rel_path, path, st in walk_context(root)
+        if stat.S_ISREG(st.st_mode) and rel_path not in excluded
+    }
+    manifest = {
+        "deps": deps_zip,
+        "files": {rel_path: signature for rel_path, (_, signature) in sources.items()},
+        "extra": {
+            name: hashlib.sha256(content.encode()).hexdigest()
+            for name, content in extra_files.items()
+        },
+    }
+    key = hashlib.sha256(root.encode()).hexdigest()[:16]
+    manifest_path = os.path.join(cache_dir(), "lambda", f"package-{key}.json")
+    try:
+        with open(manifest_path, "r") as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = None
+    if previous == manifest and os.path.exists(package_path):
+        print("Lambda package unchanged")
+        return package_path
+
+    # Start from the dependencies zip and only write the source files
+    tmp_package = f"{package_path}.{os.getpid()}"
+    if deps_zip:
+        shutil.copyfile(deps_zip, tmp_package)
+    with zipfile.ZipFile(
+        tmp_package, "a" if deps_zip else "w", zipfile.ZIP_DEFLATED
+    ) as package:
+        for rel_path, (path, _) in sorted(sources.items()):
+            package.write(path, rel_path)
+        for name, content in sorted(extra_files.items()):
+            # Lambda runs code as another user, keep it world readable
+            info = zipfile.ZipInfo(name, (1980, 1, 1, 0, 0, 0))
+            info.external_attr = 0o644 << 16
+            package.writestr(info, content, zipfile.ZIP_DEFLATED)
+    os.replace(tmp_package, package_path)
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    write_json(manifest_path, manifest)
+    print(f"Created {package_path}")
+    return package_path
@@ -1,15 +1,65 @@
+import base64
 import json
 import sys
-import time
 import traceback
 
-import boto3
-
+from red import waiter
+from red.clients import client
 from red.utility import print
 
+BUILD_CACHE_TAG = "buildcache"
+# Build fingerprint tags pushed next to latest
+IMAGE_TAG_PREFIX = "fp-"
+
+
+def put_lifecycle_policy(repository_name):
+    # No rule selects every tag: a tagStatus "any" rule counts the cache
+    # image, which could leave the build cache as the one image it keeps
+    lifecycle_policy = {
+        "rules": [
+            {
+                "rulePriority": 1,
+                "description": "Keep the buildx layer cache",
+                "selection": {
+                    "tagStatus": "tagged",
+                    "tagPrefixList": [BUILD_CACHE_TAG],
+                    "countType": "imageCountMoreThan",
+                    "countNumber": 1,
+                },
+                "action": {"type": "expire"},
+            },
+            {
+                "rulePriority": 2,
+                "description": "Keep only the latest image",
+                "selection": {
+                    "tagStatus": "tagged",
+                    "tagPrefixList": [IMAGE_TAG_PREFIX],
+                    "countType": "imageCountMoreThan",
+                    "countNumber": 1,
+                },
+                "action": {"type": "expire"},
+            },
+            {
+                "rulePriority": 3,
+                "description": "Expire replaced images and caches",
+                "selection": {
+                    "tagStatus": "untagged",
+                    "countType": "sinceImagePushed",
+                    "countUnit": "days",
+                    "countNumber": 1,
+                },
+                "action": {"type": "expire"},
+            },
+        ]
+    }
+    client("ecr").put_lifecycle_policy(
+        repositoryName=repository_name,
+        lifecyclePolicyText=json.dumps(lifecycle_policy),
+    )
+
 
 def create_ecr(repository_name):
-    ecr_client = boto3.client("ecr")
+    ecr_client = client("ecr")
     try:
         existing_repos = ecr_client.describe_repositories(
             repositoryNames=[repository_name],
@@ -18,25 +68,16 @@ def create_ecr(repository_name):
     except ecr_client.exceptions.RepositoryNotFoundException:
         try:
             response = ecr_client.create_repository(repositoryName=repository_name)
-            time.sleep(5)
-            lifecycle_policy = {
-                "rules": [
-                    {
-                        "rulePriority": 1,
-                        "description": "Keep only the latest image",
-                        "selection": {
-                            "tagStatus": "any",
-                            "countType": "imageCountMoreThan",
-                            "countNumber": 1,
-                        },
-                        "action": {"type": "expire"},
-                    }
-                ]
-            }
-            ecr_client.put_lifecycle_policy(
-                repositoryName=repository_name,
-                lifecyclePolicyText=json.dumps(lifecycle_policy),
-            )
+
+            def created():
+                try:
+                    ecr_client.describe_repositories(repositoryNames=[repository_name])
+                    return True, "CREATED"
+                except ecr_client.exceptions.RepositoryNotFoundException:
+                    return False, "CREATING"
+
+            waiter.wait_for(created, f"ECR repo {repository_name}", quiet=True)
+            put_lifecycle_policy(repository_name)
             print(
                 "ECR repo created: {}".format(response["repository"]["repositoryUri"])
             )
@@ -47,17 +88,35 @@ def create_ecr(repository_name):
 
 
 def delete_ecr_repo(function_name):
-    ecr_client = boto3.client("ecr")
+    ecr_client = client("ecr")
     try:
-        response = ecr_client.describe_images(repositoryName=function_name)
-        image_ids = [
-            {"imageDigest": image["imageDigest"]} for image in response["imageDetails"]
-        ]
-        if image_ids:
-            ecr_client.batch_delete_image(
-                repositoryName=function_name, imageIds=image_ids
-            )
-        ecr_client.delete_repository(repositoryName=function_name)
+        # force deletes the images with the repository, however many there are
+        ecr_client.delete_repository(repositoryName=function_name, force=True)
         print(f"Deleting ECR repository: {function_name}")
     except ecr_client.exceptions.RepositoryNotFoundException:
         print(f"ECR repository {function_name} not found")
+
+
+def get_image_digest(repository_name, tag):
+    """
+    Digest of the image with this tag, or None if the tag doesn't exist.
+    """
+    ecr_client = client("ecr")
+    try:
+        response = ecr_client.describe_images(
+            repositoryName=repository_name, imageIds=[{"imageTag": tag}]
+        )
+        return response["imageDetails"][0]["imageDigest"]
+    except ecr_client.exceptions.ImageNotFoundException:
+        return None
+
+
+def get_login_password():
+    """
+    Docker password for the account's ECR registry and when it expires
+    (epoch seconds), the boto3 equivalent of aws ecr get-login-password.
+    """
+    response = client("ecr").get_authorization_token()
+    data = response["authorizationData"][0]
+    _, password = base64.b64decode(data["authorizationToken"]).decode().split(":", 1)
+    return password, data["expiresAt"].timestamp()
@@ -0,0 +1,57 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def run_graph(steps, max_workers=8, on_update=None):
+    """
+    Run dependent steps concurrently, each as soon as its dependencies finish.
+
+    :param steps: dict of step name to (function, [dependency names]), each
+        function is called with a dict of its dependencies' results
+    :param on_update: optional callback receiving the names of running steps
+    :return: (results, timings) where timings maps a step name to its
+        (start, end) offsets in seconds from the start of the run
+    """
+    for name, (fn, deps) in steps.items():
+        missing = [x for x in deps if x not in steps]
+        if missing:
+            raise ValueError(f"Step {name} depends on unknown steps: {missing}")
+    results = {}
+    timings = {}
+    pending = dict(steps)
+    running = {}
+    start = time.monotonic()
+
+    def call(name, fn, inputs):
+        step_start = time.monotonic() - start
+        result = fn(inputs)
+        timings[name] = (step_start, time.monotonic() - start)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            ready = [
+                name
+                for name, (fn, deps) in pending.items()
+                if all(x in results for x in deps)
+            ]
+            for name in ready:
+                fn, deps = pending.pop(name)
+                inputs = {x: results[x] for x in deps}
+                running[executor.submit(call, name, fn, inputs)] = name
+            if not running:
+                raise ValueError(f"Steps have circular dependencies: {list(pending)}")
+            if on_update:
+                on_update(sorted(running.values()))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except BaseException:
+                    # Let running steps finish but don't start new ones
+                    pending.clear()
+                    for other in running:
+                        other.cancel()
+                    raise
+    return results, timings
@@ -1,8 +1,10 @@
+import functools
 import json
 
-import boto3
 from botocore.exceptions import ClientError
 
+from red import waiter
+from red.clients import client
 from red.utility import print
 
 
@@ -22,7 +24,7 @@ def create_role(
     :param custom_policy_document: The policy document as a dictionary
     :return: The ARN of the role, or None if the operation failed
     """
-    iam = boto3.client("iam")
+    iam = client("iam")
 
     # Define the trust policy for Lambda
 
@@ -118,6 +120,14 @@ def create_role(
         return None
 
 
+def put_inline_policy(role_name, policy_name, policy_document):
+    client("iam").put_role_policy(
+        RoleName=role_name,
+        PolicyName=policy_name,
+        PolicyDocument=json.dumps(policy_document),
+    )
+
+
 def create_batch_role(role_name, custom_policy_name, custom_policy_document):
     """
     Create an IAM role for a Lambda function with a custom policy.
@@ -155,3 +165,114 @@ def create_batch_role(role_name, custom_policy_name, custom_policy_document):
         custom_policy_document,
     )
     return role
+
+
+def create_instance_profile(role_name):
+    """
+    Create the instance role and profile EC2 compute environments launch
+    their container instances with. Returns the instance profile ARN.
+    """
+    iam = client("iam")
+    trust_policy = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Principal": {"Service": "ec2.amazonaws.com"},
+                "Action": "sts:AssumeRole",
+            }
+        ],
+    }
+    create_role(
+        role_name,
+        trust_policy,
+        "arn:aws:iam::aws:policy/service-role/AmazonEC2ContainerServiceforEC2Role",
+        None,
+        None,
+    )
+    try:
+        profile = iam.create_instance_profile(InstanceProfileName=role_name)[
+            "InstanceProfile"
+        ]
+    except iam.exceptions.EntityAlreadyExistsException:
+        profile = iam.get_instance_profile(InstanceProfileName=role_name)[
+            "InstanceProfile"
+        ]
+    if not any(x["RoleName"] == role_name for x in profile.get("Roles", [])):
+        iam.add_role_to_instance_profile(
+            InstanceProfileName=role_name, RoleName=role_name
+        )
+
+        def attached():
+            roles = iam.get_instance_profile(InstanceProfileName=role_name)[
+                "InstanceProfile"
+            ]["Roles"]
+            return any(x["RoleName"] == role_name for x in roles), "ADDING ROLE"
+
+        waiter.wait_for(attached, f"instance profile {role_name}", timeout=60)
+    return profile["Arn"]
+
+
+def delete_instance_profile(role_name):
+    """
+    Delete an instance profile created by create_instance_profile and its role.
+    """
+    iam = client("iam")
+    try:
+        profile = iam.get_instance_profile(InstanceProfileName=role_name)[
+            "InstanceProfile"
+        ]
+        for role in profile.get("Roles", []):
+            iam.remove_role_from_instance_profile(
+                InstanceProfileName=role_name, RoleName=role["RoleName"]
+            )
+        iam.delete_instance_profile(InstanceProfileName=role_name)
+    except iam.exceptions.NoSuchEntityException:
+        pass
+    delete_role(role_name)
+
+
+def delete_policy(policy_arn):
+    """
+    Delete a customer managed policy, retrying while a recent detach has not
+    propagated yet.
+    """
+    iam = client("iam")
+
+    def check():
+        try:
+            iam.delete_policy(PolicyArn=policy_arn)
+            return True, "DELETED"
+        except iam.exceptions.NoSuchEntityException:
+            return True, "DELETED"
+        except iam.exceptions.DeleteConflictException:
+            return False, "ATTACHED"
+
+    return waiter.wait_for(check, f"policy {policy_arn} to detach", timeout=60)
+
+
+def delete_role(role_name):
+    """
+    Detach every policy from a role, delete the customer managed ones and
+    then the role. Missing roles are ignored.
+    """
+    iam = client("iam")
+    try:
+        attached_policies = iam.list_attached_role_policies(RoleName=role_name)[
+            "AttachedPolicies"
+        ]
+    except iam.exceptions.NoSuchEntityException:
+        return
+    for policy in attached_policies:
+        iam.detach_role_policy(RoleName=role_name, PolicyArn=policy["PolicyArn"])
+    for policy_name in iam.list_role_policies(RoleName=role_name)["PolicyNames"]:
+        iam.delete_role_policy(RoleName=role_name, PolicyName=policy_name)
+    # Detaching is eventually consistent, retry the deletes concurrently
+    waiter.wait_all(
+        *[
+            functools.partial(delete_policy, policy["PolicyArn"])
+            for policy in attached_policies
+            if not policy["PolicyArn"].startswith("arn:aws:iam::aws:")
+        ]
+    )
+    iam.delete_role(RoleName=role_name)
@@ -1,8 +1,9 @@
-import boto3
 import questionary
 from botocore.exceptions import ClientError, NoCredentialsError
 from questionary import Choice
 
+from red.clients import client
+
 
 def get_tag_value(tags, key="Name"):
     """Helper to safely extract a tag value from a list of tags."""
@@ -20,7 +21,7 @@ def select_network_resources(region_name="us-east-1"):
     """
     try:
         # Initialize Boto3 EC2 client
-        ec2 = boto3.client("ec2", region_name=region_name)
+        ec2 = client("ec2", region_name=region_name)
 
         # ==========================================
         # Step 1: Fetch and Select VPC
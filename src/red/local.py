@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import sys
+
+import sh
+
+from red import docker
+from red.clients import client
+from red.context import dockerfile_instructions
+from red.utility import print
+
+
+def resolve_secrets(config, stub=False):
+    """
+    Values for the ssmParam:: entries of Env. Parameters that can't be read
+    with the local credentials are replaced by a placeholder.
+    """
+    secrets = {}
+    for k, v in config.get("Env", {}).items():
+        if not (isinstance(v, str) and v.startswith("ssmParam::")):
+            continue
+        parameter = "/" + v[10:].lstrip("/")
+        if stub:
+            secrets[k] = f"stub{parameter}"
+            continue
+        try:
+            response = client("ssm").get_parameter(Name=parameter, WithDecryption=True)
+            secrets[k] = response["Parameter"]["Value"]
+        except Exception as e:
+            print(f"[yellow]Stubbing {k}, couldn't read {parameter}: {e}[/yellow]")
+            secrets[k] = f"stub{parameter}"
+    return secrets
+
+
+def local_environment(config, payload, stub_secrets=False):
+    """
+    The environment a job gets from its job definition and payload: Env from
+    .red, SSM secrets, then payload overrides.
+    """
+    environment = {
+        k: str(v)
+        for k, v in config.get("Env", {}).items()
+        if not (isinstance(v, str) and v.startswith("ssmParam::"))
+    }
+    environment.update(resolve_secrets(config, stub=stub_secrets))
+    for k, v in payload.items():
+        if not isinstance(v, str):
+            v = json.dumps(v) if isinstance(v, (dict, list)) else str(v)
+        environment[k] = v
+    return environment
+
+
+def docker_available():
+    if not shutil.which("docker"):
+        return False
+    try:
+        sh.docker.info(_out=None, _err=None)
+        return True
+    except sh.ErrorReturnCode:
+        return False
+
+
+def local_image(name, config):
+    """
+    Tag of a local image for the current build context, built only when no
+    image with the same fingerprint exists yet.
+    """
+    tag = docker.image_fingerprint(config)
+    image = f"{name}:{tag}"
+    try:
+        sh.docker.image.inspect(image, _out=None, _err=None)
+        print(f"Image unchanged, reusing {image}")
+    except sh.ErrorReturnCode:
+        docker.build_image(name, config, tags=("latest", tag))
+    return image
+
+
+def run_container(image, environment, config):
+    """
+    Run the image with the job's environment and Cpu/MemorySize limits,
+    streaming its output. Returns the exit code.
+    """
+    # Values are passed through the environment so secrets aren't in argv
+    env_args = [x for k in environment for x in ("-e", k)]
+    process = sh.docker.run(
+        "--rm",
+        "--cpus",
+        str(config.get("Cpu", 1)),
+        "--memory",
+        f"{config.get('MemorySize', 2048)}m",
+        *env_args,
+        image,
+        _env={**os.environ, **environment},
+        _out=sys.stdout,
+        _err=sys.stderr,
+        _ok_code=list(range(256)),
+        _return_cmd=True,
+    )
+    return process.exit_code
+
+
+def entrypoint_command(config):
+    """
+    The command the image runs, from the Dockerfile's exec form ENTRYPOINT
+    and CMD, defaulting to python main.py.
+    """
+    command = {"ENTRYPOINT": [], "CMD": []}
+    dockerfile = config.get("DockerfilePath", "Dockerfile")
+    if os.path.exists(dockerfile):
+        for instruction, args in dockerfile_instructions(dockerfile):
+            if instruction in command:
+                try:
+                    command[instruction] = json.loads(args)
+                except ValueError:
+                    command[instruction] = ["/bin/sh", "-c", args]
+    command = command["ENTRYPOINT"] + command["CMD"] or ["python", "main.py"]
+    if command[0] in ("python", "python3"):
+        command[0] = sys.executable
+    return command
+
+
+def run_subprocess(environment, config):
+    """
+    Run the job's command directly in the build context when docker isn't
+    available. Cpu and memory limits are not applied.
+    """
+    command = entrypoint_command(config)
+    print(f"Docker unavailable, running {' '.join(command)} locally")
+    process = sh.Command(command[0])(
+        *command[1:],
+        _cwd=config.get("BuildContext", "."),
+        _env={**os.environ, **environment},
+        _out=sys.stdout,
+        _err=sys.stderr,
+        _ok_code=list(range(256)),
+        _return_cmd=True,
+    )
+    return process.exit_code
+
+
+def run_local(name, config, payload, stub_secrets=False):
+    environment = local_environment(config, payload, stub_secrets=stub_secrets)
+    if docker_available():
+        return run_container(local_image(name, config), environment, config)
+    return run_subprocess(environment, config)
@@ -1,17 +1,41 @@
+import collections
+import gzip
+import heapq
+import io
+import itertools
+import json
+import os
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 
-import boto3
-import questionary
-from rich import box
-from rich.markdown import Markdown
-from rich.panel import Panel
+from botocore.exceptions import ClientError
 
-from red.utility import milliseconds_to_date, print
+from red import batch, waiter
+from red.clients import client, pooled_client
+from red.utility import lazy_import, milliseconds_to_date, print, write_json
+
+questionary = lazy_import("questionary")
+
+
+def _print_panel(message):
+    from rich import box
+    from rich.markdown import Markdown
+    from rich.panel import Panel
+
+    panel = Panel(
+        Markdown(message),
+        title="🦊 RED project logs",
+        border_style="#ff4444",
+        box=box.ROUNDED,
+    )
+    print(panel)
 
 
 def list_logs(name):
-    logs_client = boto3.client("logs")
+    logs_client = client("logs")
     log_group_name = f"{name}"
     response = logs_client.describe_log_streams(
         logGroupName=log_group_name, orderBy="LastEventTime", descending=True, limit=10
@@ -29,49 +53,725 @@ def list_logs(name):
     return response["logStreams"][int(selection.split(".")[0]) - 1]
 
 
-def get_log(name, log_stream_name):
-    logs_client = boto3.client("logs")
-    log_group_name = f"{name}"
-    if log_stream_name == "_latest":
-        stream_response = logs_client.describe_log_streams(
-            logGroupName=log_group_name,
-            orderBy="LastEventTime",
-            descending=True,
-            limit=1,
+def latest_log_streams(name, count):
+    logs_client = client("logs")
+    paginator = logs_client.get_paginator("describe_log_streams")
+    pages = paginator.paginate(
+        logGroupName=f"{name}",
+        orderBy="LastEventTime",
+        descending=True,
+        PaginationConfig={"MaxItems": count},
+    )
+    return [x["logStreamName"] for page in pages for x in page["logStreams"]]
+
+
+def latest_log_stream(name):
+    streams = latest_log_streams(name, 1)
+    return streams[0] if streams else None
+
+
+def iter_log_events(
+    name, log_stream_name, start_time=None, end_time=None, logs_client=None
+):
+    """
+    Yield every event of a log stream page by page, following
+    nextForwardToken until it stops advancing. Memory is bounded by one page.
+    """
+    logs_client = logs_client or client("logs")
+    params = {
+        "logGroupName": f"{name}",
+        "logStreamName": log_stream_name,
+        "startFromHead": True,
+    }
+    if start_time is not None:
+        params["startTime"] = start_time
+    if end_time is not None:
+        params["endTime"] = end_time
+    token = None
+    while True:
+        response = logs_client.get_log_events(**params)
+        yield from response["events"]
+        if response["nextForwardToken"] == token:
+            return
+        token = params["nextToken"] = response["nextForwardToken"]
+
+
+def iter_log_tail(name, log_stream_name, count, start_time=None, end_time=None):
+    """
+    Yield the last count events of a log stream, reading backwards from the
+    end of the stream so only the requested events are fetched.
+    """
+    logs_client = client("logs")
+    params = {
+        "logGroupName": f"{name}",
+        "logStreamName": log_stream_name,
+        "startFromHead": False,
+    }
+    if start_time is not None:
+        params["startTime"] = start_time
+    if end_time is not None:
+        params["endTime"] = end_time
+    pages = []
+    found = 0
+    token = None
+    while found < count:
+        response = logs_client.get_log_events(**params)
+        if response["events"]:
+            pages.append(response["events"])
+            found += len(response["events"])
+        if response["nextBackwardToken"] == token:
+            break
+        token = params["nextToken"] = response["nextBackwardToken"]
+    events = [event for page in reversed(pages) for event in page]
+    yield from events[-count:]
+
+
+OUTPUT_FORMATS = ("rich", "text", "jsonl")
+
+
+def _format_batch(events, output_format):
+    if output_format == "jsonl":
+        return "".join(
+            json.dumps({"timestamp": e["timestamp"], "message": e["message"]}) + "\n"
+            for e in events
         )
-        if not stream_response.get("logStreams"):
-            panel = Panel(
-                Markdown("no logs"),
-                title="🦊 RED project logs",
-                border_style="#ff4444",
-                box=box.ROUNDED,
-            )
-            return print(panel)
-        log_stream_name = stream_response["logStreams"][0]["logStreamName"]
+    # Most events of a batch share a handful of seconds, format each second once
+    seconds = {}
+    lines = []
+    for event in events:
+        second, millis = divmod(event["timestamp"], 1000)
+        prefix = seconds.get(second)
+        if prefix is None:
+            prefix = seconds[second] = datetime.fromtimestamp(
+                second, tz=timezone.utc
+            ).strftime("%Y-%m-%d %H:%M:%S")
+        lines.append(f"{prefix}.{millis:03d} {event['message'].rstrip(chr(10))}\n")
+    return "".join(lines)
 
+
+def write_events(events, output_format="rich", out=None, batch_size=1000):
+    """
+    Write log events to the console. The text and jsonl formats bypass Rich
+    and write buffered batches straight to stdout.
+    """
+    if output_format == "rich":
+        for event in events:
+            print(event["timestamp"], event["message"], markup=False, highlight=False)
+        return
+    out = out or sys.stdout
+    events = iter(events)
+    while batch := list(itertools.islice(events, batch_size)):
+        out.write(_format_batch(batch, output_format))
+        out.flush()
+
+
+def _wait_for_stream(logs_client, log_group_name, log_stream_name, timeout=30):
     # Wait for log stream to be created if it doesn't exist yet
-    max_retries = 30
-    retry_count = 0
-    while retry_count < max_retries:
+    def exists():
         try:
-            response = logs_client.get_log_events(
+            logs_client.get_log_events(
                 logGroupName=log_group_name,
                 logStreamName=log_stream_name,
-                startFromHead=True,
+                limit=1,
             )
-            break
+            return True, "CREATED"
         except logs_client.exceptions.ResourceNotFoundException:
-            retry_count += 1
-            if retry_count >= max_retries:
-                panel = Panel(
-                    Markdown("log stream not found"),
-                    title="🦊 RED project logs",
-                    border_style="#ff4444",
-                    box=box.ROUNDED,
+            return False, "NOT FOUND"
+
+    try:
+        waiter.wait_for(exists, f"log stream {log_stream_name}", timeout, quiet=True)
+        return True
+    except TimeoutError:
+        return False
+
+
+def get_log(
+    name,
+    log_stream_name,
+    start_time=None,
+    end_time=None,
+    head=None,
+    tail=None,
+    output_format="rich",
+):
+    logs_client = client("logs")
+    log_group_name = f"{name}"
+    if log_stream_name == "_latest":
+        log_stream_name = latest_log_stream(name)
+        if not log_stream_name:
+            return _print_panel("no logs")
+
+    if not _wait_for_stream(logs_client, log_group_name, log_stream_name):
+        return _print_panel("log stream not found")
+
+    if tail:
+        events = iter_log_tail(name, log_stream_name, tail, start_time, end_time)
+    else:
+        events = iter_log_events(name, log_stream_name, start_time, end_time)
+        if head:
+            events = itertools.islice(events, head)
+
+    # Output log as it is read
+    write_events(events, output_format)
+
+
+def _iter_new_events(logs_client, log_group_name, log_stream_name, position):
+    # Read every event after position["token"] page by page, the token stops
+    # advancing once caught up
+    while True:
+        params = {
+            "logGroupName": log_group_name,
+            "logStreamName": log_stream_name,
+            "startFromHead": True,
+        }
+        token = position.get("token")
+        if token:
+            params["nextToken"] = token
+        try:
+            response = logs_client.get_log_events(**params)
+        except logs_client.exceptions.ResourceNotFoundException:
+            return
+        yield from response["events"]
+        if response["nextForwardToken"] == token:
+            return
+        position["token"] = response["nextForwardToken"]
+
+
+def iter_job_log(name, job_id, poll_interval=2):
+    """
+    Stream a job's log events while it runs.
+    Yields ("status", job) on every status change, ("event", event) for
+    every log event and ("idle", None) once caught up with the log, stopping
+    once the job is terminal and the log drained.
+    """
+    logs_client = client("logs")
+    log_group_name = f"{name}"
+    log_stream_name = None
+    position = {}
+    # Same adaptive polling as red wait, capped so the log stays live
+    for job, previous in batch.wait_for_jobs(
+        [job_id], every_poll=True, max_interval=poll_interval
+    ):
+        if job["status"] == "NOT_FOUND":
+            raise LookupError(f"Job {job_id} not found")
+        if job["status"] != previous:
+            yield "status", job
+        log_stream_name = log_stream_name or job.get("container", {}).get(
+            "logStreamName"
+        )
+        if log_stream_name:
+            for event in _iter_new_events(
+                logs_client, log_group_name, log_stream_name, position
+            ):
+                yield "event", event
+        yield "idle", None
+    if not log_stream_name:
+        return
+    # Give CloudWatch a moment to deliver the final lines
+    time.sleep(poll_interval)
+    for event in _iter_new_events(
+        logs_client, log_group_name, log_stream_name, position
+    ):
+        yield "event", event
+
+
+def follow_job(name, job_id, output_format="rich", flush_interval=0.5):
+    """
+    Write a job's log while it runs. Events are written in batches, flushed
+    every flush_interval seconds while catching up and whenever the log is
+    caught up.
+    """
+    pending = []
+    flushed_at = time.monotonic()
+
+    def flush():
+        nonlocal flushed_at
+        if pending:
+            write_events(pending, output_format)
+            pending.clear()
+        flushed_at = time.monotonic()
+
+    for kind, item in iter_job_log(name, job_id):
+        if kind == "event":
+            pending.append(item)
+            if len(pending) >= 1000 or time.monotonic() - flushed_at >= flush_interval:
+                flush()
+            continue
+        flush()
+        if kind == "status" and output_format == "rich":
+            print(f"[#ff4444]Job {item['status']}[/]")
+        elif kind == "status":
+            # Keep stdout clean for piping raw log lines
+            sys.stderr.write(f"Job {item['status']}\n")
+    flush()
+
+
+def find_running_job(name, log_stream_name):
+    """
+    Find the active job in the project queue that writes to a log stream.
+    """
+    batch_client = client("batch")
+    job_ids = []
+    for status in ("STARTING", "RUNNING"):
+        paginator = batch_client.get_paginator("list_jobs")
+        for page in paginator.paginate(jobQueue=name, jobStatus=status):
+            job_ids.extend(job["jobId"] for job in page["jobSummaryList"])
+    for i in range(0, len(job_ids), 100):
+        response = batch_client.describe_jobs(jobs=job_ids[i : i + 100])
+        for job in response["jobs"]:
+            if job.get("container", {}).get("logStreamName") == log_stream_name:
+                return job["jobId"]
+    return None
+
+
+def iter_filtered_events(
+    name,
+    pattern,
+    log_stream_names=None,
+    start_time=None,
+    end_time=None,
+    logs_client=None,
+):
+    """
+    Yield events matching a CloudWatch filter pattern, searched server side.
+    Without log_stream_names the whole log group is searched.
+    """
+    logs_client = logs_client or client("logs")
+    params = {"logGroupName": f"{name}", "filterPattern": pattern}
+    if log_stream_names:
+        params["logStreamNames"] = log_stream_names
+    if start_time is not None:
+        params["startTime"] = start_time
+    if end_time is not None:
+        params["endTime"] = end_time
+    paginator = logs_client.get_paginator("filter_log_events")
+    for page in paginator.paginate(**params):
+        yield from page["events"]
+
+
+def _iter_filtered_pages(
+    name,
+    pattern,
+    log_stream_names,
+    start_time,
+    end_time,
+    executor,
+    logs_client,
+    stop,
+    ahead=1,
+):
+    # Fetch up to ahead pages before the consumer asks for them, each fetch
+    # schedules the next one on the shared pool so no thread blocks on a
+    # slow consumer
+    params = {"logGroupName": f"{name}", "filterPattern": pattern}
+    if log_stream_names:
+        params["logStreamNames"] = log_stream_names
+    if start_time is not None:
+        params["startTime"] = start_time
+    if end_time is not None:
+        params["endTime"] = end_time
+    pages = collections.deque()
+    ready = threading.Condition()
+    state = {"token": None, "fetching": True, "done": False, "error": None}
+
+    def fetch():
+        try:
+            if stop.is_set():
+                response = {"events": []}
+            elif state["token"]:
+                response = logs_client.filter_log_events(
+                    **params, nextToken=state["token"]
                 )
-                return print(panel)
-            time.sleep(1)
+            else:
+                response = logs_client.filter_log_events(**params)
+        except Exception as e:
+            with ready:
+                state["error"] = e
+                ready.notify()
+            return
+        with ready:
+            pages.append(response["events"])
+            state["token"] = response.get("nextToken")
+            state["done"] = not state["token"] or stop.is_set()
+            state["fetching"] = not state["done"] and len(pages) < ahead
+            if state["fetching"]:
+                executor.submit(fetch)
+            ready.notify()
+
+    def drain():
+        while True:
+            with ready:
+                while not pages and not state["done"] and state["error"] is None:
+                    ready.wait()
+                if state["error"] is not None:
+                    raise state["error"]
+                if not pages:
+                    return
+                events = pages.popleft()
+                if not state["fetching"] and not state["done"]:
+                    state["fetching"] = True
+                    executor.submit(fetch)
+            yield from events
+
+    executor.submit(fetch)
+    return drain()
+
+
+def _time_windows(name, start_time, end_time, count, logs_client):
+    """
+    Split a search of the log group into count consecutive (start, end)
+    windows. The first and last keep an open start_time or end_time.
+    """
+    low = start_time
+    if low is None:
+        groups = logs_client.describe_log_groups(logGroupNamePrefix=f"{name}")
+        created = [
+            x["creationTime"] for x in groups["logGroups"] if x["logGroupName"] == name
+        ]
+        if not created:
+            return [(start_time, end_time)]
+        # Older events sent later still land in the open first window
+        low = created[0]
+    high = end_time if end_time is not None else int(time.time() * 1000)
+    if high - low < count:
+        return [(start_time, end_time)]
+    bounds = [low + (high - low) * i // count for i in range(count + 1)]
+    # Both ends of a FilterLogEvents range are inclusive
+    windows = [(bounds[i], bounds[i + 1] - 1) for i in range(count)]
+    windows[0] = (start_time, windows[0][1])
+    windows[-1] = (windows[-1][0], end_time)
+    return windows
+
+
+def search_logs(
+    name,
+    pattern,
+    log_stream_names=None,
+    start_time=None,
+    end_time=None,
+    concurrency=16,
+):
+    """
+    Search concurrently and yield the matches by timestamp. Streams are
+    searched one by one and merged, the whole log group is split into
+    time windows that are searched ahead and read in order.
+    """
+    logs_client = client("logs")
+    if log_stream_names and len(log_stream_names) == 1:
+        yield from iter_filtered_events(
+            name, pattern, log_stream_names, start_time, end_time, logs_client
+        )
+        return
+    stop = threading.Event()
+    sources = log_stream_names or _time_windows(
+        name, start_time, end_time, concurrency, logs_client
+    )
+    executor = ThreadPoolExecutor(max_workers=min(concurrency, len(sources)))
+    try:
+        if log_stream_names:
+            streams = [
+                _iter_filtered_pages(
+                    name,
+                    pattern,
+                    [x],
+                    start_time,
+                    end_time,
+                    executor,
+                    logs_client,
+                    stop,
+                )
+                for x in log_stream_names
+            ]
+            yield from heapq.merge(*streams, key=lambda e: e["timestamp"])
+        else:
+            windows = [
+                _iter_filtered_pages(
+                    name, pattern, None, low, high, executor, logs_client, stop, 4
+                )
+                for low, high in sources
+            ]
+            yield from itertools.chain.from_iterable(windows)
+    finally:
+        # Stop fetching once the consumer is done, e.g. after --head
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def count_matches(name, pattern, log_stream_names=None, start_time=None, end_time=None):
+    """
+    Count matching events per log stream without keeping any of them.
+    """
+    logs_client = client("logs")
+
+    def count(streams):
+        counts = collections.Counter()
+        for event in iter_filtered_events(
+            name, pattern, streams, start_time, end_time, logs_client
+        ):
+            counts[event["logStreamName"]] += 1
+        return counts
+
+    if not log_stream_names:
+        return count(None)
+    counts = collections.Counter({x: 0 for x in log_stream_names})
+    with ThreadPoolExecutor(max_workers=min(16, len(log_stream_names))) as executor:
+        for result in executor.map(count, [[x] for x in log_stream_names]):
+            counts.update(result)
+    return counts
+
+
+def filter_log(
+    name,
+    pattern,
+    log_stream_names=None,
+    start_time=None,
+    end_time=None,
+    head=None,
+    tail=None,
+    output_format="rich",
+):
+    events = search_logs(name, pattern, log_stream_names, start_time, end_time)
+    if head:
+        events = itertools.islice(events, head)
+    if tail:
+        events = collections.deque(events, maxlen=tail)
+    if log_stream_names is None or len(log_stream_names) > 1:
+        # Tag each line with its stream when several streams are merged
+        events = (
+            {**e, "message": f"{e['logStreamName'].split('/')[-1]} {e['message']}"}
+            for e in events
+        )
+    write_events(events, output_format)
+
+
+EXPORT_CHECKPOINT = ".red-export.json"
+
+
+def iter_log_streams(name, start_time=None):
+    """
+    Yield every log stream of the project log group, newest first, stopping
+    at the first stream whose last event is before start_time. Streams
+    without a last event timestamp are yielded, CloudWatch fills it in late.
+    """
+    logs_client = client("logs")
+    paginator = logs_client.get_paginator("describe_log_streams")
+    pages = paginator.paginate(
+        logGroupName=f"{name}", orderBy="LastEventTime", descending=True
+    )
+    for page in pages:
+        for stream in page["logStreams"]:
+            last_event = stream.get("lastEventTimestamp")
+            if start_time and last_event is not None and last_event < start_time:
+                return
+            yield stream
+
+
+def _open_compressed(path, compression):
+    if compression == "gzip":
+        return gzip.open(path, "wt", compresslevel=6)
+    try:
+        from compression import zstd
+
+        return zstd.open(path, "wt")
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd compression requires the zstandard package")
+    return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, "wb")))
 
-    # Output complete log
-    for event in response["events"]:
-        print(event["timestamp"], event["message"])
+
+def export_stream(
+    name, log_stream_name, path, compression, start_time, end_time, logs_client
+):
+    # Write to a temporary file so interrupted exports are never mistaken as done
+    tmp_path = f"{path}.part"
+    with _open_compressed(tmp_path, compression) as f:
+        for event in iter_log_events(
+            name, log_stream_name, start_time, end_time, logs_client
+        ):
+            line = json.dumps(
+                {"timestamp": event["timestamp"], "message": event["message"]}
+            )
+            f.write(line + "\n")
+    os.replace(tmp_path, path)
+    # Compressed bytes on disk, what the export actually wrote
+    return os.path.getsize(path)
+
+
+def export_logs(
+    name,
+    out,
+    start_time=None,
+    end_time=None,
+    compression="gzip",
+    concurrency=8,
+):
+    """
+    Export every log stream to compressed JSONL files in out, concurrently.
+    Finished streams are recorded in a checkpoint for the start and end
+    time, so an interrupted export of the same window resumes where it
+    stopped. Yields (stream, bytes written, skipped, error) per stream,
+    streams that fail are reported and left out of the checkpoint.
+    """
+    os.makedirs(out, exist_ok=True)
+    checkpoint_path = os.path.join(out, EXPORT_CHECKPOINT)
+    window = [start_time, end_time]
+    checkpoint = {"window": window, "streams": {}}
+    try:
+        with open(checkpoint_path, "r") as f:
+            saved = json.load(f)
+        # Streams done for another window are missing events of this one
+        if saved.get("window") == window:
+            checkpoint = saved
+    except (OSError, ValueError):
+        pass
+    finished = checkpoint["streams"]
+    extension = "jsonl.gz" if compression == "gzip" else "jsonl.zst"
+    logs_client = pooled_client("logs", concurrency)
+
+    def export(stream):
+        log_stream_name = stream["logStreamName"]
+        file_name = f"{log_stream_name.replace('/', '_')}.{extension}"
+        path = os.path.join(out, file_name)
+        try:
+            return (
+                stream,
+                export_stream(
+                    name,
+                    log_stream_name,
+                    path,
+                    compression,
+                    start_time,
+                    end_time,
+                    logs_client,
+                ),
+                None,
+            )
+        except ClientError as e:
+            if os.path.exists(f"{path}.part"):
+                os.remove(f"{path}.part")
+            return stream, 0, str(e)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        for stream in iter_log_streams(name, start_time):
+            done = finished.get(stream["logStreamName"])
+            if done and done == stream.get("lastEventTimestamp"):
+                yield stream["logStreamName"], 0, True, None
+                continue
+            futures.append(executor.submit(export, stream))
+        try:
+            for future in as_completed(futures):
+                stream, size, error = future.result()
+                if error:
+                    yield stream["logStreamName"], 0, False, error
+                    continue
+                finished[stream["logStreamName"]] = stream.get("lastEventTimestamp")
+                write_json(checkpoint_path, checkpoint)
+                yield stream["logStreamName"], size, False, None
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+# Events buffered by a merged view at most, split between the streams
+MERGE_BUFFER_EVENTS = 100_000
+
+
+def _iter_prefetched_events(
+    name,
+    log_stream_name,
+    executor,
+    logs_client,
+    ahead,
+    start_time=None,
+    end_time=None,
+    limit=None,
+):
+    # The first page of every stream is fetched on the pool, later pages are
+    # only fetched ahead while the shared ahead semaphore has room, otherwise
+    # when the merge reaches the end of the current page
+    params = {
+        "logGroupName": f"{name}",
+        "logStreamName": log_stream_name,
+        "startFromHead": True,
+    }
+    if start_time is not None:
+        params["startTime"] = start_time
+    if end_time is not None:
+        params["endTime"] = end_time
+    if limit:
+        params["limit"] = limit
+
+    def fetch(token):
+        try:
+            if token:
+                return logs_client.get_log_events(**params, nextToken=token)
+            return logs_client.get_log_events(**params)
+        except logs_client.exceptions.ResourceNotFoundException:
+            return {"events": [], "nextForwardToken": token}
+
+    def drain(future):
+        token = None
+        prefetched = False
+        try:
+            while True:
+                response = future.result() if future else fetch(token)
+                if prefetched:
+                    ahead.release()
+                next_token = response["nextForwardToken"]
+                future = None
+                prefetched = next_token != token and ahead.acquire(blocking=False)
+                if prefetched:
+                    future = executor.submit(fetch, next_token)
+                yield from response["events"]
+                if next_token == token:
+                    return
+                token = next_token
+        finally:
+            if prefetched:
+                ahead.release()
+
+    return drain(executor.submit(fetch, None))
+
+
+def _label_events(events, label):
+    for event in events:
+        yield {**event, "message": f"{label} {event['message']}"}
+
+
+def merge_logs(
+    name, streams, start_time=None, end_time=None, output_format="rich", concurrency=16
+):
+    """
+    Print the events of many (label, logStreamName) streams ordered by time.
+    Streams are k-way merged with a heap. Pages are sized so the first page
+    of every stream fits MERGE_BUFFER_EVENTS, and at most concurrency pages
+    are fetched ahead across all streams.
+    """
+    logs_client = client("logs")
+    width = max(len(label) for label, _ in streams)
+    limit = min(10000, max(100, MERGE_BUFFER_EVENTS // len(streams)))
+    ahead = threading.Semaphore(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        iterators = [
+            _label_events(
+                _iter_prefetched_events(
+                    name,
+                    log_stream_name,
+                    executor,
+                    logs_client,
+                    ahead,
+                    start_time,
+                    end_time,
+                    limit,
+                ),
+                f"{label:>{width}}",
+            )
+            for label, log_stream_name in streams
+        ]
+        write_events(
+            heapq.merge(*iterators, key=lambda e: e["timestamp"]), output_format
+        )
@@ -1,28 +1,41 @@
+import functools
 import json
 import os
 import platform
 import shlex
 import sys
 import time
-from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
+from typing import List
 
-import boto3
-import questionary
-import rich
-import sh
 import typer
-from rich.progress import Progress, SpinnerColumn, TextColumn
-from typing_extensions import Annotated
 
-from red import batch, constants, docker, ecr, logs, schedule, utility
-from red.infra import select_network_resources
-from red.utility import load_config, print
+from red import constants, utility
+from red.utility import lazy_import, load_config, print, spinner
+
+# Loaded on first use so short commands and --help start fast
+questionary = lazy_import("questionary")
+batch = lazy_import("red.batch")
+capacity = lazy_import("red.capacity")
+context = lazy_import("red.context")
+docker = lazy_import("red.docker")
+ecr = lazy_import("red.ecr")
+graph = lazy_import("red.graph")
+iam = lazy_import("red.iam")
+infra = lazy_import("red.infra")
+local = lazy_import("red.local")
+logs = lazy_import("red.logs")
+projects = lazy_import("red.projects")
+schedule = lazy_import("red.schedule")
+serverless = lazy_import("red.serverless")
+staging = lazy_import("red.staging")
 
 selected_date = None
 
 app = typer.Typer()
+log_app = typer.Typer()
+app.add_typer(log_app, name="log", help="View job logs")
 
 
 @app.command("init")
@@ -86,7 +99,7 @@ def run_init():
         "Is the environment public? If private, you must have a NAT Gateway for your private Batch environment to interact with the internet"
     ).ask()
     env_content["assignPublicIp"] = "ENABLED" if is_public else "DISABLED"
-    resources = select_network_resources()
+    resources = infra.select_network_resources()
     env_content["VPC"]["SubnetIds"] = resources["subnets"]
     env_content["VPC"]["SecurityGroupIds"] = resources["security_groups"]
     env_content["IamPolicy"] = {
@@ -125,24 +138,436 @@ def run_init():
     print("🦊 RED project setup!")
 
 
+def deploy_steps(name, config):
+    """
+    Deploy steps and their dependencies for graph.run_graph. Only the job
+    definition needs the image, so the image is built and pushed while the
+    rest of the Batch environment is provisioned.
+    """
+    if config.get("Mode") == "lambda":
+        return lambda_deploy_steps(name, config)
+
+    def push_image(repo_uri):
+        account_ecr = repo_uri.split("/")[0]
+        return docker.push_to_ecr(repo_uri, account_ecr, config, quiet=True)
+
+    try:
+        ec2 = batch.uses_ec2(name, config)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    compute_environment_deps = ["role"]
+    steps = {}
+    if ec2 and not config.get("InstanceRole"):
+        steps["instance role"] = (
+            lambda _: iam.create_instance_profile(f"{name}_instance"),
+            [],
+        )
+        compute_environment_deps.append("instance role")
+    if ec2:
+        steps["launch template"] = (
+            lambda r: batch.ensure_launch_template(name, r["ecr"]),
+            ["ecr"],
+        )
+        compute_environment_deps.append("launch template")
+
+    return steps | {
+        "ecr": (lambda _: ecr.create_ecr(name), []),
+        "image": (lambda r: push_image(r["ecr"]), ["ecr"]),
+        "role": (lambda _: batch.ensure_batch_role(name, config), []),
+        "log group": (lambda _: batch.ensure_log_group(name), []),
+        "compute environment": (
+            lambda r: batch.ensure_compute_environments(
+                name,
+                r["role"],
+                config,
+                r.get("instance role") or config.get("InstanceRole"),
+                r.get("launch template"),
+            ),
+            compute_environment_deps,
+        ),
+        "job queue": (
+            lambda r: batch.ensure_job_queue(name, r["compute environment"]),
+            ["compute environment"],
+        ),
+        "job definition": (
+            lambda r: batch.register_job_definition(
+                name, r["image"], r["role"], r["log group"], config
+            ),
+            ["image", "role", "log group"],
+        ),
+    }
+
+
+def lambda_deploy_steps(name, config):
+    """
+    Deploy steps for "Mode": "lambda". The function is deployed from the zip
+    package, or from the ECR image when LambdaPackage is "image".
+    """
+    secrets = serverless.ssm_parameters(config)
+
+    def function(r):
+        return serverless.deploy_function(
+            name,
+            r["lambda role"],
+            r["log group"],
+            config,
+            secrets,
+            package=r.get("package"),
+            image_uri=r.get("image"),
+        )
+
+    steps = {
+        "lambda role": (
+            lambda _: serverless.ensure_lambda_role(name, config, secrets),
+            [],
+        ),
+        "log group": (lambda _: batch.ensure_log_group(name), []),
+    }
+    if config.get("LambdaPackage", "zip") == "image":
+        steps["ecr"] = (lambda _: ecr.create_ecr(name), [])
+        steps["image"] = (
+            lambda r: docker.push_to_ecr(
+                r["ecr"], r["ecr"].split("/")[0], config, quiet=True
+            ),
+            ["ecr"],
+        )
+        steps["function"] = (function, ["lambda role", "log group", "image"])
+    else:
+        handler = {constants.LAMBDA_HANDLER_FILE: constants.LAMBDA_HANDLER}
+        steps["package"] = (
+            lambda _: docker.build_serverless_package(config, extra_files=handler),
+            [],
+        )
+        steps["function"] = (function, ["lambda role", "log group", "package"])
+    return steps
+
+
+def print_timings(timings, title="Deploy steps"):
+    from rich.table import Table
+
+    table = Table(title=title, title_justify="left", border_style="#ff4444")
+    table.add_column("Step")
+    table.add_column("Start", justify="right")
+    table.add_column("Duration", justify="right")
+    table.add_column("", min_width=20)
+    total = max(end for _, end in timings.values()) or 1
+    for step, (start, end) in sorted(timings.items(), key=lambda x: x[1]):
+        offset = int(start / total * 20)
+        bar = " " * offset + "█" * max(1, int((end - start) / total * 20))
+        table.add_row(step, f"{start:.1f}s", f"{end - start:.1f}s", bar)
+    print(table)
+    step_time = sum(end - start for start, end in timings.values())
+    print(f"Total {total:.1f}s ({step_time:.1f}s of step time)")
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def print_context_report(report):
+    from rich.table import Table
+
+    print(
+        f"Build context: {format_bytes(report['total_bytes'])} in "
+        f"{report['file_count']} files"
+    )
+    for title, rows in (
+        ("Largest directories", report["largest_directories"]),
+        ("Largest files", [(x, size) for size, x in report["largest_files"]]),
+    ):
+        table = Table(title=title, title_justify="left", border_style="#ff4444")
+        table.add_column("Path")
+        table.add_column("Size", justify="right")
+        for path, size in rows:
+            table.add_row(path, format_bytes(size))
+        print(table)
+    for warning in report["cache_warnings"]:
+        print(f"[yellow]Cache:[/yellow] {warning}")
+    if report["ignore_suggestions"]:
+        print("Suggested .dockerignore additions:")
+        for suggestion in report["ignore_suggestions"]:
+            print(f"  {suggestion}")
+
+
+def analyze_build_context(config):
+    return context.analyze_context(
+        config.get("BuildContext", "."), config.get("DockerfilePath", "Dockerfile")
+    )
+
+
+def check_context_budget(config):
+    """
+    Fail before anything is built when the build context is larger than
+    ContextBudgetMB.
+    """
+    budget = config.get("ContextBudgetMB")
+    if not budget:
+        return
+    report = analyze_build_context(config)
+    if report["total_bytes"] > budget * 1024 * 1024:
+        print_context_report(report)
+        print(
+            f"[red]Build context is {format_bytes(report['total_bytes'])}, over the "
+            f"{budget} MB ContextBudgetMB.[/red] Run red build --analyze "
+            "--write-dockerignore to trim it."
+        )
+        raise typer.Exit(code=1)
+
+
+@app.command("build")
+def run_build(
+    analyze: bool = typer.Option(
+        False, "--analyze", help="report build context size instead of building"
+    ),
+    write_dockerignore: bool = typer.Option(
+        False,
+        "--write-dockerignore",
+        help="add the suggested entries to .dockerignore",
+    ),
+):
+    config = load_config()
+    if analyze or write_dockerignore:
+        report = analyze_build_context(config)
+        print_context_report(report)
+        if write_dockerignore and report["ignore_suggestions"]:
+            build_context = config.get("BuildContext", ".")
+            content = context.suggested_dockerignore(
+                build_context, report["ignore_suggestions"]
+            )
+            with open(os.path.join(build_context, ".dockerignore"), "w") as f:
+                f.write(content)
+            print("Updated .dockerignore")
+        return
+    check_context_budget(config)
+    docker.build_image(config.get("Name"), config)
+
+
+def load_projects(root):
+    """
+    Configs of every project below root, keyed by project name. Files that
+    can't be read are reported and skipped.
+    """
+    configs = {}
+    for path in utility.find_projects(root):
+        try:
+            config = utility.read_config(path)
+        except ValueError as e:
+            print(f"[yellow]Skipping project. {e}[/yellow]")
+            continue
+        name = config.get("Name")
+        if name in configs:
+            raise typer.BadParameter(f"Project name {name} is used more than once")
+        configs[name] = config
+    if not configs:
+        raise typer.BadParameter(f"No .red files found under {root}")
+    return configs
+
+
+def print_project_results(results):
+    from rich.table import Table
+
+    table = Table(title="Projects", title_justify="left", border_style="#ff4444")
+    table.add_column("Project")
+    table.add_column("Status")
+    table.add_column("Duration", justify="right")
+    table.add_column("Slowest step")
+    for name, result in sorted(results.items()):
+        timings = result["timings"]
+        slowest = max(timings.items(), key=lambda x: x[1][1] - x[1][0], default=None)
+        table.add_row(
+            name,
+            (
+                "[green]deployed[/green]"
+                if result["status"] == "deployed"
+                else f"[red]failed[/red] {result['error']}"
+            ),
+            f"{result['duration']:.1f}s",
+            f"{slowest[0]} ({slowest[1][1] - slowest[1][0]:.1f}s)" if slowest else "",
+        )
+    print(table)
+
+
+def run_deploy_all(root, parallel, docker_slots, aws_slots):
+    configs = load_projects(root)
+    for config in configs.values():
+        check_context_budget(config)
+    # Built here, deploy_steps loads lazy modules that the workers then share
+    project_steps = {
+        name: deploy_steps(name, config) for name, config in configs.items()
+    }
+    start = time.monotonic()
+    with spinner() as progress:
+        task = progress.add_task(
+            f"[#ff4444]Deploying {len(configs)} RED projects...", total=None
+        )
+
+        def on_update(finished, running):
+            progress.update(
+                task,
+                description=f"[#ff4444]{finished}/{len(configs)} done, "
+                f"running {', '.join(running)}",
+            )
+
+        results = projects.deploy_projects(
+            project_steps,
+            configs.values(),
+            parallel=parallel,
+            docker_slots=docker_slots,
+            aws_slots=aws_slots,
+            on_update=on_update,
+        )
+    print_project_results(results)
+    failed = [
+        name for name, result in results.items() if result["status"] != "deployed"
+    ]
+    print(
+        f"Deployed {len(results) - len(failed)}/{len(results)} projects in "
+        f"{time.monotonic() - start:.1f}s"
+    )
+    if failed:
+        raise typer.Exit(code=1)
+
+
 @app.command("deploy")
-def run_deploy():
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[progress.description]{task.description}"),
-        transient=True,
-    ) as progress:
+def run_deploy(
+    all_projects: bool = typer.Option(
+        False, "--all", help="deploy every project with a .red file under --root"
+    ),
+    root: str = typer.Option(".", "--root", help="where --all looks for projects"),
+    parallel: int = typer.Option(
+        4, "--parallel", min=1, help="projects deployed at once with --all"
+    ),
+    docker_slots: int = typer.Option(
+        2, "--docker-slots", min=1, help="concurrent image builds and pushes with --all"
+    ),
+    aws_slots: int = typer.Option(
+        16, "--aws-slots", min=1, help="concurrent AWS steps with --all"
+    ),
+):
+    if all_projects:
+        return run_deploy_all(root, parallel, docker_slots, aws_slots)
+    config = load_config()
+    check_context_budget(config)
+    with spinner() as progress:
         task = progress.add_task("[#ff4444]Deploying RED project...", total=None)
-        config = load_config()
         name = config.get("Name")
-        progress.update(task, description="[#ff4444]Confirming ECR")
-        repo_uri = ecr.create_ecr(name)
-        account_ecr = repo_uri.split("/")[0]
-        progress.update(task, description="[#ff4444]Pushing to ECR")
-        docker.push_to_ecr(repo_uri, account_ecr, config, quiet=True)
-        progress.update(task, description=f"[#ff4444]Creating Batch Environment")
-        batch.create_batch_environment(name, repo_uri, config)
+
+        def on_update(running):
+            progress.update(task, description=f"[#ff4444]{', '.join(running)}")
+
+        try:
+            results, timings = graph.run_graph(
+                deploy_steps(name, config), on_update=on_update
+            )
+        except (ValueError, RuntimeError) as e:
+            from rich.markup import escape
+
+            print(f"[red]{escape(str(e))}[/red]")
+            raise typer.Exit(1)
     print("RED project deployed")
+    print_timings(timings)
+
+
+@app.command("status")
+def run_status(
+    all_projects: bool = typer.Option(
+        False, "--all", help="every project with a .red file under --root"
+    ),
+    root: str = typer.Option(".", "--root", help="where --all looks for projects"),
+):
+    from rich.table import Table
+
+    if all_projects:
+        configs = load_projects(root)
+    else:
+        config = load_config()
+        configs = {config.get("Name"): config}
+    with spinner() as progress:
+        progress.add_task("[#ff4444]Checking RED projects...", total=None)
+        statuses = projects.projects_status(configs)
+    columns = []
+    for status in statuses.values():
+        columns.extend(x for x in status if x not in columns)
+    table = Table(title="Status", title_justify="left", border_style="#ff4444")
+    table.add_column("Project")
+    for column in columns:
+        table.add_column(column.capitalize())
+    for name, status in sorted(statuses.items()):
+        table.add_row(name, *[status.get(x, "") for x in columns])
+    print(table)
+
+
+@app.command("warm")
+def run_warm(
+    vcpus: int = typer.Option(
+        ..., "--vcpus", "-n", min=1, help="vCPUs to keep running"
+    ),
+    duration: str = typer.Option(
+        None, "--for", help="cool down automatically after e.g. 30m or 2h"
+    ),
+):
+    config = load_config()
+    name = config.get("Name")
+    seconds = None
+    if duration:
+        seconds = utility.parse_duration(duration)
+        if not seconds:
+            raise typer.BadParameter(f"invalid duration {duration}, e.g. 30m or 2h")
+    with spinner() as progress:
+        progress.add_task("[#ff4444]Warming RED project...", total=None)
+        try:
+            compute_env_name = capacity.warm(name, config, vcpus, seconds)
+        except (ValueError, LookupError) as e:
+            raise typer.BadParameter(str(e))
+    until = f" for {duration}" if duration else ", run red cool when done"
+    print(f"{compute_env_name} warm at {vcpus} vCPUs{until}")
+
+
+@app.command("cool")
+def run_cool():
+    config = load_config()
+    name = config.get("Name")
+    with spinner() as progress:
+        progress.add_task("[#ff4444]Cooling RED project...", total=None)
+        try:
+            compute_env_name = capacity.cool(name, config)
+        except (ValueError, LookupError) as e:
+            raise typer.BadParameter(str(e))
+    print(f"{compute_env_name} cooled down")
+
+
+@app.command("latency")
+def run_latency(
+    since: str = typer.Option(
+        "7d", "--since", help="jobs submitted since, relative (2h, 7d) or ISO 8601"
+    ),
+):
+    from rich.table import Table
+
+    config = load_config()
+    name = config.get("Name")
+    with spinner() as progress:
+        progress.add_task("[#ff4444]Reading RED jobs...", total=None)
+        latencies = capacity.queue_latencies(name, config, utility.parse_time(since))
+    table = Table(
+        title="Queue to start latency", title_justify="left", border_style="#ff4444"
+    )
+    for column in ("Capacity", "Jobs", "p50", "p90", "Max"):
+        table.add_column(column)
+    for state in ("warm", "cold"):
+        summary = capacity.latency_summary(latencies[state])
+        if summary is None:
+            table.add_row(state, "0", "-", "-", "-")
+            continue
+        table.add_row(
+            state,
+            str(summary["count"]),
+            *[f"{summary[x]:.1f}s" for x in ("p50", "p90", "max")],
+        )
+    print(table)
 
 
 @app.command("run")
@@ -152,9 +577,55 @@ def run_execute(
     detached: bool = typer.Option(
         False, "--detached", "-d", help="run job without tailing logs"
     ),
+    payload_file: str = typer.Option(
+        None,
+        "--payload-file",
+        "-f",
+        help="JSONL or CSV file of payloads (- for stdin), submits one job per payload",
+    ),
+    concurrency: int = typer.Option(
+        16, "--concurrency", min=1, help="concurrent submits for --payload-file"
+    ),
+    manifest: str = typer.Option(
+        None, "--manifest", "-m", help="jobId to payload manifest path (JSONL)"
+    ),
+    array: int = typer.Option(
+        None,
+        "--array",
+        "-a",
+        min=2,
+        max=constants.MAX_ARRAY_SIZE,
+        help="submit as an array job with N children",
+    ),
+    use_lambda: bool = typer.Option(
+        False,
+        "--lambda",
+        help="invoke the project's Lambda function instead of a Batch job",
+    ),
+    run_locally: bool = typer.Option(
+        False, "--local", help="run the job container on this machine"
+    ),
+    stub_secrets: bool = typer.Option(
+        False, "--stub-secrets", help="with --local, don't read ssmParam:: values"
+    ),
 ):
     config = load_config()
     name = config.get("Name")
+    if run_locally and (payload_file or array or cron or use_lambda):
+        raise typer.BadParameter(
+            "--local can't be combined with --payload-file, --array, --cron or --lambda"
+        )
+    use_lambda = use_lambda or config.get("Mode") == "lambda"
+    if use_lambda and (payload_file or array or cron):
+        raise typer.BadParameter(
+            "--payload-file, --array and --cron are only supported for Batch jobs"
+        )
+    if payload_file:
+        if payload != "{}" or cron or array:
+            raise typer.BadParameter(
+                "--payload-file can't be combined with --payload, --cron or --array"
+            )
+        return run_bulk_execute(name, payload_file, concurrency, manifest)
     try:
         json_data = json.loads(payload)
     except json.JSONDecodeError:
@@ -170,42 +641,194 @@ def run_execute(
         cron_name = utility.slugify(schedule_name)
         schedule.schedule_compute(name, cron_name, payload, cron_exp, is_once, config)
         print("RED project schedule created")
+    elif run_locally:
+        exit_code = local.run_local(name, config, payload, stub_secrets=stub_secrets)
+        if exit_code:
+            raise typer.Exit(code=exit_code)
+    elif use_lambda:
+        run_lambda(name, payload, detached)
     else:
         envs = batch.get_job_definition_environment_variables(name)
-        envs = [{"name": x.get("Name"), "value": x.get("Value")} for x in envs]
-        envs.extend([{"name": k, "value": v} for k, v in payload.items()])
+        envs = batch.build_environment(envs, payload)
+        if array:
+            envs.append({"name": "RED_ARRAY_SIZE", "value": str(array)})
         job_response = batch.submit_batch_job(
-            f"{name}_execution", name, name, environment=envs
+            f"{name}_execution", name, name, environment=envs, array_size=array
         )
         job_id = job_response["jobId"]
         print(f"RED project batch job submitted: {job_id}")
-        log_stream_name = None
         if detached:
             return
+        wait_for_job(name, job_id, array=bool(array))
 
-        # Wait for job to finish with spinner
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            transient=True,
-        ) as progress:
-            task = progress.add_task(
-                "[#ff4444]Waiting for job to complete...", total=None
+
+def run_lambda(name, payload, detached=False):
+    try:
+        if detached:
+            response = serverless.invoke(name, payload, asynchronous=True)
+            return print(f"RED project Lambda invoked: {response['request_id']}")
+        with spinner() as progress:
+            progress.add_task("[#ff4444]Running Lambda function...", total=None)
+            response = serverless.invoke(name, payload)
+    except LookupError as e:
+        raise typer.BadParameter(str(e))
+    sys.stdout.write(response["log"])
+    if response["error"]:
+        print(f"[red]Lambda {response['error']} error:[/red] {response['result']}")
+        raise typer.Exit(code=1)
+    print(f"Result: {response['result']}", markup=False, highlight=False)
+
+
+@app.command("map")
+def run_map(
+    input_list: str = typer.Argument(
+        ..., help="input list (JSON array, JSONL or one item per line)"
+    ),
+    shards: int = typer.Option(
+        None,
+        "--shards",
+        "-n",
+        min=1,
+        max=constants.MAX_ARRAY_SIZE,
+        help="number of array children (default: one per item)",
+    ),
+    payload: str = typer.Option("{}", "--payload", "-p", help="optional payload"),
+    detached: bool = typer.Option(
+        False, "--detached", "-d", help="run job without waiting for completion"
+    ),
+):
+    config = load_config()
+    name = config.get("Name")
+    try:
+        payload = json.loads(payload)
+        items = utility.read_items(input_list)
+    except (OSError, ValueError) as e:
+        raise typer.BadParameter(str(e))
+    if not isinstance(payload, dict):
+        raise typer.BadParameter("--payload must be a JSON object")
+    if not items:
+        return print("Input list is empty")
+    shards = min(shards or len(items), len(items), constants.MAX_ARRAY_SIZE)
+    envs = batch.get_job_definition_environment_variables(name)
+    envs = batch.build_environment(envs, payload)
+    try:
+        batch.check_overrides_size(envs)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    # Children fetch their own shard, the overrides only carry its location
+    envs.extend(staging.stage_map_input(name, items, shards))
+    job_response = batch.submit_batch_job(
+        f"{name}_map", name, name, environment=envs, array_size=shards
+    )
+    job_id = job_response["jobId"]
+    print(
+        f"RED project array job submitted: {job_id} ({len(items)} items, {shards} shards)"
+    )
+    if detached:
+        return
+    wait_for_job(name, job_id, array=shards > 1)
+
+
+def wait_for_job(name, job_id, array=False):
+    if not array:
+        # Stream the log live until the job finishes
+        return logs.follow_job(name, job_id)
+
+    # Wait for job to finish with spinner
+    with spinner() as progress:
+        task = progress.add_task("[#ff4444]Waiting for job to complete...", total=None)
+        for job, previous in batch.wait_for_jobs([job_id]):
+            progress.update(task, description=f"[#ff4444]Job {job['status']}")
+
+    # Array parents have no log stream, summarize the children instead
+    summary = job.get("arrayProperties", {}).get("statusSummary", {})
+    counts = ", ".join(f"{k}: {v}" for k, v in summary.items() if v)
+    print(f"Array job {job['status']} ({counts})")
+
+
+@app.command("wait")
+def run_wait(
+    job_ids: List[str] = typer.Argument(None, help="job ids to wait for"),
+    manifest: str = typer.Option(
+        None, "--manifest", "-m", help="wait for every job in a run manifest"
+    ),
+):
+    job_ids = list(job_ids or [])
+    if manifest:
+        with open(manifest, "r") as f:
+            job_ids.extend(json.loads(line).get("jobId") for line in f if line.strip())
+        job_ids = [x for x in job_ids if x]
+    if not job_ids:
+        raise typer.BadParameter("Provide job ids or a manifest")
+    from rich.markup import escape
+
+    failed = 0
+    done = 0
+    total = len(set(job_ids))
+    with spinner() as progress:
+        task = progress.add_task(f"[#ff4444]Waiting for {total} jobs...", total=None)
+        for job, previous in batch.wait_for_jobs(job_ids):
+            status = job["status"]
+            transition = f"{previous} -> {status}" if previous else status
+            progress.console.print(
+                escape(f"{job['jobId']} {job.get('jobName', '')}: {transition}")
             )
-            batch_client = boto3.client("batch")
-            while True:
-                response = batch_client.describe_jobs(jobs=[job_id])
-                job_status = response["jobs"][0]["status"]
-                if job_status in ["SUCCEEDED", "FAILED"]:
-                    log_stream_name = (
-                        response["jobs"][0].get("container", {}).get("logStreamName")
-                    )
-                    progress.update(task, description=f"[#ff4444]Job {job_status}")
-                    break
-                time.sleep(5)
+            if status in batch.TERMINAL_JOB_STATUSES or status == "NOT_FOUND":
+                done += 1
+                failed += status != "SUCCEEDED"
+                progress.update(
+                    task, description=f"[#ff4444]{done}/{total} jobs complete"
+                )
+    print(f"{done - failed} succeeded, {failed} failed")
+    if failed:
+        raise typer.Exit(1)
+
 
-        # Output the complete log
-        logs.get_log(name, log_stream_name)
+def run_bulk_execute(name, payload_file, concurrency, manifest):
+    # Resolve job definition environment once for every payload
+    envs = batch.get_job_definition_environment_variables(name)
+    manifest = manifest or f"{name}_manifest_{datetime.now():%Y%m%d%H%M%S}.jsonl"
+    submitted = 0
+    failed = 0
+    start = time.monotonic()
+    with (
+        open(manifest, "w") as manifest_file,
+        spinner() as progress,
+    ):
+        task = progress.add_task("[#ff4444]Submitting jobs...", total=None)
+        try:
+            results = batch.submit_batch_jobs(
+                f"{name}_execution",
+                name,
+                name,
+                utility.read_payloads(payload_file),
+                envs,
+                concurrency=concurrency,
+            )
+            for result in results:
+                if result.get("jobId"):
+                    submitted += 1
+                else:
+                    failed += 1
+                    progress.console.print(
+                        f"Failed to submit payload: {result.get('error')}"
+                    )
+                manifest_file.write(json.dumps(result) + "\n")
+                rate = submitted / max(time.monotonic() - start, 1e-6)
+                progress.update(
+                    task,
+                    description=f"[#ff4444]Submitted {submitted} jobs ({rate:.1f} jobs/s)",
+                )
+        except (OSError, ValueError) as e:
+            raise typer.BadParameter(
+                f"{e}, the {submitted} jobs submitted before it are in {manifest}"
+            )
+    elapsed = time.monotonic() - start
+    print(
+        f"RED project submitted {submitted} jobs in {elapsed:.1f}s "
+        f"({submitted / max(elapsed, 1e-6):.1f} jobs/s), {failed} failed"
+    )
+    print(f"Manifest written to {manifest}")
 
 
 # @app.command("pull")
@@ -243,11 +866,7 @@ def cron(
             choices=schedules,
             instruction="(Select at least 1)",
         ).ask()
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            transient=True,
-        ) as progress:
+        with spinner() as progress:
             task = progress.add_task(
                 "[#ff4444]Deleting selected RED schedules...", total=None
             )
@@ -266,43 +885,336 @@ def cron(
         print(response)
 
 
+def kill_steps(name, config, fast=False):
+    """
+    Teardown steps and their dependencies for graph.run_graph. The job queue
+    must be gone before the compute environments can be deleted, and they
+    need their service and instance roles until they are deleted.
+    Everything else is independent. With fast, steps nothing depends on
+    don't wait for AWS to confirm the deletion.
+    """
+    compute_env_names = batch.project_compute_environments(name) or [name]
+
+    steps = {
+        "schedule group": (
+            lambda _: schedule.delete_schedule_group(name, wait=not fast),
+            [],
+        ),
+        "schedule role": (lambda _: iam.delete_role(f"{name}_schedule"), []),
+        "ecr": (lambda _: ecr.delete_ecr_repo(name), []),
+        "log group": (lambda _: batch.delete_log_group(name), []),
+        "job definition": (lambda _: batch.deregister_job_definitions(name), []),
+        "disable job queue": (lambda _: batch.disable_job_queue(name), []),
+        "job queue": (
+            lambda _: batch.delete_job_queue(name),
+            ["disable job queue"],
+        ),
+    }
+    # A role from config is not RED's to delete
+    has_role = not config.get("Role")
+    try:
+        has_instance_role = batch.uses_ec2(name, config) and not config.get(
+            "InstanceRole"
+        )
+    except ValueError:
+        has_instance_role = True
+    wait = has_role or has_instance_role or not fast
+    for compute_env_name in compute_env_names:
+        steps[f"disable compute environment {compute_env_name}"] = (
+            functools.partial(
+                lambda ce, _: batch.disable_compute_environment(ce), compute_env_name
+            ),
+            [],
+        )
+        steps[f"compute environment {compute_env_name}"] = (
+            functools.partial(
+                lambda ce, _: batch.delete_compute_environment(ce, wait=wait),
+                compute_env_name,
+            ),
+            ["job queue", f"disable compute environment {compute_env_name}"],
+        )
+    compute_env_steps = [f"compute environment {x}" for x in compute_env_names]
+    if has_role:
+        steps["role"] = (
+            lambda _: batch.delete_batch_role(name),
+            compute_env_steps,
+        )
+    # Also cleans up after a project that used EC2 environments before
+    steps["instance role"] = (
+        lambda _: iam.delete_instance_profile(f"{name}_instance"),
+        compute_env_steps if has_instance_role else [],
+    )
+    steps["launch template"] = (
+        lambda _: batch.delete_launch_template(name),
+        compute_env_steps,
+    )
+    steps["staged inputs"] = (lambda _: staging.delete_staged_inputs(name), [])
+    if config.get("Mode") == "lambda":
+        steps["lambda function"] = (lambda _: serverless.delete_function(name), [])
+    return {step: (keep_going(step, fn), deps) for step, (fn, deps) in steps.items()}
+
+
+def keep_going(step, fn):
+    """
+    Wrap a teardown step so a failure is reported instead of cancelling the
+    steps that haven't run yet.
+    """
+
+    def run(inputs):
+        try:
+            return fn(inputs)
+        except batch.TEARDOWN_ERRORS as e:
+            print(f"[yellow]Couldn't delete {step}: {e}[/yellow]")
+
+    return run
+
+
 @app.command("kill")
 def run_kill(
     schedule_name: str = typer.Option("", "--schedule", "-s", help="schedule name"),
+    fast: bool = typer.Option(
+        False,
+        "--fast",
+        help="don't wait for deletions that no other step depends on",
+    ),
 ):
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[progress.description]{task.description}"),
-        transient=True,
-    ) as progress:
+    config = load_config()
+    name = config.get("Name")
+    with spinner() as progress:
         task = progress.add_task("[#ff4444]Deleting RED project...", total=None)
-        config = load_config()
-        name = config.get("Name")
         if schedule_name:
             progress.update(task, description=f"[#ff4444]Deleting Schedule")
             schedule_name = utility.slugify(schedule_name)
             schedule.delete_schedule(schedule_name, name)
             print("Deleted RED project schedule")
             return
-        progress.update(task, description=f"[#ff4444]Deleting Schedule Group")
-        schedule.delete_schedule_group(name)
-        progress.update(task, advance=50)
-        progress.update(task, description=f"[#ff4444]Deleting compute environment")
-        batch.delete_batch_environment(name)
-        progress.update(task, description=f"[#ff4444]Deleting ECR repo")
-        ecr.delete_ecr_repo(name)
 
-        print("Deleted RED project")
+        def on_update(running):
+            progress.update(task, description=f"[#ff4444]{', '.join(running)}")
 
+        results, timings = graph.run_graph(
+            kill_steps(name, config, fast=fast), on_update=on_update
+        )
+    print("Deleted RED project")
+    print_timings(timings, title="Teardown steps")
 
-@app.command()
-def log(latest: bool = typer.Option(False, "--latest", "-l", help="get latest log")):
+
+@log_app.callback(invoke_without_command=True)
+def log(
+    ctx: typer.Context,
+    latest: bool = typer.Option(False, "--latest", "-l", help="get latest log"),
+    follow: bool = typer.Option(
+        False, "--follow", "-F", help="stream the log until the job finishes"
+    ),
+    since: str = typer.Option(
+        None, "--since", help="start time, relative (30m, 2h, 7d) or ISO 8601"
+    ),
+    until: str = typer.Option(
+        None, "--until", help="end time, relative (30m, 2h, 7d) or ISO 8601"
+    ),
+    head: int = typer.Option(None, "--head", min=1, help="only the first N events"),
+    tail: int = typer.Option(None, "--tail", min=1, help="only the last N events"),
+    output_format: str = typer.Option(
+        "rich", "--format", help="output format: rich, text or jsonl"
+    ),
+    raw: bool = typer.Option(
+        False, "--raw", help="fast plain text output, same as --format text"
+    ),
+    pattern: str = typer.Option(
+        None, "--filter", "--grep", help="CloudWatch filter pattern, searched in AWS"
+    ),
+    streams: int = typer.Option(
+        None, "--streams", min=1, help="search the latest N log streams"
+    ),
+    group: bool = typer.Option(
+        False, "--group", help="search every stream in the project log group"
+    ),
+    count: bool = typer.Option(
+        False, "--count", help="only print the number of matches per stream"
+    ),
+    job: str = typer.Option(
+        None,
+        "--job",
+        "-j",
+        help="merged log of an array job, comma separated job ids or a run manifest",
+    ),
+):
+    if ctx.invoked_subcommand is not None:
+        return
+    if head and tail:
+        raise typer.BadParameter("--head and --tail can't be combined")
+    if follow and (since or until):
+        raise typer.BadParameter("--since and --until can't be combined with --follow")
     config = load_config()
     name = config.get("Name")
+    try:
+        start_time = utility.parse_time(since)
+        end_time = utility.parse_time(until)
+    except ValueError:
+        raise typer.BadParameter("Invalid --since/--until time")
+    output_format = "text" if raw else output_format
+    if output_format not in logs.OUTPUT_FORMATS:
+        raise typer.BadParameter(
+            f"--format must be one of {', '.join(logs.OUTPUT_FORMATS)}"
+        )
+    if job:
+        return run_log_jobs(name, job, start_time, end_time, output_format)
+    if pattern is not None:
+        return run_log_filter(
+            name,
+            pattern,
+            latest,
+            streams,
+            group,
+            count,
+            start_time,
+            end_time,
+            head,
+            tail,
+            output_format,
+        )
     if latest:
-        return logs.get_log(name, "_latest")
-    log = logs.list_logs(name)
-    logs.get_log(name, log.get("logStreamName"))
+        log_stream_name = logs.latest_log_stream(name) if follow else "_latest"
+    else:
+        log_stream_name = logs.list_logs(name).get("logStreamName")
+    if follow and log_stream_name:
+        job_id = logs.find_running_job(name, log_stream_name)
+        if job_id:
+            return logs.follow_job(name, job_id, output_format=output_format)
+        print("Job is no longer running, showing complete log")
+    logs.get_log(
+        name,
+        log_stream_name or "_latest",
+        start_time=start_time,
+        end_time=end_time,
+        head=head,
+        tail=tail,
+        output_format=output_format,
+    )
+
+
+@log_app.command("export")
+def log_export(
+    out: str = typer.Option(..., "--out", "-o", help="output directory"),
+    since: str = typer.Option(
+        None, "--since", help="start time, relative (30m, 2h, 7d) or ISO 8601"
+    ),
+    until: str = typer.Option(
+        None, "--until", help="end time, relative (30m, 2h, 7d) or ISO 8601"
+    ),
+    compression: str = typer.Option(
+        "gzip", "--compression", help="file compression: gzip or zstd"
+    ),
+    concurrency: int = typer.Option(
+        8, "--concurrency", min=1, help="streams downloaded at once"
+    ),
+):
+    config = load_config()
+    name = config.get("Name")
+    try:
+        start_time = utility.parse_time(since)
+        end_time = utility.parse_time(until)
+    except ValueError:
+        raise typer.BadParameter("Invalid --since/--until time")
+    if compression not in ("gzip", "zstd"):
+        raise typer.BadParameter("--compression must be gzip or zstd")
+    exported = 0
+    skipped = 0
+    failed = 0
+    total_bytes = 0
+    start = time.monotonic()
+    with spinner() as progress:
+        task = progress.add_task("[#ff4444]Exporting logs...", total=None)
+        try:
+            for log_stream_name, size, was_skipped, error in logs.export_logs(
+                name, out, start_time, end_time, compression, concurrency
+            ):
+                if error:
+                    failed += 1
+                    progress.console.print(
+                        f"Failed to export {log_stream_name}: {error}", markup=False
+                    )
+                    continue
+                skipped += was_skipped
+                exported += not was_skipped
+                total_bytes += size
+                rate = total_bytes / 1e6 / max(time.monotonic() - start, 1e-6)
+                progress.update(
+                    task,
+                    description=f"[#ff4444]Exported {exported} streams ({rate:.1f} MB/s)",
+                )
+        except RuntimeError as e:
+            raise typer.BadParameter(str(e))
+    elapsed = time.monotonic() - start
+    print(
+        f"Exported {exported} streams, {total_bytes / 1e6:.1f} MB written in "
+        f"{elapsed:.1f}s "
+        f"({total_bytes / 1e6 / max(elapsed, 1e-6):.1f} MB/s), "
+        f"{skipped} already exported, {failed} failed"
+    )
+    if failed:
+        raise typer.Exit(1)
+
+
+def run_log_jobs(name, job, start_time, end_time, output_format):
+    if os.path.exists(job):
+        with open(job, "r") as f:
+            job_ids = [json.loads(line).get("jobId") for line in f if line.strip()]
+    else:
+        job_ids = [x.strip() for x in job.split(",")]
+    job_ids = [x for x in job_ids if x]
+    if not job_ids:
+        raise typer.BadParameter("No job ids found")
+    streams = batch.resolve_log_streams(job_ids)
+    if not streams:
+        return print("No logs")
+    logs.merge_logs(
+        name,
+        streams,
+        start_time=start_time,
+        end_time=end_time,
+        output_format=output_format,
+    )
+
+
+def run_log_filter(
+    name,
+    pattern,
+    latest,
+    streams,
+    group,
+    count,
+    start_time,
+    end_time,
+    head,
+    tail,
+    output_format,
+):
+    if group:
+        log_stream_names = None
+    elif streams or latest:
+        log_stream_names = logs.latest_log_streams(name, streams or 1)
+        if not log_stream_names:
+            return print("No logs")
+    else:
+        log_stream_names = [logs.list_logs(name).get("logStreamName")]
+    if count:
+        counts = logs.count_matches(
+            name, pattern, log_stream_names, start_time, end_time
+        )
+        for log_stream_name, matches in counts.items():
+            print(f"{matches:>8} {log_stream_name}", markup=False)
+        return print(f"{sum(counts.values()):>8} total")
+    logs.filter_log(
+        name,
+        pattern,
+        log_stream_names,
+        start_time=start_time,
+        end_time=end_time,
+        head=head,
+        tail=tail,
+        output_format=output_format,
+    )
 
 
 @app.callback(invoke_without_command=True)
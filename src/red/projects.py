@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import sh
+
+from red import batch, graph
+from red.clients import client
+from red.context import dockerfile_instructions
+from red.docker import PLATFORMS
+from red.utility import print
+
+# Steps that run docker, limited by the docker slots instead of the AWS ones
+DOCKER_STEPS = ("image", "package")
+
+
+def base_images(configs):
+    """
+    Unique (image, platform) pairs the projects' Dockerfiles build FROM,
+    excluding build stages and scratch.
+    """
+    images = set()
+    for config in configs:
+        dockerfile = config.get("DockerfilePath", "Dockerfile")
+        if not os.path.exists(dockerfile):
+            continue
+        platform = PLATFORMS.get(config.get("Arch", "x86_64"), "linux/amd64")
+        stages = set()
+        for instruction, args in dockerfile_instructions(dockerfile):
+            if instruction != "FROM":
+                continue
+            parts = [x for x in args.split() if not x.startswith("--")]
+            image = parts[0]
+            if image not in stages and image != "scratch" and "$" not in image:
+                images.add((image, platform))
+            if len(parts) >= 3 and parts[1].lower() == "as":
+                stages.add(parts[2])
+    return sorted(images)
+
+
+def pull_base_images(images, slot):
+    """
+    Pull each shared base image once so concurrent builds reuse its layers
+    instead of pulling it per project.
+    """
+
+    def pull(image, platform):
+        with slot:
+            try:
+                sh.docker.pull("--platform", platform, image, _out=None, _err=None)
+            except sh.ErrorReturnCode:
+                print(f"[yellow]Couldn't pre-pull {image}[/yellow]")
+
+    with ThreadPoolExecutor(max_workers=max(1, len(images))) as executor:
+        list(executor.map(lambda x: pull(*x), images))
+
+
+def _with_slot(slot, fn):
+    def run(inputs):
+        with slot:
+            return fn(inputs)
+
+    return run
+
+
+def deploy_projects(
+    project_steps, configs, parallel=4, docker_slots=2, aws_slots=16, on_update=None
+):
+    """
+    Deploy several projects concurrently, each as its own step graph. Docker
+    and AWS steps draw from separate slot pools shared by every project.
+
+    :param project_steps: dict of project name to its graph.run_graph steps,
+        built on the calling thread
+    :param configs: the projects' configs, used to pre-pull base images
+    :param on_update: optional callback receiving (finished, running names)
+    :return: dict of project name to {"status", "duration", "timings", "error"}
+    """
+    docker_slot = threading.Semaphore(docker_slots)
+    aws_slot = threading.Semaphore(aws_slots)
+    images = base_images(configs)
+    if images:
+        print(f"Pulling {len(images)} base images")
+        pull_base_images(images, docker_slot)
+
+    results = {}
+    running = set()
+    lock = threading.Lock()
+
+    def deploy(name, steps):
+        steps = {
+            step: (
+                _with_slot(docker_slot if step in DOCKER_STEPS else aws_slot, fn),
+                deps,
+            )
+            for step, (fn, deps) in steps.items()
+        }
+        with lock:
+            running.add(name)
+        start = time.monotonic()
+        try:
+            _, timings = graph.run_graph(steps)
+            return {
+                "status": "deployed",
+                "duration": time.monotonic() - start,
+                "timings": timings,
+                "error": None,
+            }
+        # A failing step can also exit, catch_error calls sys.exit
+        except BaseException as e:
+            return {
+                "status": "failed",
+                "duration": time.monotonic() - start,
+                "timings": {},
+                "error": str(e) or type(e).__name__,
+            }
+        finally:
+            with lock:
+                running.discard(name)
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = {
+            executor.submit(deploy, name, steps): name
+            for name, steps in project_steps.items()
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if on_update:
+                with lock:
+                    on_update(len(results), sorted(running))
+    return results
+
+
+def project_status(name, config):
+    """
+    Current state of a project's deployed resources.
+    """
+    status = {"mode": config.get("Mode", "batch")}
+    ecr_client = client("ecr")
+    try:
+        image = ecr_client.describe_images(
+            repositoryName=name, imageIds=[{"imageTag": "latest"}]
+        )["imageDetails"][0]
+        status["image"] = image["imagePushedAt"].strftime("%Y-%m-%d %H:%M")
+    except (
+        ecr_client.exceptions.RepositoryNotFoundException,
+        ecr_client.exceptions.ImageNotFoundException,
+    ):
+        status["image"] = "-"
+    if status["mode"] == "lambda":
+        lambda_client = client("lambda")
+        try:
+            function = lambda_client.get_function_configuration(FunctionName=name)
+            status["function"] = (
+                f"{function.get('State')} {function.get('LastUpdateStatus')}"
+            )
+        except lambda_client.exceptions.ResourceNotFoundException:
+            status["function"] = "-"
+        return status
+    batch_client = client("batch")
+    env_names = batch.project_compute_environments(name)
+    envs = (
+        batch_client.describe_compute_environments(computeEnvironments=env_names)[
+            "computeEnvironments"
+        ]
+        if env_names
+        else []
+    )
+    status["compute environment"] = (
+        ", ".join(
+            f"{x['computeEnvironmentName']} {x['status']} {x['state']}" for x in envs
+        )
+        or "-"
+    )
+    queues = batch_client.describe_job_queues(jobQueues=[name])["jobQueues"]
+    status["job queue"] = (
+        f"{queues[0]['status']} {queues[0]['state']}" if queues else "-"
+    )
+    definitions = batch_client.describe_job_definitions(
+        jobDefinitionName=name, status="ACTIVE"
+    )["jobDefinitions"]
+    status["job definition"] = (
+        str(max(x["revision"] for x in definitions)) if definitions else "-"
+    )
+    return status
+
+
+def projects_status(configs, concurrency=16):
+    """
+    project_status for several projects concurrently, keyed by project name.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            name: executor.submit(project_status, name, config)
+            for name, config in configs.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
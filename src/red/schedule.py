@@ -1,34 +1,27 @@
 import json
-import os
 import time
-from zoneinfo import ZoneInfo
 
-import boto3
-from rich import box
-from rich.console import Console
-from rich.markdown import Markdown
-from rich.panel import Panel
-from rich.table import Table
-from rich.text import Text
-
-from red import batch, iam
+from red import batch, iam, waiter
+from red.clients import client
 from red.utility import print
 
 
 def create_schedule_group(name):
     try:
-        scheduler_client = boto3.client("scheduler")
+        scheduler_client = client("scheduler")
         response = scheduler_client.create_schedule_group(Name=name)
-        time.sleep(5)
+
+        def active():
+            state = scheduler_client.get_schedule_group(Name=name)["State"]
+            return state == "ACTIVE", state
+
+        waiter.wait_for(active, f"schedule group {name}", quiet=True)
         return name
     except scheduler_client.exceptions.ConflictException:
         return name
 
 
-def schedule_compute(function_name, cron_name, payload, cron, onetime, config):
-    scheduler_client = boto3.client("scheduler")
-    create_schedule_group(function_name)
-    role_name = function_name + "_schedule"
+def ensure_schedule_role(function_name):
     trust_policy = {
         "Version": "2012-10-17",
         "Statement": [
@@ -48,31 +41,53 @@ def schedule_compute(function_name, cron_name, payload, cron, onetime, config):
                     "batch:SubmitJob",
                     "batch:DescribeJobDefinitions",
                     "batch:DescribeJobQueues",
+                    "batch:UpdateComputeEnvironment",
                     "lambda:InvokeFunction",
                 ],
                 "Resource": ["*"],
             }
         ],
     }
-    role_arn = iam.create_role(
-        role_name,
+    return iam.create_role(
+        function_name + "_schedule",
         trust_policy,
         None,
         custom_policy_name=function_name + "_schedule_policy",
         custom_policy_document=custom_policy_name,
     )
-    time.sleep(10)
+
+
+def _create_schedule(schedule_params):
+    scheduler_client = client("scheduler")
+
+    # A new role takes a few seconds before the scheduler can assume it
+    def create():
+        try:
+            scheduler_client.create_schedule(**schedule_params)
+            return True, "CREATED"
+        except scheduler_client.exceptions.ValidationException as e:
+            if "role" not in str(e).lower():
+                raise
+            return False, "ROLE PROPAGATING"
+
+    waiter.wait_for(create, f"schedule {schedule_params['Name']}", timeout=120)
+
+
+def schedule_compute(function_name, cron_name, payload, cron, onetime, config):
+    scheduler_client = client("scheduler")
+    create_schedule_group(function_name)
+    role_arn = ensure_schedule_role(function_name)
     schedule_expression = f"cron({cron})" if cron else f"at({onetime})"
     # Get the current terminal's time zone
     current_timezone = time.tzname[0]
-    sts_client = boto3.client("sts")
+    sts_client = client("sts")
     account_id = sts_client.get_caller_identity()["Account"]
     job = f"arn:aws:batch:{scheduler_client.meta.region_name}:{account_id}:job-definition/{function_name}"
     queue = f"arn:aws:batch:{scheduler_client.meta.region_name}:{account_id}:job-queue/{function_name}"
     compute_env = f"arn:aws:batch:{scheduler_client.meta.region_name}:{account_id}:compute-environment/{function_name}"
     envs = batch.get_job_definition_environment_variables(function_name)
     envs.extend([{"Name": k, "Value": v} for k, v in payload.items()])
-    schedule_response = scheduler_client.create_schedule(
+    schedule_params = dict(
         Name=cron_name,
         ActionAfterCompletion="NONE" if not onetime else "DELETE",
         GroupName=function_name,
@@ -93,20 +108,76 @@ def schedule_compute(function_name, cron_name, payload, cron, onetime, config):
         },
         State="ENABLED",
     )
+    _create_schedule(schedule_params)
     print(f"Schedule created: {cron_name}")
 
 
+def cool_down_schedule_name(compute_env_name):
+    return f"cool-{compute_env_name}"
+
+
+def schedule_cool_down(function_name, compute_env_name, min_vcpus, at):
+    """
+    Scale the compute environment back to min_vcpus at a UTC datetime, even
+    if nothing is running locally by then.
+    """
+    create_schedule_group(function_name)
+    delete_cool_down(function_name, compute_env_name)
+    role_arn = ensure_schedule_role(function_name)
+    _create_schedule(
+        dict(
+            Name=cool_down_schedule_name(compute_env_name),
+            ActionAfterCompletion="DELETE",
+            GroupName=function_name,
+            ScheduleExpression=f"at({at.strftime('%Y-%m-%dT%H:%M:%S')})",
+            ScheduleExpressionTimezone="UTC",
+            FlexibleTimeWindow={"Mode": "OFF"},
+            Target={
+                "Arn": "arn:aws:scheduler:::aws-sdk:batch:updateComputeEnvironment",
+                "RoleArn": role_arn,
+                "Input": json.dumps(
+                    {
+                        "ComputeEnvironment": compute_env_name,
+                        "ComputeResources": {"MinvCpus": min_vcpus},
+                    }
+                ),
+            },
+            State="ENABLED",
+        )
+    )
+
+
+def delete_cool_down(function_name, compute_env_name):
+    scheduler_client = client("scheduler")
+    try:
+        scheduler_client.delete_schedule(
+            GroupName=function_name, Name=cool_down_schedule_name(compute_env_name)
+        )
+    except scheduler_client.exceptions.ResourceNotFoundException:
+        pass
+
+
 def delete_schedule(schedule, name):
-    scheduler_client = boto3.client("scheduler")
+    scheduler_client = client("scheduler")
     response = scheduler_client.delete_schedule(GroupName=name, Name=schedule)
     print(f"Deleted schedule: {schedule}")
 
 
-def delete_schedule_group(name):
+def delete_schedule_group(name, wait=True):
     try:
-        scheduler_client = boto3.client("scheduler")
+        scheduler_client = client("scheduler")
         response = scheduler_client.delete_schedule_group(Name=name)
-        time.sleep(5)
+        if not wait:
+            return print(f"Deleting schedule group: {name}")
+
+        def deleted():
+            try:
+                state = scheduler_client.get_schedule_group(Name=name)["State"]
+                return False, state
+            except scheduler_client.exceptions.ResourceNotFoundException:
+                return True, "DELETED"
+
+        waiter.wait_for(deleted, f"schedule group {name}", quiet=True)
         print(f"Deleted schedule group: {name}")
     except:
         ...
@@ -114,7 +185,7 @@ def delete_schedule_group(name):
 
 def list_schedules(name):
     try:
-        scheduler_client = boto3.client("scheduler")
+        scheduler_client = client("scheduler")
         response = scheduler_client.list_schedules(GroupName=name).get("Schedules", [])
         schedules = []
         for index, x in enumerate(response):
@@ -128,7 +199,7 @@ def list_schedules(name):
 
 def get_schedule(name, function_name):
     try:
-        scheduler_client = boto3.client("scheduler")
+        scheduler_client = client("scheduler")
         response = scheduler_client.get_schedule(GroupName=function_name, Name=name)
         return response
     except:
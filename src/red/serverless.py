@@ -0,0 +1,272 @@
+import base64
+import copy
+import hashlib
+import json
+
+from red import constants, waiter
+from red.clients import client
+from red.iam import create_role, delete_role
+from red.utility import print
+
+LAMBDA_BASIC_POLICY = "arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"
+# Direct uploads are limited to 50 MB, larger packages need the image mode
+MAX_ZIP_BYTES = 50 * 1024 * 1024
+MAX_TIMEOUT = 900
+MAX_MEMORY = 10240
+MAX_EPHEMERAL_STORAGE = 10240
+
+
+def _lambda_client():
+    # A synchronous invoke can run for the full Lambda timeout, and a retried
+    # invoke would run the job twice
+    return client(
+        "lambda",
+        read_timeout=MAX_TIMEOUT + 60,
+        retries={"max_attempts": 1, "mode": "standard"},
+    )
+
+
+def ssm_parameters(config):
+    """
+    Env entries stored in SSM, as environment variable name to parameter ARN.
+    """
+    parameters = {
+        k: v[10:].lstrip("/")
+        for k, v in config.get("Env", {}).items()
+        if isinstance(v, str) and v.startswith("ssmParam::")
+    }
+    if not parameters:
+        return {}
+    region = client("lambda").meta.region_name
+    account_id = client("sts").get_caller_identity()["Account"]
+    return {
+        k: f"arn:aws:ssm:{region}:{account_id}:parameter/{v}"
+        for k, v in parameters.items()
+    }
+
+
+def ensure_lambda_role(name, config, secrets):
+    role = config.get("LambdaRole")
+    if role:
+        return role
+    trust_policy = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Principal": {"Service": "lambda.amazonaws.com"},
+                "Action": "sts:AssumeRole",
+            }
+        ],
+    }
+    policy = copy.deepcopy(
+        config.get("IamPolicy") or {"Version": "2012-10-17", "Statement": []}
+    )
+    if secrets:
+        policy["Statement"].append(
+            {
+                "Effect": "Allow",
+                "Action": ["ssm:GetParameter"],
+                "Resource": sorted(secrets.values()),
+            }
+        )
+    role = create_role(
+        f"{name}_lambda",
+        trust_policy,
+        LAMBDA_BASIC_POLICY,
+        f"{name}_lambda_policy",
+        policy if policy["Statement"] else None,
+    )
+    if role is None:
+        raise RuntimeError(
+            f"Couldn't create the IAM role {name}_lambda, set LambdaRole in .red "
+            "or fix the IAM error above"
+        )
+    return role
+
+
+def function_settings(name, role, log_group, config, secrets, image=False):
+    """
+    create_function/update_function_configuration parameters from .red,
+    with the Batch sizes clamped to the Lambda limits.
+    """
+    variables = {
+        k: str(v)
+        for k, v in config.get("Env", {}).items()
+        if not (isinstance(v, str) and v.startswith("ssmParam::"))
+    }
+    if secrets:
+        variables["RED_SSM_PARAMS"] = json.dumps(secrets, sort_keys=True)
+    settings = {
+        "FunctionName": name,
+        "Role": role,
+        "Timeout": min(int(config.get("Timeout", MAX_TIMEOUT)), MAX_TIMEOUT),
+        "MemorySize": min(int(config.get("MemorySize", 1024)), MAX_MEMORY),
+        "EphemeralStorage": {
+            "Size": min(int(config.get("StorageSize", 1)) * 1024, MAX_EPHEMERAL_STORAGE)
+        },
+        "Environment": {"Variables": variables},
+        # Same log group as the Batch jobs, so red log works for both
+        "LoggingConfig": {"LogFormat": "Text", "LogGroup": log_group},
+    }
+    if not image:
+        settings["Runtime"] = f"python{config.get('Runtime', '3.12')}"
+        settings["Handler"] = (
+            f"{constants.LAMBDA_HANDLER_FILE.removesuffix('.py')}.lambda_handler"
+        )
+    return settings
+
+
+def _settings_changed(current, settings):
+    for key, value in settings.items():
+        if key == "Environment":
+            if (
+                current.get("Environment", {}).get("Variables", {})
+                != value["Variables"]
+            ):
+                return True
+        elif key == "LoggingConfig":
+            if current.get("LoggingConfig", {}).get("LogGroup") != value["LogGroup"]:
+                return True
+        elif current.get(key) != value:
+            return True
+    return False
+
+
+def wait_for_function(name):
+    lambda_client = client("lambda")
+
+    def check():
+        function = lambda_client.get_function_configuration(FunctionName=name)
+        state = function.get("State")
+        update = function.get("LastUpdateStatus")
+        if "Failed" in (state, update):
+            raise RuntimeError(
+                function.get("StateReason") or function.get("LastUpdateStatusReason")
+            )
+        return state == "Active" and update in (None, "Successful"), (
+            f"{state}/{update}"
+        )
+
+    return waiter.wait_for(check, f"Lambda function {name}", quiet=True)
+
+
+def deploy_function(
+    name, role, log_group, config, secrets, package=None, image_uri=None
+):
+    """
+    Create or update the project's Lambda function from a zip package or an
+    image in ECR. Code and configuration are only updated when they changed.
+    Returns the function ARN.
+    """
+    lambda_client = client("lambda")
+    settings = function_settings(
+        name, role, log_group, config, secrets, image=bool(image_uri)
+    )
+    architectures = [
+        "arm64" if config.get("Arch") in ("arm64", "aarch64") else "x86_64"
+    ]
+    if image_uri:
+        code = {"ImageUri": image_uri}
+    else:
+        with open(package, "rb") as f:
+            zip_bytes = f.read()
+        if len(zip_bytes) > MAX_ZIP_BYTES:
+            raise RuntimeError(
+                f"{package} is over 50 MB, set LambdaPackage to image to deploy "
+                "the function from the ECR image instead"
+            )
+        code = {"ZipFile": zip_bytes}
+        code_sha = base64.b64encode(hashlib.sha256(zip_bytes).digest()).decode()
+
+    try:
+        current = lambda_client.get_function(FunctionName=name)
+    except lambda_client.exceptions.ResourceNotFoundException:
+        current = None
+
+    if current is None:
+        print(f"Creating Lambda function: {name}")
+
+        def create():
+            # A new role takes a few seconds before Lambda can assume it
+            try:
+                response = lambda_client.create_function(
+                    **settings,
+                    Code=code,
+                    PackageType="Image" if image_uri else "Zip",
+                    Architectures=architectures,
+                )
+                return True, response["FunctionArn"]
+            except lambda_client.exceptions.InvalidParameterValueException as e:
+                if "role" not in str(e).lower():
+                    raise
+                return False, "ROLE NOT ASSUMABLE YET"
+
+        function_arn = waiter.wait_for(create, "Lambda role", timeout=120)
+        wait_for_function(name)
+        return function_arn
+
+    configuration = current["Configuration"]
+    if image_uri:
+        code_changed = current.get("Code", {}).get("ImageUri") != image_uri
+    else:
+        code_changed = configuration.get("CodeSha256") != code_sha
+    code_changed = code_changed or configuration.get("Architectures") != architectures
+    if code_changed:
+        print(f"Updating Lambda function code: {name}")
+        lambda_client.update_function_code(
+            FunctionName=name, Architectures=architectures, **code
+        )
+        wait_for_function(name)
+    if _settings_changed(configuration, settings):
+        print(f"Updating Lambda function configuration: {name}")
+        lambda_client.update_function_configuration(**settings)
+        wait_for_function(name)
+    return configuration["FunctionArn"]
+
+
+def invoke(name, payload, asynchronous=False):
+    """
+    Invoke the function with the payload as its event.
+
+    :return: dict with the request id, and for synchronous invokes the
+        result, the function error if any and the tail of the log
+    """
+    lambda_client = _lambda_client()
+    body = json.dumps(payload).encode()
+    try:
+        if asynchronous:
+            response = lambda_client.invoke(
+                FunctionName=name, InvocationType="Event", Payload=body
+            )
+            return {"request_id": response["ResponseMetadata"]["RequestId"]}
+        response = lambda_client.invoke(
+            FunctionName=name,
+            InvocationType="RequestResponse",
+            LogType="Tail",
+            Payload=body,
+        )
+    except lambda_client.exceptions.ResourceNotFoundException:
+        raise LookupError(
+            f'Lambda function {name} not found, deploy with "Mode": "lambda" first'
+        )
+    return {
+        "request_id": response["ResponseMetadata"]["RequestId"],
+        "result": response["Payload"].read().decode(),
+        "error": response.get("FunctionError"),
+        # Lambda returns the last 4 KB of the log
+        "log": base64.b64decode(response.get("LogResult", "")).decode(errors="replace"),
+    }
+
+
+def delete_function(name):
+    lambda_client = client("lambda")
+    try:
+        print(f"Deleting Lambda function: {name}")
+        lambda_client.delete_function(FunctionName=name)
+    except lambda_client.exceptions.ResourceNotFoundException:
+        print("Skipping Lambda function")
+    try:
+        delete_role(f"{name}_lambda")
+    except Exception:
+        print("Couldn't delete Lambda IAM role")
@@ -0,0 +1,140 @@
+import json
+import uuid
+
+from botocore.exceptions import ClientError
+
+from red.clients import client
+from red.utility import print
+
+# Staged inputs are only read while their job runs
+EXPIRE_DAYS = 7
+# Width of each shard offset at the start of a staged map input
+OFFSET_WIDTH = 16
+
+
+def bucket_name(account_id, region):
+    return f"red-staging-{account_id}-{region}"
+
+
+def project_bucket():
+    """
+    (bucket, region) of the staging bucket shared by the projects of this
+    account and region.
+    """
+    region = client("s3").meta.region_name
+    account_id = client("sts").get_caller_identity()["Account"]
+    return bucket_name(account_id, region), region
+
+
+def ensure_bucket(bucket, region):
+    s3_client = client("s3")
+    try:
+        s3_client.head_bucket(Bucket=bucket)
+        return bucket
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchBucket"):
+            raise
+    print(f"Creating staging bucket: {bucket}")
+    params = {"Bucket": bucket}
+    # us-east-1 rejects its own name as a location constraint
+    if region != "us-east-1":
+        params["CreateBucketConfiguration"] = {"LocationConstraint": region}
+    try:
+        s3_client.create_bucket(**params)
+    except s3_client.exceptions.BucketAlreadyOwnedByYou:
+        return bucket
+    s3_client.get_waiter("bucket_exists").wait(Bucket=bucket)
+    s3_client.put_bucket_lifecycle_configuration(
+        Bucket=bucket,
+        LifecycleConfiguration={
+            "Rules": [
+                {
+                    "ID": "expire-staged-inputs",
+                    "Filter": {"Prefix": ""},
+                    "Status": "Enabled",
+                    "Expiration": {"Days": EXPIRE_DAYS},
+                }
+            ]
+        },
+    )
+    return bucket
+
+
+def shard_items(items, shards):
+    """
+    Split items into shards contiguous slices whose sizes differ by at most
+    one, the same split get_shard reads back.
+    """
+    return [
+        items[len(items) * index // shards : len(items) * (index + 1) // shards]
+        for index in range(shards)
+    ]
+
+
+def pack_shards(items, shards):
+    """
+    One object holding every shard as a JSON array, preceded by the byte
+    offset of each shard and of the end so a child can read its own shard
+    with two ranged GETs.
+    """
+    chunks = [
+        json.dumps(shard, separators=(",", ":")).encode()
+        for shard in shard_items(items, shards)
+    ]
+    offset = OFFSET_WIDTH * (len(chunks) + 1)
+    offsets = []
+    for chunk in chunks:
+        offsets.append(offset)
+        offset += len(chunk)
+    offsets.append(offset)
+    header = b"".join(str(x).zfill(OFFSET_WIDTH).encode() for x in offsets)
+    return header + b"".join(chunks)
+
+
+def stage_map_input(function_name, items, shards):
+    """
+    Upload the sharded input list of a red map job. Returns the environment
+    that points the array children at it.
+    """
+    bucket, region = project_bucket()
+    ensure_bucket(bucket, region)
+    key = f"{function_name}/map/{uuid.uuid4().hex}.json"
+    client("s3").put_object(Bucket=bucket, Key=key, Body=pack_shards(items, shards))
+    return [
+        {"name": "RED_MAP_BUCKET", "value": bucket},
+        {"name": "RED_MAP_KEY", "value": key},
+        {"name": "RED_MAP_REGION", "value": region},
+    ]
+
+
+def read_policy(function_name):
+    """
+    Inline policy letting the project's jobs read their staged inputs.
+    """
+    bucket, _ = project_bucket()
+    return {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Action": ["s3:GetObject"],
+                "Resource": [f"arn:aws:s3:::{bucket}/{function_name}/*"],
+            }
+        ],
+    }
+
+
+def delete_staged_inputs(function_name):
+    s3_client = client("s3")
+    bucket, _ = project_bucket()
+    print(f"Deleting staged inputs: {bucket}/{function_name}/")
+    paginator = s3_client.get_paginator("list_objects_v2")
+    try:
+        for page in paginator.paginate(Bucket=bucket, Prefix=f"{function_name}/"):
+            objects = [{"Key": x["Key"]} for x in page.get("Contents", [])]
+            if objects:
+                s3_client.delete_objects(
+                    Bucket=bucket, Delete={"Objects": objects, "Quiet": True}
+                )
+    except s3_client.exceptions.NoSuchBucket:
+        return
@@ -1,9 +1,13 @@
+import csv
 import functools
+import importlib
 import json
 import os
 import re
 import sys
+import tempfile
 import traceback
+import types
 from datetime import datetime, timezone
 
 from rich.console import Console
@@ -12,25 +16,196 @@ console = Console()
 print = console.print
 
 
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, attr):
+        # import_module holds the import lock until the module is fully
+        # executed, so threads touching the module first are safe
+        module = self.__dict__.get("_module")
+        if module is None:
+            module = self.__dict__["_module"] = importlib.import_module(self.__name__)
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    """
+    Return a module that is only imported on first attribute access, from
+    any thread.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name)
+
+
+def spinner():
+    from rich.progress import Progress, SpinnerColumn, TextColumn
+
+    return Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        transient=True,
+    )
+
+
+def cache_dir():
+    """Directory for RED's local caches, created on first use."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    path = os.path.join(base, "red")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_json(path, data):
+    """
+    Replace path with data as JSON through a unique temporary file, so
+    readers and concurrent writers never see a partial file.
+    """
+    with tempfile.NamedTemporaryFile(
+        "w", dir=os.path.dirname(path), prefix=".tmp-", delete=False
+    ) as f:
+        try:
+            json.dump(data, f)
+        except BaseException:
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
+
+
 def milliseconds_to_date(milliseconds):
     seconds = milliseconds / 1000
     date = datetime.fromtimestamp(seconds, tz=timezone.utc)
     return date.strftime("%Y-%m-%d %H:%M:%S UTC")
 
 
-def load_config():
+def parse_duration(value):
+    """
+    Parse a duration such as 30s, 15m, 2h, 7d or 1w into seconds, or None if
+    value isn't one.
+    """
+    match = re.fullmatch(r"(\d+)([smhdw])", value.strip())
+    if not match:
+        return None
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    return int(match.group(1)) * units[match.group(2)]
+
+
+def parse_time(value):
+    """
+    Parse a relative duration (e.g. 30s, 15m, 2h, 7d) measured back from now
+    or an ISO 8601 datetime into epoch milliseconds.
+    """
+    if value is None:
+        return None
+    seconds = parse_duration(value)
+    if seconds is not None:
+        return int((datetime.now(timezone.utc).timestamp() - seconds) * 1000)
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp() * 1000)
+
+
+# .red paths are relative to the project directory
+PROJECT_PATHS = {"BuildContext": ".", "DockerfilePath": "Dockerfile"}
+
+
+def read_config(path=".red"):
+    """
+    Read a project's .red file, raising ValueError when it can't be used.
+    Paths in a .red file outside the current directory are resolved against
+    that file's directory.
+    """
     try:
-        with open(".red", "r") as f:
+        with open(path, "r") as f:
             config = json.load(f)
-        if not config.get("Name"):
-            print("Name must be defined in .red file")
-            sys.exit()
-        return config
-    except:
-        print("Error with .red file")
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Error with {path} file: {e}")
+    if not isinstance(config, dict) or not config.get("Name"):
+        raise ValueError(f"Name must be defined in {path}")
+    project_dir = os.path.dirname(os.path.abspath(path))
+    if project_dir != os.getcwd():
+        for key, default in PROJECT_PATHS.items():
+            config[key] = os.path.normpath(
+                os.path.join(project_dir, config.get(key, default))
+            )
+    return config
+
+
+def load_config(path=".red"):
+    """
+    read_config for commands, printing the problem and exiting on a bad file.
+    """
+    try:
+        return read_config(path)
+    except ValueError as e:
+        print(str(e))
         sys.exit(0)
 
 
+def find_projects(root, skip=(".git", "node_modules", "__pycache__")):
+    """
+    Paths of every .red file below root, skipping hidden and dependency
+    directories.
+    """
+    projects = []
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = sorted(
+            d
+            for d in dirs
+            if d not in skip
+            and not d.startswith(".")
+            and not os.path.exists(os.path.join(directory, d, "pyvenv.cfg"))
+        )
+        if ".red" in files:
+            projects.append(os.path.join(directory, ".red"))
+    return projects
+
+
+def read_payloads(path):
+    """
+    Stream payload dicts from a JSONL or CSV file, or stdin when path is "-".
+    """
+    if path == "-":
+        yield from _parse_payloads(sys.stdin, csv_format=False)
+        return
+    with open(path, "r", newline="") as f:
+        yield from _parse_payloads(f, csv_format=path.lower().endswith(".csv"))
+
+
+def _parse_payloads(f, csv_format):
+    if csv_format:
+        yield from csv.DictReader(f)
+        return
+    for line_number, line in enumerate(f, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            payload = json.loads(line)
+        except json.JSONDecodeError:
+            raise ValueError(f"Invalid JSON on line {line_number}")
+        if not isinstance(payload, dict):
+            raise ValueError(f"Payload on line {line_number} must be a JSON object")
+        yield payload
+
+
+def read_items(path):
+    """
+    Read an input list from a JSON array, a JSONL file or plain lines.
+    """
+    with open(path, "r") as f:
+        if path.lower().endswith(".json"):
+            items = json.load(f)
+            if not isinstance(items, list):
+                raise ValueError("JSON input list must be an array")
+            return items
+        lines = [line.strip() for line in f if line.strip()]
+    if path.lower().endswith(".jsonl"):
+        return [json.loads(line) for line in lines]
+    return lines
+
+
 def slugify(text):
     # Convert the text to lowercase
     text = text.lower()
@@ -0,0 +1,45 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from red.utility import print
+
+
+def wait_for(
+    check, description, timeout=900, delay=0.5, max_delay=10, factor=2, quiet=False
+):
+    """
+    Poll check until it reports done, starting fast and backing off
+    exponentially up to max_delay.
+
+    :param check: function returning (done, state)
+    :param description: what is being waited on, used in messages
+    :param timeout: seconds before TimeoutError is raised
+    :return: the last state returned by check
+    """
+    deadline = time.monotonic() + timeout
+    last_state = None
+    while True:
+        done, state = check()
+        if done:
+            return state
+        if state != last_state and not quiet:
+            print(f"Waiting for {description}: {state}")
+        last_state = state
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(
+                f"Timed out after {timeout}s waiting for {description} (state: {state})"
+            )
+        time.sleep(delay)
+        delay = min(delay * factor, max_delay)
+
+
+def wait_all(*waits):
+    """
+    Run independent waits concurrently, each a function taking no arguments.
+    Returns their results in order and raises the first failure.
+    """
+    if not waits:
+        return []
+    with ThreadPoolExecutor(max_workers=len(waits)) as executor:
+        futures = [executor.submit(x) for x in waits]
+        return [future.result() for future in futures]
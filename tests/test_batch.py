@@ -0,0 +1,216 @@
+import types
+
+import pytest
+
+from red import batch
+
+CONFIG = {"Cpu": 1, "MemorySize": 2048, "StorageSize": 21, "Env": {"MODE": "prod"}}
+REPO_URI = "123456789012.dkr.ecr.us-east-1.amazonaws.com/proj"
+ROLE = "arn:aws:iam::123456789012:role/proj"
+
+
+class FakeBatch:
+    """
+    The job definition calls of the Batch API over in-memory revisions.
+    """
+
+    meta = types.SimpleNamespace(region_name="us-east-1")
+
+    def __init__(self):
+        self.definitions = []
+        self.registered = 0
+        self.deregistered = []
+
+    def describe_job_definitions(self, jobDefinitionName=None, status=None, **params):
+        if "jobDefinitions" in params:
+            arns = params["jobDefinitions"]
+            return {
+                "jobDefinitions": [
+                    x for x in self.definitions if x["jobDefinitionArn"] in arns
+                ]
+            }
+        return {
+            "jobDefinitions": [x for x in self.definitions if x["status"] == status]
+        }
+
+    def register_job_definition(self, tags, **params):
+        self.registered += 1
+        arn = f"arn:job-definition/proj:{self.registered}"
+        self.definitions.append(
+            {"jobDefinitionArn": arn, "status": "ACTIVE", "tags": tags}
+        )
+        return {"jobDefinitionArn": arn}
+
+    def deregister_job_definition(self, jobDefinition):
+        self.deregistered.append(jobDefinition)
+        for definition in self.definitions:
+            if definition["jobDefinitionArn"] == jobDefinition:
+                definition["status"] = "INACTIVE"
+
+
+def register(fake, monkeypatch, config):
+    monkeypatch.setattr(batch, "client", lambda service: fake)
+    return batch.register_job_definition("proj", REPO_URI, ROLE, "proj", config)
+
+
+def test_hash_ignores_key_order():
+    assert batch.job_definition_hash({"a": 1, "b": [1, 2]}) == (
+        batch.job_definition_hash({"b": [1, 2], "a": 1})
+    )
+    assert batch.job_definition_hash({"a": 1}) != batch.job_definition_hash({"a": 2})
+
+
+def test_unchanged_definition_is_not_registered_again(monkeypatch):
+    fake = FakeBatch()
+    register(fake, monkeypatch, CONFIG)
+    register(fake, monkeypatch, dict(CONFIG))
+    assert fake.registered == 1
+    assert fake.deregistered == []
+
+
+def test_changed_definition_replaces_the_active_revision(monkeypatch):
+    fake = FakeBatch()
+    register(fake, monkeypatch, CONFIG)
+    register(fake, monkeypatch, {**CONFIG, "MemorySize": 4096})
+    assert fake.registered == 2
+    assert fake.deregistered == ["arn:job-definition/proj:1"]
+    active = [x for x in fake.definitions if x["status"] == "ACTIVE"]
+    assert [x["jobDefinitionArn"] for x in active] == ["arn:job-definition/proj:2"]
+
+
+def test_env_changes_are_part_of_the_hash(monkeypatch):
+    fake = FakeBatch()
+    register(fake, monkeypatch, CONFIG)
+    register(fake, monkeypatch, {**CONFIG, "Env": {"MODE": "dev"}})
+    assert fake.registered == 2
+
+
+def test_default_is_a_single_fargate_environment():
+    assert batch.compute_environment_specs("proj", {}) == [
+        ("proj", {"Type": "FARGATE", "MaxvCpus": 100})
+    ]
+    assert not batch.uses_ec2("proj", {})
+
+
+def test_names_follow_type_and_keep_queue_order():
+    config = {
+        "ComputeEnvironments": [
+            {"Type": "fargate_spot", "MaxvCpus": 2000},
+            {"Type": "FARGATE", "MaxvCpus": 256},
+        ]
+    }
+    specs = batch.compute_environment_specs("proj", config)
+    assert [name for name, _ in specs] == ["proj-fargate-spot", "proj"]
+    assert specs[0][1] == {"Type": "FARGATE_SPOT", "MaxvCpus": 2000}
+
+
+def test_named_entries_of_the_same_type():
+    config = {
+        "ComputeEnvironments": [
+            {"Type": "SPOT", "Name": "big"},
+            {"Type": "SPOT", "Name": "small"},
+            {"Type": "EC2"},
+        ]
+    }
+    names = [name for name, _ in batch.compute_environment_specs("proj", config)]
+    assert names == ["proj-big", "proj-small", "proj-ec2"]
+    assert batch.uses_ec2("proj", config)
+
+
+def test_duplicate_names_are_rejected():
+    config = {"ComputeEnvironments": [{"Type": "SPOT"}, {"Type": "SPOT"}]}
+    with pytest.raises(ValueError, match="unique"):
+        batch.compute_environment_specs("proj", config)
+
+
+def test_fargate_and_ec2_can_not_be_mixed():
+    config = {"ComputeEnvironments": [{"Type": "FARGATE"}, {"Type": "EC2"}]}
+    with pytest.raises(ValueError, match="mix"):
+        batch.compute_environment_specs("proj", config)
+
+
+def test_unknown_types_are_rejected():
+    with pytest.raises(ValueError, match="Unknown"):
+        batch.compute_environment_specs(
+            "proj", {"ComputeEnvironments": [{"Type": "GPU"}]}
+        )
+
+
+EC2_SPEC = {"Type": "EC2", "MaxvCpus": 64, "InstanceTypes": ["c6i", "m6i"]}
+PROFILE = "arn:aws:iam::123456789012:instance-profile/proj_instance"
+
+
+def test_matching_resources_have_no_changes():
+    resources = batch.compute_resources(EC2_SPEC, {}, PROFILE, "proj-red")
+    # Batch reports its own order and adds launch template fields
+    current = {
+        **resources,
+        "instanceTypes": ["m6i", "c6i"],
+        "desiredvCpus": 12,
+        "launchTemplate": {
+            **resources["launchTemplate"],
+            "launchTemplateId": "lt-1",
+        },
+    }
+    assert batch._resource_changes(current, resources) == {}
+
+
+def test_changed_resources_are_updated():
+    resources = batch.compute_resources(
+        {**EC2_SPEC, "MaxvCpus": 256, "MinvCpus": 4}, {}, PROFILE
+    )
+    current = batch.compute_resources(EC2_SPEC, {}, PROFILE)
+    assert batch._resource_changes(current, resources) == {
+        "maxvCpus": 256,
+        "minvCpus": 4,
+    }
+
+
+class FakeComputeEnvironments:
+    exceptions = types.SimpleNamespace(ClientException=Exception)
+
+    def __init__(self, resources):
+        self.current = {
+            "computeEnvironmentName": "proj-ec2",
+            "computeEnvironmentArn": "arn:compute-environment/proj-ec2",
+            "status": "VALID",
+            "state": "ENABLED",
+            "tags": {batch.PROJECT_TAG: "proj"},
+            "computeResources": resources,
+        }
+        self.updates = []
+
+    def describe_compute_environments(self, computeEnvironments):
+        return {"computeEnvironments": [self.current]}
+
+    def update_compute_environment(self, computeEnvironment, **params):
+        self.updates.append(params)
+
+
+def ensure(fake, monkeypatch, spec):
+    monkeypatch.setattr(batch, "client", lambda service: fake)
+    return batch.ensure_compute_environment("proj", "proj-ec2", spec, ROLE, {}, PROFILE)
+
+
+def test_ec2_and_spot_switch_in_place(monkeypatch):
+    fake = FakeComputeEnvironments(batch.compute_resources(EC2_SPEC, {}, PROFILE))
+    ensure(fake, monkeypatch, {**EC2_SPEC, "Type": "SPOT"})
+    (update,) = fake.updates
+    assert update["computeResources"]["type"] == "SPOT"
+    assert update["computeResources"]["allocationStrategy"] == (
+        "SPOT_PRICE_CAPACITY_OPTIMIZED"
+    )
+
+
+@pytest.mark.parametrize("current, new", [("FARGATE", "EC2"), ("SPOT", "FARGATE")])
+def test_other_type_changes_are_rejected(monkeypatch, current, new):
+    fake = FakeComputeEnvironments({"type": current, "maxvCpus": 64})
+    with pytest.raises(ValueError, match="Rename the entry or run red kill"):
+        ensure(fake, monkeypatch, {"Type": new, "MaxvCpus": 64})
+    assert fake.updates == []
+
+
+def test_unchanged_environment_is_left_alone(monkeypatch):
+    fake = FakeComputeEnvironments(batch.compute_resources(EC2_SPEC, {}, PROFILE))
+    ensure(fake, monkeypatch, EC2_SPEC)
+    assert fake.updates == []
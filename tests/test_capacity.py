@@ -0,0 +1,80 @@
+import json
+import math
+from datetime import datetime, timezone
+
+from red import batch, capacity
+
+ARN = "arn:aws:batch:us-east-1:123456789012:compute-environment/proj-ec2"
+
+
+def tag_event(at, event_name, resource_arn=ARN, **params):
+    return {
+        "EventTime": datetime.fromtimestamp(at, timezone.utc),
+        "CloudTrailEvent": json.dumps(
+            {
+                "eventSource": "batch.amazonaws.com",
+                "requestParameters": {"resourceArn": resource_arn, **params},
+            }
+        ),
+    }
+
+
+class FakeCloudTrail:
+    def __init__(self, events):
+        self.events = events
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, LookupAttributes, StartTime):
+        event_name = LookupAttributes[0]["AttributeValue"]
+        yield {
+            "Events": [
+                event
+                for name, event in self.events
+                if name == event_name and event["EventTime"] >= StartTime
+            ]
+        }
+
+
+def changes(monkeypatch, events, since=0):
+    cloudtrail = FakeCloudTrail(events)
+    monkeypatch.setattr(capacity, "client", lambda service: cloudtrail)
+    return capacity._tag_changes(ARN, since)
+
+
+def test_tag_changes_of_the_compute_environment(monkeypatch):
+    events = [
+        ("TagResource", tag_event(100, "TagResource", tags={batch.WARM_TAG: "400"})),
+        ("UntagResource", tag_event(200, "UntagResource", tagKeys=[batch.WARM_TAG])),
+        ("TagResource", tag_event(300, "TagResource", tags={batch.WARM_TAG: "none"})),
+        # Other tags and other resources don't count
+        ("TagResource", tag_event(150, "TagResource", tags={"team": "data"})),
+        ("UntagResource", tag_event(250, "UntagResource", tagKeys=["team"])),
+        (
+            "TagResource",
+            tag_event(
+                120, "TagResource", resource_arn="other", tags={batch.WARM_TAG: "1"}
+            ),
+        ),
+    ]
+    assert changes(monkeypatch, events) == [(100, 400), (200, None), (300, math.inf)]
+    assert changes(monkeypatch, events, since=250) == [(300, math.inf)]
+
+
+def test_warm_windows_end_at_cool_rewarm_or_expiry():
+    found = capacity.warm_windows(
+        [(100, 400), (200, None), (300, 500), (450, math.inf)], since=0
+    )
+    assert found == [[100, 200], [300, 450], [450, math.inf]]
+    assert capacity.warm_windows([(100, 150)], since=0) == [[100, 150]]
+
+
+def test_warm_windows_started_before_since():
+    # A cool first means the environment was warm from before since
+    assert capacity.warm_windows([(100, None)], since=50) == [[50, 100]]
+    # Without any change the current tag tells
+    assert capacity.warm_windows([], since=50, tagged_until=math.inf) == [
+        [50, math.inf]
+    ]
+    assert capacity.warm_windows([], since=50) == []
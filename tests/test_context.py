@@ -0,0 +1,116 @@
+import os
+
+import pytest
+
+from red import context
+
+
+def patterns(*lines):
+    return [
+        (context._pattern_to_regex(x.lstrip("!")), x.startswith("!")) for x in lines
+    ]
+
+
+@pytest.mark.parametrize(
+    "path, lines, excluded",
+    [
+        ("data/big.csv", ["data"], True),
+        ("data/big.csv", ["*.csv"], False),
+        ("big.csv", ["*.csv"], True),
+        ("src/a/__pycache__/x.pyc", ["**/__pycache__"], True),
+        ("x.pyc", ["**/*.pyc"], True),
+        ("data/keep.csv", ["data", "!data/keep.csv"], False),
+        ("data/keep.csv", ["!data/keep.csv", "data"], True),
+        ("notes.md", ["note?.md"], True),
+        ("main.py", [], False),
+    ],
+)
+def test_is_excluded(path, lines, excluded):
+    assert context.is_excluded(path, patterns(*lines)) is excluded
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    monkeypatch.setattr(context, "cache_dir", lambda: str(cache))
+    root = tmp_path / "project"
+    root.mkdir()
+    (root / "Dockerfile").write_text("FROM python:3.13\nCOPY . .\n")
+    (root / "main.py").write_text("print('hello')\n")
+    (root / ".dockerignore").write_text("logs\n")
+    (root / "logs").mkdir()
+    (root / "logs" / "run.log").write_text("first\n")
+    return root
+
+
+def fingerprint(root, extra=None):
+    return context.fingerprint(str(root), str(root / "Dockerfile"), extra)
+
+
+def test_fingerprint_is_stable(project):
+    assert fingerprint(project) == fingerprint(project)
+
+
+def test_content_changes_change_the_fingerprint(project):
+    before = fingerprint(project)
+    (project / "main.py").write_text("print('bye')\n")
+    assert fingerprint(project) != before
+
+
+def test_excluded_files_do_not_change_the_fingerprint(project):
+    before = fingerprint(project)
+    (project / "logs" / "run.log").write_text("second\n")
+    (project / "logs" / "other.log").write_text("third\n")
+    assert fingerprint(project) == before
+
+
+def test_dockerfile_mode_and_settings_are_part_of_the_fingerprint(project):
+    before = fingerprint(project)
+    assert fingerprint(project, {"platform": "linux/arm64"}) != before
+    os.chmod(project / "main.py", 0o755)
+    assert fingerprint(project) != before
+    (project / "Dockerfile").write_text("FROM python:3.12\nCOPY . .\n")
+    assert fingerprint(project, None) != before
+
+
+def test_unchanged_files_are_not_hashed_again(project, monkeypatch):
+    fingerprint(project)
+    hashed = []
+    original = context._hash_file
+    monkeypatch.setattr(
+        context, "_hash_file", lambda p: hashed.append(p) or original(p)
+    )
+    fingerprint(project)
+    assert hashed == []
+    (project / "main.py").write_text("print('changed')\n")
+    fingerprint(project)
+    assert hashed == [str(project / "main.py")]
+
+
+def test_analyze_reports_what_the_build_sends(project):
+    (project / ".venv" / "lib").mkdir(parents=True)
+    (project / ".venv" / "lib" / "site.py").write_text("x" * 5000)
+    (project / "data").mkdir()
+    (project / "data" / "input.csv").write_text("y" * 2000)
+    report = context.analyze_context(str(project), str(project / "Dockerfile"))
+    files = {path for _, path in report["largest_files"]}
+    assert "logs/run.log" not in files
+    assert report["largest_files"][0] == (5000, ".venv/lib/site.py")
+    assert dict(report["largest_directories"])[".venv"] == 5000
+    assert report["file_count"] == len(files) == 5
+    assert ".venv" in report["ignore_suggestions"]
+
+
+def test_analyze_flags_copy_before_install(project):
+    (project / "Dockerfile").write_text(
+        "FROM python:3.13\nCOPY . .\nRUN pip install -r requirements.txt\n"
+    )
+    report = context.analyze_context(str(project), str(project / "Dockerfile"))
+    assert len(report["cache_warnings"]) == 1
+    assert "pip install" in report["cache_warnings"][0]
+
+
+def test_suggestions_are_appended_once(project):
+    content = context.suggested_dockerignore(str(project), ["logs", ".venv"])
+    assert content == "logs\n.venv\n"
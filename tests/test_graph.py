@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from red.graph import run_graph
+
+
+def test_steps_run_after_their_dependencies():
+    order = []
+    lock = threading.Lock()
+
+    def step(name, delay=0):
+        def run(inputs):
+            time.sleep(delay)
+            with lock:
+                order.append(name)
+            return name
+
+        return run
+
+    results, timings = run_graph(
+        {
+            "a": (step("a", 0.05), []),
+            "b": (step("b"), ["a"]),
+            "c": (step("c"), []),
+            "d": (step("d"), ["b", "c"]),
+        }
+    )
+    assert results == {"a": "a", "b": "b", "c": "c", "d": "d"}
+    assert order.index("a") < order.index("b") < order.index("d")
+    assert order.index("c") < order.index("d")
+    assert set(timings) == {"a", "b", "c", "d"}
+    assert timings["b"][0] >= timings["a"][1]
+
+
+def test_steps_receive_their_dependencies_results():
+    results, _ = run_graph(
+        {
+            "one": (lambda _: 1, []),
+            "two": (lambda _: 2, []),
+            "sum": (lambda r: r["one"] + r["two"], ["one", "two"]),
+        }
+    )
+    assert results["sum"] == 3
+
+
+def test_independent_steps_run_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+    run_graph({name: (lambda _: barrier.wait(), []) for name in "abc"})
+
+
+def test_failure_cancels_steps_not_started():
+    started = []
+
+    def fail(_):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        run_graph(
+            {
+                "fail": (fail, []),
+                "after": (lambda _: started.append("after"), ["fail"]),
+                "slow": (lambda _: time.sleep(0.1), []),
+                "after slow": (lambda _: started.append("after slow"), ["slow"]),
+            }
+        )
+    assert started == []
+
+
+def test_circular_dependencies_are_rejected():
+    with pytest.raises(ValueError, match="circular"):
+        run_graph({"a": (lambda _: None, ["b"]), "b": (lambda _: None, ["a"])})
+
+
+def test_unknown_dependencies_are_rejected():
+    with pytest.raises(ValueError, match="unknown"):
+        run_graph({"a": (lambda _: None, ["missing"])})
@@ -0,0 +1,122 @@
+import io
+import json
+
+from red import logs
+
+
+class Out(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+
+EVENTS = [
+    {"timestamp": 1704164645123, "message": "started\n"},
+    {"timestamp": 1704164645999, "message": "halfway"},
+    {"timestamp": 1704164646000, "message": 'said "done"\n'},
+]
+
+
+def test_text_lines_are_utc_with_milliseconds():
+    out = Out()
+    logs.write_events(EVENTS, "text", out=out)
+    assert out.getvalue().splitlines() == [
+        "2024-01-02 03:04:05.123 started",
+        "2024-01-02 03:04:05.999 halfway",
+        '2024-01-02 03:04:06.000 said "done"',
+    ]
+
+
+def test_jsonl_keeps_timestamp_and_message():
+    out = Out()
+    logs.write_events(EVENTS, "jsonl", out=out)
+    lines = [json.loads(x) for x in out.getvalue().splitlines()]
+    assert lines == [
+        {"timestamp": e["timestamp"], "message": e["message"]} for e in EVENTS
+    ]
+
+
+def test_events_are_written_in_batches():
+    out = Out()
+    events = ({"timestamp": i * 1000, "message": str(i)} for i in range(25))
+    logs.write_events(events, "text", out=out, batch_size=10)
+    assert len(out.getvalue().splitlines()) == 25
+    assert out.flushes == 3
+
+
+def test_no_events_write_nothing():
+    out = Out()
+    logs.write_events([], "jsonl", out=out)
+    assert out.getvalue() == ""
+    assert out.flushes == 0
+
+
+class FakeLogs:
+    """
+    get_log_events over in-memory streams, paged by limit like CloudWatch.
+    """
+
+    class exceptions:
+        class ResourceNotFoundException(Exception):
+            pass
+
+    def __init__(self, streams):
+        self.streams = streams
+        self.limits = set()
+
+    def get_log_events(self, logStreamName, limit, nextToken=None, **params):
+        if logStreamName not in self.streams:
+            raise self.exceptions.ResourceNotFoundException()
+        self.limits.add(limit)
+        events = self.streams[logStreamName]
+        start = int(nextToken or 0)
+        page = events[start : start + limit]
+        return {"events": page, "nextForwardToken": str(start + len(page))}
+
+
+def test_merge_orders_events_across_streams(monkeypatch, capsys):
+    streams = {
+        "job/a": [
+            {"timestamp": t * 1000, "message": f"a{t}"} for t in range(0, 600, 2)
+        ],
+        "job/b": [
+            {"timestamp": t * 1000, "message": f"b{t}"} for t in range(1, 600, 2)
+        ],
+        "job/c": [
+            {"timestamp": t * 1000, "message": f"c{t}"} for t in range(0, 600, 7)
+        ],
+    }
+    fake = FakeLogs(streams)
+    monkeypatch.setattr(logs, "client", lambda service: fake)
+    labels = [("a", "job/a"), ("b", "job/b"), ("c", "job/c")]
+    logs.merge_logs("proj", labels, output_format="text", concurrency=2)
+    lines = capsys.readouterr().out.splitlines()
+    expected = sorted(
+        (e["timestamp"], label, e["message"])
+        for label, name in labels
+        for e in streams[name]
+    )
+    assert [tuple(line.split()[2:]) for line in lines] == [
+        (label, message) for _, label, message in expected
+    ]
+    stamps = [line[:23] for line in lines]
+    assert stamps == sorted(stamps)
+
+
+def test_merge_pages_shrink_with_the_number_of_streams(monkeypatch, capsys):
+    streams = {f"job/{i}": [{"timestamp": i, "message": str(i)}] for i in range(2000)}
+    fake = FakeLogs(streams)
+    monkeypatch.setattr(logs, "client", lambda service: fake)
+    logs.merge_logs("proj", [(str(i), f"job/{i}") for i in range(2000)], "text")
+    assert fake.limits == {100}
+    assert len(capsys.readouterr().out.splitlines()) == 2000
+
+
+def test_merge_skips_missing_streams(monkeypatch, capsys):
+    fake = FakeLogs({"job/a": [{"timestamp": 1, "message": "only"}]})
+    monkeypatch.setattr(logs, "client", lambda service: fake)
+    logs.merge_logs("proj", [("a", "job/a"), ("gone", "job/gone")], "text")
+    assert capsys.readouterr().out.split()[-1] == "only"
@@ -0,0 +1,81 @@
+import io
+import sys
+import types
+
+import pytest
+
+from red import constants
+from red.staging import pack_shards, shard_items
+
+
+class FakeS3:
+    def __init__(self, body):
+        self.body = body
+        self.ranges = []
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = map(int, Range.removeprefix("bytes=").split("-"))
+        self.ranges.append((start, end))
+        return {"Body": io.BytesIO(self.body[start : end + 1])}
+
+
+@pytest.fixture
+def get_shard(monkeypatch):
+    """
+    get_shard from the generated main.py, reading from a FakeS3 holding
+    the staged input.
+    """
+
+    def load(body, index):
+        s3 = FakeS3(body)
+        boto3 = types.SimpleNamespace(client=lambda service, region_name: s3)
+        monkeypatch.setitem(sys.modules, "boto3", boto3)
+        monkeypatch.setenv("RED_MAP_BUCKET", "bucket")
+        monkeypatch.setenv("RED_MAP_KEY", "proj/map/input.json")
+        monkeypatch.setenv("RED_MAP_REGION", "us-east-1")
+        monkeypatch.setenv("AWS_BATCH_JOB_ARRAY_INDEX", str(index))
+        namespace = {}
+        exec(constants.BATCH_PYTHON, namespace)
+        return namespace["get_shard"], s3
+
+    return load
+
+
+@pytest.mark.parametrize("count, shards", [(10, 3), (3, 3), (7, 1), (1000, 64)])
+def test_shards_cover_items_in_order(count, shards):
+    items = list(range(count))
+    parts = shard_items(items, shards)
+    assert len(parts) == shards
+    assert [x for part in parts for x in part] == items
+    assert max(map(len, parts)) - min(map(len, parts)) <= 1
+
+
+def test_every_child_reads_its_own_shard(get_shard):
+    items = [f"s3://bucket/file-{i}.csv" for i in range(10)]
+    body = pack_shards(items, 4)
+    for index, expected in enumerate(shard_items(items, 4)):
+        read, _ = get_shard(body, index)
+        assert read() == expected
+
+
+def test_a_child_only_reads_its_offsets_and_shard(get_shard):
+    items = [{"id": i, "text": "x" * 100} for i in range(1000)]
+    body = pack_shards(items, 100)
+    read, s3 = get_shard(body, 42)
+    assert read() == items[420:430]
+    offsets, shard = s3.ranges
+    assert offsets == (16 * 42, 16 * 44 - 1)
+    assert shard[1] - shard[0] < len(body) / 50
+
+
+def test_unicode_items_keep_their_byte_offsets(get_shard):
+    items = ["ä", "日本", "🙂", "plain"]
+    body = pack_shards(items, 2)
+    assert get_shard(body, 1)[0]() == ["🙂", "plain"]
+
+
+def test_get_shard_without_a_staged_input(monkeypatch):
+    monkeypatch.delenv("RED_MAP_KEY", raising=False)
+    namespace = {}
+    exec(constants.BATCH_PYTHON, namespace)
+    assert namespace["get_shard"]() == []
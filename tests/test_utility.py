@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from red.utility import parse_duration, parse_time
+
+
+@pytest.mark.parametrize(
+    "value, seconds",
+    [("30s", 30), ("15m", 900), ("2h", 7200), ("7d", 604800), ("1w", 604800)],
+)
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == seconds
+
+
+@pytest.mark.parametrize("value", ["", "15", "m", "1.5h", "2 hours", "-1h", "3y"])
+def test_parse_duration_rejects_other_values(value):
+    assert parse_duration(value) is None
+
+
+def test_parse_time_relative():
+    now = datetime.now(timezone.utc).timestamp() * 1000
+    assert abs(parse_time("2h") - (now - 7200 * 1000)) < 5000
+
+
+def test_parse_time_iso():
+    assert parse_time("2024-01-02T03:04:05+00:00") == 1704164645000
+    # Naive datetimes are UTC
+    assert parse_time("2024-01-02T03:04:05") == 1704164645000
+    assert parse_time("2024-01-02T05:04:05+02:00") == 1704164645000
+
+
+def test_parse_time_none():
+    assert parse_time(None) is None
+
+
+def test_parse_time_invalid():
+    with pytest.raises(ValueError):
+        parse_time("yesterday")
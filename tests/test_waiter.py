@@ -0,0 +1,32 @@
+import pytest
+
+from red import waiter
+
+
+def test_wait_for_returns_the_final_state(monkeypatch):
+    monkeypatch.setattr(waiter.time, "sleep", lambda _: None)
+    states = iter([(False, "CREATING"), (False, "CREATING"), (True, "VALID")])
+    assert waiter.wait_for(lambda: next(states), "thing", quiet=True) == "VALID"
+
+
+def test_wait_for_backs_off(monkeypatch):
+    delays = []
+    monkeypatch.setattr(waiter.time, "sleep", delays.append)
+    states = iter([(False, "x")] * 6 + [(True, "done")])
+    waiter.wait_for(lambda: next(states), "thing", max_delay=4, quiet=True)
+    assert delays == [0.5, 1, 2, 4, 4, 4]
+
+
+def test_wait_for_times_out():
+    with pytest.raises(TimeoutError, match="thing"):
+        waiter.wait_for(lambda: (False, "PENDING"), "thing", timeout=0.01, quiet=True)
+
+
+def test_wait_all_keeps_order_and_raises():
+    assert waiter.wait_all(lambda: 1, lambda: 2) == [1, 2]
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        waiter.wait_all(lambda: 1, fail)